@@ -0,0 +1,215 @@
+import os
+
+from arnold import *
+
+import Events
+import Nodegraph
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+class ArnoldSession(object):
+	'''
+	Owns a single Arnold universe for the open scene. The file is only loaded
+	with AiASSLoad when Arnold is first needed (e.g. kick) and again when it
+	has changed on disk. Edits made in the graph since the scene was opened
+	are recorded and applied to the universe incrementally. Edited parameter
+	values are not, they reach the universe when the saved file is read again.
+	'''
+
+	def __init__(self):
+		self.active = False
+		self.filename = None
+		self.loadedStat = None
+		self.diverged = False
+		self.tracking = False
+		self.edits = []
+		self.numApplied = 0
+
+		Events.registerHandler(self.__nodeCreated, 'node_create')
+		Events.registerHandler(self.__portsConnected, 'port_connectBatch')
+		Events.registerHandler(self.__portsDisconnected, 'port_disconnectBatch')
+		Events.registerHandler(self.__nodeDeleted, 'node_delete')
+		Events.registerHandler(self.__nodeRenamed, 'node_rename')
+
+	def __stat(self, filename):
+		try:
+			stat = os.stat(filename)
+		except OSError:
+			return None
+		return stat.st_size, stat.st_mtime
+
+	def open(self, filename):
+		'''
+		Starts tracking edits for a scene which has just been populated from filename.
+		A universe holding the same unchanged file is kept as it is.
+		'''
+		if filename != self.filename or self.diverged or self.__stat(filename) != self.loadedStat:
+			self.close()
+
+		self.filename = filename
+		self.tracking = True
+		self.edits = []
+		self.numApplied = 0
+
+	def detach(self):
+		'''
+		The graph no longer shows the scene, the universe is kept in case it is re-opened
+		'''
+		self.tracking = False
+		self.edits = []
+		self.numApplied = 0
+
+	def close(self):
+		if self.active:
+			AiEnd()
+			self.active = False
+
+		self.filename = None
+		self.loadedStat = None
+		self.diverged = False
+		self.tracking = False
+		self.edits = []
+		self.numApplied = 0
+
+	def isLoaded(self):
+		return self.active and self.filename is not None
+
+	def saved(self, filename):
+		'''
+		The graph, including all edits, was written to filename. Called before the
+		edited parameters of the nodes are cleared.
+		'''
+		if not self.tracking: return
+		if self.active and Nodegraph.getEditedNodes():
+			# The universe lacks the edited values, so it must not pass for the file
+			self.loadedStat = None
+		elif self.active:
+			# The universe already matches what was written so there is nothing to re-read
+			self.__applyEdits()
+			self.loadedStat = self.__stat(filename)
+			self.diverged = False
+
+		self.filename = filename
+		self.edits = []
+		self.numApplied = 0
+
+	def sync(self):
+		'''
+		Makes the universe match the graph, loading the file only if needed
+		'''
+		if not self.tracking or self.filename is None: return False
+
+		stat = self.__stat(self.filename)
+		if not self.active or stat != self.loadedStat:
+			if self.active: AiEnd()
+			logger.info('Loading %s into the Arnold session' % self.filename)
+			AiBegin()
+			self.active = True
+			AiASSLoad(self.filename, AI_NODE_ALL)
+			self.loadedStat = stat
+			self.diverged = False
+			self.numApplied = 0
+
+		self.__applyEdits()
+		return True
+
+	def render(self):
+		if self.sync():
+			AiRender(AI_RENDER_MODE_CAMERA)
+
+	def write(self, filename):
+		if self.sync():
+			AiASSWrite(filename, AI_NODE_ALL, False)
+
+	def __nodeCreated(self, node):
+		if self.tracking:
+			self.edits.append(('create', node.getType(), node.getName()))
+
+	def __portsConnected(self, connections):
+		if self.tracking:
+			self.edits.extend(('connect',) + tuple(connection) for connection in connections)
+
+	def __portsDisconnected(self, connections):
+		if self.tracking:
+			self.edits.extend(('disconnect',) + tuple(connection) for connection in connections)
+
+	def __nodeDeleted(self, name):
+		if self.tracking:
+			self.edits.append(('delete', name))
+
+	def __nodeRenamed(self, name, newName):
+		if self.tracking:
+			self.edits.append(('rename', name, newName))
+
+	def __applyEdits(self):
+		for edit in self.edits[self.numApplied:]:
+			if edit[0] == 'create':
+				self.__createNode(*edit[1:])
+			elif edit[0] == 'connect':
+				self.__connect(*edit[1:])
+			elif edit[0] == 'disconnect':
+				self.__disconnect(*edit[1:])
+			elif edit[0] == 'delete':
+				self.__deleteNode(*edit[1:])
+			elif edit[0] == 'rename':
+				self.__renameNode(*edit[1:])
+
+		if self.numApplied < len(self.edits): self.diverged = True
+		self.numApplied = len(self.edits)
+
+	def __createNode(self, nodeType, nodeName):
+		if AiNodeLookUpByName(nodeName): return
+		aNode = AiNode(nodeType)
+		AiNodeSetStr(aNode, 'name', nodeName)
+
+	def __deleteNode(self, nodeName):
+		aNode = AiNodeLookUpByName(nodeName)
+		if aNode: AiNodeDestroy(aNode)
+
+	def __renameNode(self, nodeName, newName):
+		aNode = AiNodeLookUpByName(nodeName)
+		if aNode: AiNodeSetStr(aNode, 'name', newName)
+
+	def __setNodeArray(self, aInputNode, nodeTo, portIn):
+		# Node arrays are rebuilt from every connection the graph has for the port
+		node = Nodegraph.getNode(nodeTo)
+		input = node.getInputPort(portIn) if node is not None else None
+		connectedPorts = input.getConnectedPorts() if input is not None else []
+		connectedNodes = [AiNodeLookUpByName(port.getNode().getName()) for port in connectedPorts]
+		connectedNodes = [aNode for aNode in connectedNodes if aNode]
+		array = AiArrayAllocate(len(connectedNodes), 1, AI_TYPE_NODE)
+		for index, aNode in enumerate(connectedNodes):
+			AiArraySetPtr(array, index, aNode)
+		AiNodeSetArray(aInputNode, portIn, array)
+
+	def __disconnect(self, nodeFrom, portOut, nodeTo, portIn):
+		aInputNode = AiNodeLookUpByName(nodeTo)
+		if not aInputNode: return
+
+		param = AiNodeEntryLookUpParameter(AiNodeGetNodeEntry(aInputNode), portIn)
+		paramType = AiParamGetType(param) if param else AI_TYPE_NONE
+
+		if paramType == AI_TYPE_NODE:
+			AiNodeSetPtr(aInputNode, portIn, None)
+		elif paramType == AI_TYPE_ARRAY:
+			self.__setNodeArray(aInputNode, nodeTo, portIn)
+		else:
+			AiNodeUnlink(aInputNode, portIn)
+
+	def __connect(self, nodeFrom, portOut, nodeTo, portIn):
+		aOutputNode = AiNodeLookUpByName(nodeFrom)
+		aInputNode = AiNodeLookUpByName(nodeTo)
+		if not aOutputNode or not aInputNode: return
+
+		param = AiNodeEntryLookUpParameter(AiNodeGetNodeEntry(aInputNode), portIn)
+		paramType = AiParamGetType(param) if param else AI_TYPE_NONE
+
+		if paramType == AI_TYPE_NODE:
+			AiNodeSetPtr(aInputNode, portIn, aOutputNode)
+		elif paramType == AI_TYPE_ARRAY:
+			self.__setNodeArray(aInputNode, nodeTo, portIn)
+		else:
+			AiNodeLink(aOutputNode, portIn, aInputNode)
@@ -0,0 +1,194 @@
+import os
+import mmap
+import numpy as np
+
+import AssIO
+import AssParser
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+arrayDtypes = {
+	'BYTE': np.uint8, 'INT': np.int32, 'UINT': np.uint32, 'BOOL': np.bool_,
+	'USHORT': np.uint16, 'HALF': np.float16, 'FLOAT': np.float32,
+	'RGB': np.float32, 'RGBA': np.float32, 'VECTOR': np.float32, 'POINT': np.float32,
+	'VECTOR2': np.float32, 'POINT2': np.float32, 'MATRIX': np.float32
+}
+
+_mappings = {}
+
+_b85Powers = 85 ** np.arange(4, -1, -1, dtype=np.uint64)
+_whitespace = np.array([ord(c) for c in ' \t\r\n\f\v'], dtype=np.uint8)
+
+
+class StaleFileError(RuntimeError):
+	'''
+	Raised when a file changed on disk since the offsets into it were taken
+	'''
+
+
+def checkFileStat(filename, fileStat):
+	'''
+	Raises StaleFileError unless filename still has the (size, mtime) fileStat
+	'''
+	if fileStat is None: return
+	stat = os.stat(filename)
+	if (stat.st_size, stat.st_mtime) != fileStat:
+		raise StaleFileError('%s has changed on disk since it was indexed' % filename)
+
+
+def getMapping(filename, fileStat=None):
+	'''
+	Read-only memory map of a file, shared by every handle into that file.
+	Mappings are keyed by the (size, mtime) the offsets were taken from and
+	StaleFileError is raised when the file no longer has them, so a file
+	replaced on disk never gets read with stale offsets.
+	'''
+	key = (filename, fileStat)
+	try:
+		checkFileStat(filename, fileStat)
+	except StaleFileError:
+		mapping = _mappings.pop(key, None)
+		if mapping is not None: mapping.close()
+		raise
+
+	mapping = _mappings.get(key)
+	if mapping is None:
+		with open(filename, 'rb') as f:
+			mapping = _mappings[key] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+	return mapping
+
+
+def closeMappings(filename=None):
+	for key in list(_mappings):
+		if filename is None or key[0] == filename:
+			_mappings.pop(key).close()
+
+
+def decodeText(data, dtype):
+	if dtype == np.bool_:
+		words = np.array(data.split())
+		return np.in1d(words, ('1', 'true', 'on', 'yes'))
+
+	return np.fromstring(data, dtype=np.float64 if dtype.kind == 'f' else np.int64, sep=' ').astype(dtype)
+
+
+def decodeB85(chars, dtype):
+	'''
+	Decodes Arnold's base 85 encoding in bulk. Every group of five characters
+	from '!' onwards holds four bytes, 'z' stands for four zero bytes.
+
+	:param chars: uint8 array view of the encoded data
+	'''
+	chars = chars[~np.in1d(chars, _whitespace)]
+
+	# Expand each 'z' into '!!!!!' so every group is five characters wide
+	isZero = chars == ord('z')
+	if isZero.any():
+		chars = np.repeat(chars, np.where(isZero, 5, 1))
+		chars[chars == ord('z')] = ord('!')
+
+	padding = -len(chars) % 5
+	if padding:
+		chars = np.concatenate((chars, np.full(padding, ord('u'), dtype=np.uint8)))
+
+	groups = (chars.astype(np.uint64) - ord('!')).reshape(-1, 5)
+	words = groups.dot(_b85Powers).astype('>u4')
+	data = words.tobytes()
+	if padding: data = data[:-padding]
+
+	return np.frombuffer(data, dtype=np.dtype(dtype).newbyteorder('<'))
+
+
+class ArrayHandle(object):
+	'''
+	Lazy handle of an array parameter inside a memory mapped .ass file.
+	The header is enough to report the count, shape and dtype. Values are
+	decoded with NumPy only when materialise() or getStats() is called.
+	Compressed files cannot be mapped so their range is streamed instead.
+
+	:param filename: .ass file
+	:param ref: ArrayRef with the byte range of the values
+	:param fileStat: (size, mtime) of the file when ref was parsed
+	'''
+
+	__slots__ = ('filename', 'ref', 'fileStat', '__stats')
+
+	def __init__(self, filename, ref, fileStat=None):
+		self.filename = filename
+		self.ref = ref
+		self.fileStat = fileStat
+		self.__stats = None
+
+	def getType(self):
+		return self.ref.getBaseType()
+
+	def getCount(self):
+		return self.ref.getCount()
+
+	def getDtype(self):
+		return np.dtype(arrayDtypes.get(self.getType(), np.float32))
+
+	def getShape(self):
+		components = AssParser.arrayTypeComponents.get(self.getType(), 1)
+		shape = (self.ref.numElements, components) if components > 1 else (self.ref.numElements,)
+		if self.ref.numKeys > 1: shape = (self.ref.numKeys,) + shape
+		return shape
+
+	def getNumBytes(self):
+		return self.ref.end - self.ref.start
+
+	def __readCompressed(self):
+		with AssIO.openAss(self.filename) as assFile:
+			assFile.seek(self.ref.start)
+			return assFile.read(self.getNumBytes())
+
+	def materialise(self):
+		'''
+		Raises StaleFileError when the file changed since the handle was made,
+		the handle has to be made again from the file as it is now
+		'''
+		dtype = self.getDtype()
+		if AssIO.isCompressed(self.filename):
+			checkFileStat(self.filename, self.fileStat)
+			data = self.__readCompressed()
+			chars = np.frombuffer(data, dtype=np.uint8)
+		else:
+			mapping = getMapping(self.filename, self.fileStat)
+			chars = np.frombuffer(mapping, dtype=np.uint8, count=self.getNumBytes(), offset=self.ref.start)
+			data = None
+
+		if self.ref.isEncoded():
+			values = decodeB85(chars, dtype)
+		else:
+			values = decodeText(chars.tobytes() if data is None else data, dtype)
+
+		count = int(np.prod(self.getShape()))
+		if len(values) != count:
+			logger.warning('Expected %d values in %s but decoded %d' % (count, self.filename, len(values)))
+			return values
+
+		return values.reshape(self.getShape())
+
+	def getStats(self):
+		'''
+		Count and dtype come from the header, min/max are computed once and cached
+		'''
+		if self.__stats is None:
+			values = self.materialise()
+			valueRange = (values.min(), values.max()) if values.size else (None, None)
+			self.__stats = {
+				'count': self.getCount(), 'shape': self.getShape(), 'dtype': self.getDtype().name,
+				'min': valueRange[0], 'max': valueRange[1]
+			}
+
+		return self.__stats
+
+	def __len__(self):
+		return self.ref.numElements
+
+	def __str__(self):
+		return '%s[%s] %s' % (self.getType(), 'x'.join(map(str, self.getShape())), self.getDtype().name)
@@ -0,0 +1,162 @@
+import os
+import zlib
+import gzip
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+chunkSize = 1 << 20
+
+_magic = {
+	'gzip': '\x1f\x8b',
+	'zstd': '\x28\xb5\x2f\xfd'
+}
+
+_extensions = {
+	'.gz': 'gzip',
+	'.zst': 'zstd'
+}
+
+fileFilter = 'ASS file (*.ass *.ass.gz *.ass.zst)'
+
+
+def _zstandard():
+	try:
+		import zstandard
+	except ImportError:
+		raise RuntimeError('You need the zstandard module to read or write .zst files')
+
+	return zstandard
+
+
+class GzipReader(object):
+	'''
+	Streaming gzip decoder built directly on zlib, which decompresses whole
+	chunks rather than going through GzipFile's small internal reads.
+	Supports concatenated gzip members and forward seeks (backward seeks
+	restart the stream).
+
+	:param raw: compressed file object
+	'''
+
+	def __init__(self, raw):
+		self.raw = raw
+		self.__reset()
+
+	def __reset(self):
+		self.raw.seek(0)
+		self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+		self.buffer = ''
+		self.position = 0
+		self.eof = False
+
+	def read(self, size=-1):
+		if size is None or size < 0: size = float('inf')
+		parts, numBytes = [self.buffer], len(self.buffer)
+		while numBytes < size and not self.eof:
+			data = self.raw.read(chunkSize)
+			if not data:
+				parts.append(self.decompressor.flush())
+				self.eof = True
+				break
+
+			decoded = self.decompressor.decompress(data)
+			while self.decompressor.unused_data:
+				# Start of the next gzip member
+				unused = self.decompressor.unused_data
+				self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+				decoded += self.decompressor.decompress(unused)
+
+			parts.append(decoded)
+			numBytes += len(decoded)
+
+		data = ''.join(parts)
+		if size < len(data):
+			data, self.buffer = data[:int(size)], data[int(size):]
+		else:
+			self.buffer = ''
+
+		self.position += len(data)
+		return data
+
+	def tell(self):
+		return self.position
+
+	def seek(self, offset, whence=os.SEEK_SET):
+		if whence == os.SEEK_CUR: offset += self.position
+		elif whence != os.SEEK_SET: raise IOError('Compressed streams only support absolute and relative seeks')
+
+		if offset < self.position: self.__reset()
+		while self.position < offset:
+			if not self.read(min(chunkSize, offset - self.position)): break
+
+		return self.position
+
+	def close(self):
+		self.raw.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+
+def detectCompression(filename):
+	with open(filename, 'rb') as f:
+		header = f.read(4)
+
+	for compression, magic in _magic.iteritems():
+		if header.startswith(magic): return compression
+
+	return None
+
+
+def compressionFromExtension(filename):
+	return _extensions.get(os.path.splitext(filename)[1].lower())
+
+
+def wrapReader(raw, compression):
+	if compression == 'gzip':
+		return GzipReader(raw)
+	elif compression == 'zstd':
+		return _zstandard().ZstdDecompressor().stream_reader(raw, read_size=chunkSize)
+
+	return raw
+
+
+def openAss(filename, mode='rb', compression=None):
+	'''
+	Opens a plain, gzip or zstd compressed .ass file as a binary stream.
+	Reads detect the compression from the file contents, writes from the extension.
+	'''
+	if 'r' in mode:
+		if compression is None: compression = detectCompression(filename)
+		return wrapReader(open(filename, 'rb'), compression)
+
+	if compression is None: compression = compressionFromExtension(filename)
+	if compression == 'gzip':
+		return gzip.GzipFile(filename, 'wb', compresslevel=6)
+	elif compression == 'zstd':
+		return _zstandard().ZstdCompressor().stream_writer(open(filename, 'wb'))
+
+	return open(filename, 'wb')
+
+
+def isCompressed(filename):
+	return detectCompression(filename) is not None
+
+
+def copyRange(source, target, start, end):
+	'''
+	Copies bytes [start, end) of a source stream to a target stream in chunks
+	'''
+	source.seek(start)
+	remaining = end - start
+	while remaining > 0:
+		data = source.read(min(chunkSize, remaining))
+		if not data: break
+		target.write(data)
+		remaining -= len(data)
@@ -0,0 +1,172 @@
+import os
+import sys
+import functools
+from collections import OrderedDict
+
+import AssIO
+import AssParser
+import AssArray
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+class IndexEntry(object):
+	__slots__ = ('name', 'type', 'start', 'end', 'references', 'checksum')
+
+	def __init__(self, name, type, start, end, references, checksum=None):
+		self.name = name
+		self.type = type
+		self.start = start
+		self.end = end
+		self.references = references
+		self.checksum = checksum
+
+	def getSize(self):
+		return self.end - self.start
+
+	def getReferences(self):
+		return self.references
+
+
+class AssIndex(object):
+	'''
+	Byte-offset index of the node blocks in an .ass file. Each entry holds the
+	node name, type, byte range, a checksum of the block and the names it
+	references so the parameter body can be parsed later, one node at a time,
+	with a single seek.
+
+	:param filename: .ass file the offsets refer to
+	'''
+
+	def __init__(self, filename):
+		self.filename = filename
+		self.entries = OrderedDict()
+		self.fileStat = self.__stat()
+
+	def __stat(self):
+		try:
+			stat = os.stat(self.filename)
+		except OSError:
+			return None
+		return stat.st_size, stat.st_mtime
+
+	def build(self):
+		self.entries = OrderedDict()
+		self.fileStat = self.__stat()
+		with AssIO.openAss(self.filename) as assFile:
+			for block in AssParser.iterNodeBlocks(assFile):
+				self.add(block)
+
+		return self
+
+	def add(self, block, name=None):
+		if name is None: name = block.name or block.type
+		entry = IndexEntry(name, block.type, block.start, block.end, list(block.getReferences()), block.checksum)
+		self.entries[name] = entry
+		return entry
+
+	def getRecords(self):
+		'''
+		Plain tuples of the index, suitable for pickling
+		'''
+		return [(entry.name, entry.type, entry.start, entry.end, entry.references, entry.checksum)
+				for entry in self.entries.itervalues()]
+
+	@classmethod
+	def fromRecords(cls, filename, records):
+		index = cls(filename)
+		for record in records:
+			index.entries[record[0]] = IndexEntry(*record)
+
+		return index
+
+	def update(self, index):
+		'''
+		Takes over the entries of another index, e.g. of a newer version of the file.
+		Parameter sources bound to this index read from the new file from then on.
+		'''
+		self.filename = index.filename
+		self.entries = index.entries
+		self.fileStat = index.fileStat
+
+	def isStale(self):
+		return self.__stat() != self.fileStat
+
+	def getEntry(self, name):
+		return self.entries.get(name)
+
+	def getEntries(self):
+		return self.entries.values()
+
+	def getNames(self):
+		return self.entries.keys()
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __contains__(self, name):
+		return name in self.entries
+
+	def readBlock(self, name):
+		'''
+		Parses the full NodeBlock for a node, offsets are relative to the file
+		'''
+		for block in self.iterBlocks((name,)):
+			return block
+
+		return None
+
+	def iterBlocks(self, names):
+		'''
+		Yields the parsed NodeBlocks in file order so a batch of lookups is a
+		single forward pass, even through a compressed stream
+		'''
+		entries = sorted((self.entries[name] for name in names if name in self.entries), key=lambda entry: entry.start)
+		if not entries: return
+
+		if self.isStale():
+			logger.warning('%s has changed since it was indexed' % self.filename)
+
+		with AssIO.openAss(self.filename) as assFile:
+			tokenizer = AssParser.AssTokenizer(assFile)
+			for entry in entries:
+				tokenizer.seek(entry.start)
+				block = AssParser.readNodeBlock(tokenizer)
+				if block is not None: yield block
+
+	def attach(self, node, name):
+		'''
+		Makes a node read its parameters from the entry called name on first access
+		'''
+		node.properties['sourceName'] = name
+		node.setParameterSource(functools.partial(self.loadParameters, name))
+
+	def loadParameters(self, name, node):
+		block = self.readBlock(name)
+		if block is None: return
+		AssParser.applyParameters(node, block)
+		self.__setArrays(node, block)
+
+	def rebind(self, node, name):
+		'''
+		Points a node whose parameters were read already at the entry called name,
+		which holds the same block at other offsets. Its values, edits included, are kept.
+		'''
+		node.properties['sourceName'] = name
+		block = self.readBlock(name)
+		if block is not None: self.__setArrays(node, block)
+
+	def __setArrays(self, node, block):
+		# Array values stay in the file, the node only holds a handle into the memory map
+		edited = node.getEditedParameters()
+		for paramName, value in block.params.iteritems():
+			if isinstance(value, AssParser.ArrayRef) and paramName not in edited:
+				node.setParameter(paramName, 'ARRAY', None, AssArray.ArrayHandle(self.filename, value, self.fileStat), edited=False)
+
+
+if __name__ == '__main__':
+	for filename in sys.argv[1:]:
+		for entry in AssIndex(filename).build().getEntries():
+			print '%s\t%s\t%d\t%d' % (entry.name, entry.type, entry.start, entry.end)
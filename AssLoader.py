@@ -0,0 +1,90 @@
+import os
+import time
+import threading
+
+import PySide.QtCore as QtCore
+
+import AssIO
+import AssParser
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+class AssLoader(QtCore.QThread):
+	'''
+	Parses an .ass file on a worker thread and hands the node blocks to the
+	GUI thread in batches. The worker never touches Nodegraph or the view,
+	it only emits blocksParsed which is delivered through a queued connection.
+
+	At most maxBatchesInFlight batches wait on the GUI thread at any time, the
+	receiver calls batchDone() once a batch has been populated.
+
+	:param filename: .ass file to load
+	'''
+
+	blocksParsed = QtCore.Signal(object)
+	progressChanged = QtCore.Signal(int)
+
+	def __init__(self, filename, parent=None, batchSize=2000, batchInterval=0.05, maxBatchesInFlight=2):
+		super(AssLoader, self).__init__(parent)
+		self.filename = filename
+		self.batchSize = batchSize
+		self.batchInterval = batchInterval
+		self.cancelled = False
+		self.error = None
+		self.__inFlight = threading.Semaphore(maxBatchesInFlight)
+
+	def cancel(self):
+		self.cancelled = True
+
+	def isCancelled(self):
+		return self.cancelled
+
+	def batchDone(self):
+		self.__inFlight.release()
+
+	def __emitBatch(self, blocks):
+		# Back-pressure so a fast parse cannot flood the GUI thread with batches
+		while not self.__inFlight.acquire(False):
+			if self.cancelled: return False
+			time.sleep(0.005)
+
+		self.blocksParsed.emit(blocks)
+		return True
+
+	def run(self):
+		try:
+			self.__parse()
+		except Exception as e:
+			logger.exception('Failed to load %s' % self.filename)
+			self.error = e
+
+	def __parse(self):
+		fileSize = max(1, os.path.getsize(self.filename))
+		blocks = []
+		lastEmit = time.time()
+		lastProgress = -1
+
+		# Progress follows the compressed bytes read when the file is compressed
+		rawFile = open(self.filename, 'rb')
+		with AssIO.wrapReader(rawFile, AssIO.detectCompression(self.filename)) as assFile:
+			for block in AssParser.iterNodeBlocks(assFile):
+				if self.cancelled: return
+				blocks.append(block)
+
+				now = time.time()
+				if len(blocks) >= self.batchSize or now - lastEmit >= self.batchInterval:
+					if not self.__emitBatch(blocks): return
+					blocks, lastEmit = [], now
+
+					progress = min(100, int(100 * rawFile.tell() / fileSize))
+					if progress != lastProgress:
+						self.progressChanged.emit(progress)
+						lastProgress = progress
+
+		if blocks and not self.cancelled:
+			self.__emitBatch(blocks)
+
+		self.progressChanged.emit(100)
@@ -0,0 +1,583 @@
+import re
+import zlib
+from collections import OrderedDict
+
+import Events
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+# Number of components stored per element for each Arnold array type
+arrayTypeComponents = {
+	'BYTE': 1, 'INT': 1, 'UINT': 1, 'BOOL': 1, 'FLOAT': 1, 'HALF': 1, 'USHORT': 1,
+	'RGB': 3, 'RGBA': 4, 'VECTOR': 3, 'POINT': 3, 'VECTOR2': 2, 'POINT2': 2,
+	'MATRIX': 16, 'STRING': 1, 'NODE': 1, 'POINTER': 1, 'ENUM': 1, 'CLOSURE': 1
+}
+
+# Array types whose values are names rather than numbers
+nameArrayTypes = ('NODE', 'STRING', 'POINTER', 'ENUM')
+
+# Parameter types whose values name other nodes, and the ones whose values are only ever text
+referenceTypes = ('NODE', 'POINTER')
+textTypes = ('STRING', 'ENUM', 'BOOL')
+
+_tokenPattern = re.compile(r'[ \t\r\f\v]*(?:(\n)|("[^"]*"?)|(#[^\n]*)|([{}])|([^\s{}"#]+))')
+_wordPattern = re.compile(r'\s*(\S+)')
+_lineWordsPattern = re.compile(r'[ \t\r\f\v]*(\n)?\s*\S+[ \t\r\f\v]*([^\s#])?')
+_numberStart = frozenset('0123456789-+.')
+_nonReferences = frozenset(('true', 'false', 'on', 'off', 'yes', 'no'))
+_b85Alphabet = frozenset(map(chr, range(ord('!'), ord('u') + 1)) + ['z'])
+
+# Size in bytes of a single encoded component, used to measure b85 data
+_componentSizes = {'BYTE': 1, 'BOOL': 1, 'USHORT': 2, 'HALF': 2}
+
+
+class ArrayRef(object):
+	'''
+	Location of an array parameter's data inside the source file.
+	Only the header is kept in memory, the values stay on disk.
+	'''
+
+	__slots__ = ('numElements', 'numKeys', 'type', 'start', 'end')
+
+	def __init__(self, numElements, numKeys, type, start, end):
+		self.numElements = numElements
+		self.numKeys = numKeys
+		self.type = type
+		self.start = start
+		self.end = end
+
+	def isEncoded(self):
+		return self.type.startswith('b85')
+
+	def getBaseType(self):
+		return self.type[3:] if self.isEncoded() else self.type
+
+	def getCount(self):
+		return self.numElements * self.numKeys
+
+
+class NodeBlock(object):
+	'''
+	A single node block of an .ass file: its type, name, byte range and the
+	(short) parameter values. Array data is only referenced through ArrayRef.
+	'''
+
+	__slots__ = ('type', 'name', 'start', 'end', 'checksum', 'params', 'declarations', 'nodeArrays', 'ranges')
+
+	def __init__(self, type, start):
+		self.type = type
+		self.name = None
+		self.start = start
+		self.end = start
+		self.checksum = None
+		self.params = OrderedDict()
+		self.declarations = {}
+		self.nodeArrays = {}
+		# (paramName, start, end) of every parameter line in file order, paramName is None for declarations
+		self.ranges = []
+
+	def getReferences(self):
+		'''
+		Yields (paramName, name) for every value that may name another node: values
+		of NODE parameters and links on the others. Text parameters (STRING, ENUM,
+		BOOL) never refer to nodes, whatever their value. Whether the name actually
+		exists is decided once the whole file is known.
+		'''
+		for paramName, names in self.nodeArrays.iteritems():
+			for name in names:
+				yield paramName, name
+
+		nodeClass = None
+		for paramName, value in self.params.iteritems():
+			if paramName == 'name' or not isinstance(value, list) or len(value) != 1: continue
+			token = value[0]
+			if not token: continue
+
+			if nodeClass is None: nodeClass = getNodeClass(self.type) or False
+			paramType = self.getParameterType(nodeClass, paramName)
+			if paramType in textTypes: continue
+			# Any name may follow a NODE parameter, elsewhere numbers are values rather than links
+			if paramType not in referenceTypes and (token[0] in _numberStart or token in _nonReferences): continue
+			yield paramName, token
+
+	def getParameterType(self, nodeClass, paramName):
+		'''
+		:return: declared or registered type of a parameter, None if unknown
+		'''
+		declaration = self.declarations.get(paramName)
+		if declaration: return declaration[-1]
+		definition = nodeClass.registeredParameterMap.get(paramName) if nodeClass else None
+		return definition.getType() if definition is not None else None
+
+
+class AssTokenizer(object):
+	'''
+	Incremental tokenizer for .ass files which reads the stream in chunks.
+	After each call to next() the byte range of the token is available in
+	start/end and lineStart tells whether the token began a new line.
+
+	:param stream: file-like object opened in binary mode
+	'''
+
+	def __init__(self, stream, chunkSize=1 << 20):
+		self.stream = stream
+		self.chunkSize = chunkSize
+		self.buffer = ''
+		self.pos = 0
+		self.offset = 0
+		self.eof = False
+
+		self.start = self.end = 0
+		self.lineStart = True
+		self.__pushedBack = None
+
+		# Running CRC32 of the bytes from checksumStart onwards, see beginChecksum()
+		self.checksumStart = None
+		self.checksum = 0
+
+	def __fill(self):
+		if self.eof: return False
+		data = self.stream.read(self.chunkSize)
+		if not data:
+			self.eof = True
+			return False
+
+		self.__updateChecksum(self.offset + self.pos)
+		self.offset += self.pos
+		self.buffer = self.buffer[self.pos:] + data
+		self.pos = 0
+		return True
+
+	def seek(self, offset):
+		'''
+		Moves to an absolute offset, reusing the buffered data when possible
+		so forward seeks on compressed streams never restart the decoder.
+		'''
+		self.__pushedBack = None
+		self.lineStart = True
+		self.checksumStart = None
+		if self.offset <= offset <= self.offset + len(self.buffer):
+			self.pos = offset - self.offset
+			return
+
+		self.stream.seek(offset)
+		self.offset, self.buffer, self.pos, self.eof = offset, '', 0, False
+
+	def __updateChecksum(self, offset):
+		if self.checksumStart is None or offset <= self.checksumStart: return
+		data = self.buffer[self.checksumStart - self.offset:offset - self.offset]
+		self.checksum = zlib.crc32(data, self.checksum)
+		self.checksumStart = offset
+
+	def beginChecksum(self, offset):
+		'''
+		Starts checksumming the raw bytes from offset, which must still be buffered.
+		The checksum is folded in as chunks are discarded so any range size is fine.
+		'''
+		self.checksumStart = offset
+		self.checksum = 0
+
+	def endChecksum(self, offset):
+		self.__updateChecksum(offset)
+		self.checksumStart = None
+		return self.checksum & 0xffffffff
+
+	def pushBack(self, token):
+		self.__pushedBack = (token, self.start, self.end, self.lineStart)
+
+	def next(self):
+		if self.__pushedBack is not None:
+			token, self.start, self.end, self.lineStart = self.__pushedBack
+			self.__pushedBack = None
+			return token
+
+		lineStart = False
+		while True:
+			match = _tokenPattern.match(self.buffer, self.pos)
+			# Anything touching the end of the buffer may continue in the next chunk
+			if match is None or (match.end() == len(self.buffer) and not self.eof):
+				if self.__fill(): continue
+				if match is None: return None
+
+			self.pos = match.end()
+			if match.group(1) is not None:
+				lineStart = True
+				continue
+			if match.group(3) is not None:
+				continue
+
+			self.start, self.end = self.offset + match.start(match.lastindex), self.offset + self.pos
+			self.lineStart = lineStart
+			token = match.group(match.lastindex)
+			if match.lastindex == 2:
+				token = token.strip('"')
+			return token
+
+	def nextWord(self):
+		# Whitespace delimited word, ignoring quotes and comments (e.g. b85 encoded data)
+		while True:
+			match = _wordPattern.match(self.buffer, self.pos)
+			if match is None or (match.end() == len(self.buffer) and not self.eof):
+				if self.__fill(): continue
+				if match is None: return None
+
+			self.pos = match.end()
+			self.start, self.end = self.offset + match.start(1), self.offset + self.pos
+			return match.group(1)
+
+	def isParameterNext(self):
+		'''
+		True if the next word begins a line with more words on it, which is a
+		parameter rather than a line of encoded array data. Nothing is consumed.
+		'''
+		while True:
+			match = _lineWordsPattern.match(self.buffer, self.pos)
+			if match is None or (match.group(2) is None and match.end() == len(self.buffer) and not self.eof):
+				if self.__fill(): continue
+				if match is None: return False
+
+			return match.group(1) is not None and match.group(2) is not None
+
+	def rewindWord(self):
+		# Undo the last nextWord() call, the word is always still in the buffer
+		self.pos = self.start - self.offset
+
+	def skipWords(self, numWords):
+		'''
+		Skips numWords whitespace delimited words and returns the byte range they cover.
+		Whole chunks are counted with str.split so we avoid a Python loop per value.
+		'''
+		start = end = None
+		while numWords > 0:
+			if self.pos >= len(self.buffer) or not self.buffer[self.pos:].strip():
+				if not self.__fill(): break
+
+			# Only count up to the last whitespace so we never split a word in two
+			cut = len(self.buffer)
+			if not self.eof:
+				cut = max(self.buffer.rfind(c, self.pos) for c in ' \t\n')
+				if cut <= self.pos:
+					if self.__fill(): continue
+					cut = len(self.buffer)
+
+			segment = self.buffer[self.pos:cut]
+			count = len(segment.split())
+			if count and count <= numWords:
+				if start is None:
+					start = self.offset + self.pos + (len(segment) - len(segment.lstrip()))
+				end = self.offset + self.pos + len(segment.rstrip())
+				numWords -= count
+				self.pos = cut
+				continue
+
+			if not count:
+				self.pos = cut
+				continue
+
+			# The remaining words end inside this segment
+			for _ in xrange(numWords):
+				self.nextWord()
+				if start is None: start = self.start
+			end = self.end
+			numWords = 0
+
+		if start is None: start = end = self.offset + self.pos
+		return start, end
+
+
+def _isArrayHeader(values):
+	if len(values) != 3: return False
+	arrayType = values[2]
+	if arrayType.startswith('b85'): arrayType = arrayType[3:]
+	return arrayType in arrayTypeComponents and values[0].isdigit() and values[1].isdigit()
+
+
+def _encodedLength(numChars, numZeros):
+	# Number of bytes the b85 characters read so far decode to ('z' is shorthand for four zero bytes)
+	return numZeros * 4 + (numChars // 5) * 4 + max(0, numChars % 5 - 1)
+
+
+def _readArray(tokenizer, block, paramName, header):
+	numElements, numKeys, arrayType = int(header[0]), int(header[1]), header[2]
+	baseType = arrayType[3:] if arrayType.startswith('b85') else arrayType
+	count = numElements * numKeys * arrayTypeComponents[baseType]
+
+	if baseType in nameArrayTypes:
+		names = []
+		for _ in xrange(count):
+			names.append(tokenizer.next())
+		if baseType in referenceTypes:
+			block.nodeArrays[paramName] = names
+		else:
+			block.params[paramName] = names
+		return tokenizer.end
+
+	if arrayType != baseType:
+		start = end = None
+		numBytes = count * _componentSizes.get(baseType, 4)
+		numChars = numZeros = 0
+		while _encodedLength(numChars, numZeros) < numBytes:
+			# Short data must not swallow the parameters after it, whose names are valid b85 too
+			if tokenizer.isParameterNext(): break
+			word = tokenizer.nextWord()
+			if word is None: break
+			if not _b85Alphabet.issuperset(word):
+				# Malformed data, never read past the end of the block
+				tokenizer.rewindWord()
+				break
+			if start is None: start = tokenizer.start
+			end = tokenizer.end
+			zeros = word.count('z')
+			numZeros += zeros
+			numChars += len(word) - zeros
+		if start is None: start = end = tokenizer.end
+		if _encodedLength(numChars, numZeros) < numBytes:
+			logger.error('Parse error: %s of %s %s holds %d of %d bytes at byte %d' % (
+				paramName, block.type, block.name or '', _encodedLength(numChars, numZeros), numBytes, start))
+	else:
+		start, end = tokenizer.skipWords(count)
+
+	block.params[paramName] = ArrayRef(numElements, numKeys, arrayType, start, end)
+	return end
+
+
+def _readBlock(tokenizer, block):
+	while True:
+		paramName = tokenizer.next()
+		if paramName is None:
+			logger.warning('Unexpected end of file in %s block' % block.type)
+			block.checksum = tokenizer.endChecksum(block.end)
+			return block
+		if paramName == '}':
+			block.end = tokenizer.end
+			block.checksum = tokenizer.endChecksum(block.end)
+			return block
+
+		paramStart, end = tokenizer.start, tokenizer.end
+		if paramName == 'declare':
+			declaration = []
+			token = tokenizer.next()
+			while token is not None and not tokenizer.lineStart and token != '}':
+				declaration.append(token)
+				end = tokenizer.end
+				token = tokenizer.next()
+			tokenizer.pushBack(token)
+			if declaration: block.declarations[declaration[0]] = declaration[1:]
+			block.ranges.append((None, paramStart, end))
+			continue
+
+		values = []
+		token = tokenizer.next()
+		while token is not None and token != '}' and (not tokenizer.lineStart or token[:1] in _numberStart):
+			values.append(token)
+			end = tokenizer.end
+			if len(values) == 3 and _isArrayHeader(values):
+				end = _readArray(tokenizer, block, paramName, values)
+				values = None
+				break
+			token = tokenizer.next()
+
+		block.ranges.append((paramName, paramStart, end))
+		if values is None: continue
+		tokenizer.pushBack(token)
+
+		if paramName == 'name' and values:
+			block.name = values[0]
+		block.params[paramName] = values
+
+
+def readNodeBlock(tokenizer):
+	'''
+	Reads the next node block from a tokenizer, None at the end of the stream
+	'''
+	while True:
+		nodeType = tokenizer.next()
+		if nodeType is None: return None
+
+		start = tokenizer.start
+		tokenizer.beginChecksum(start)
+		if tokenizer.next() != '{':
+			logger.warning('Expected { after %s at byte %d' % (nodeType, start))
+			continue
+
+		return _readBlock(tokenizer, NodeBlock(nodeType, start))
+
+
+def iterNodeBlocks(stream):
+	'''
+	Generator which yields a NodeBlock for every node in an .ass stream.
+	Memory use is bounded by the largest node header rather than the file.
+	'''
+	tokenizer = AssTokenizer(stream)
+	while True:
+		block = readNodeBlock(tokenizer)
+		if block is None: return
+		yield block
+
+
+def convertValue(paramType, values):
+	if not values or isinstance(values, ArrayRef): return None
+	value = values[0]
+	try:
+		if paramType == 'INT':
+			return int(value)
+		elif paramType == 'FLOAT':
+			return float(value)
+		elif paramType == 'BOOL':
+			return value in ('true', 'on', '1', 'yes')
+		elif paramType in ('STRING', 'ENUM'):
+			return value
+	except ValueError:
+		return None
+
+	return None
+
+
+def getNodeClass(nodeType):
+	# Nodegraph is imported lazily as its registry needs Arnold while the parser does not
+	import Nodegraph
+	return Nodegraph.getNodeClass(nodeType)
+
+
+def getOutputPortName(nodeType):
+	nodeClass = getNodeClass(nodeType)
+	if nodeClass is None: return 'out'
+	outputPorts = nodeClass.registeredOutputPorts
+	return outputPorts[0] if outputPorts else 'out'
+
+
+def applyParameters(node, block):
+	# Only the values are stored on the node, the definitions stay shared with its type
+	for paramName, values in block.params.iteritems():
+		definition = node.getParameterDefinition(paramName)
+		if definition is None: continue
+		value = convertValue(definition.getType(), values)
+		if value is not None:
+			node.setParameterValue(paramName, value, edited=False)
+
+
+def populateNode(block, preview=False, applyValues=True):
+	'''
+	Creates the Nodegraph node for a NodeBlock and applies its scalar values
+	'''
+	import Nodegraph
+	nodeName = block.name or block.type
+	newNode = Nodegraph.createNode(block.type, nodeName, addRegisteredPorts=not preview)
+	if newNode is None: return None
+
+	if block.type != 'options':
+		newNode.addOutputPort(getOutputPortName(block.type))
+
+	if applyValues:
+		applyParameters(newNode, block)
+
+	return newNode
+
+
+def resolveReferences(references, nodeTypes):
+	'''
+	Turns candidate references into connections for names that exist in the scene.
+
+	:param references: iterable of (nodeName, paramName, referencedName)
+	:param nodeTypes: dict of node name to node type for every node in the scene
+	:return: list of (nodeFrom, portOut, nodeTo, portIn) tuples
+	'''
+	connections = []
+	for nodeName, paramName, name in references:
+		if name not in nodeTypes:
+			# Component links, e.g. image1.r
+			name = name.rsplit('.', 1)[0]
+			if name not in nodeTypes: continue
+
+		connections.append((name, getOutputPortName(nodeTypes[name]), nodeName, paramName))
+
+	return connections
+
+
+class SceneBuilder(object):
+	'''
+	Populates Nodegraph from NodeBlocks which may arrive in several batches.
+	Connections are queued as soon as both ends exist, references to nodes
+	further down the file are kept until those nodes arrive.
+
+	When an AssIndex is given the blocks are recorded in it and parameter
+	values are only parsed once a node's parameters are first accessed.
+
+	:param preview: only add the ports which are connected
+	:param index: optional AssIndex of the file being loaded
+	:param store: optional GraphStore which gets the nodes and connections as well
+	'''
+
+	def __init__(self, preview=False, index=None, store=None):
+		self.preview = preview
+		self.index = index
+		self.store = store
+		self.nodeTypes = {}
+		self.pending = {}
+
+	def addBlocks(self, blocks, indexed=False):
+		'''
+		:param blocks: NodeBlocks, or IndexEntries already in the index when indexed is set
+		'''
+		references = []
+		for block in blocks:
+			node = self.addNode(block, indexed)
+			if node is None: continue
+
+			nodeName = node.getName()
+			references.extend(self.pending.pop(nodeName, ()))
+			for paramName, name in block.getReferences():
+				if name in self.nodeTypes or name.rsplit('.', 1)[0] in self.nodeTypes:
+					references.append((nodeName, paramName, name))
+				else:
+					self.pending.setdefault(name, []).append((nodeName, paramName, name))
+
+		self.__connect(resolveReferences(references, self.nodeTypes))
+
+	def addNode(self, block, indexed=False):
+		'''
+		Creates the node for a single block without connecting it
+		'''
+		node = populateNode(block, self.preview, applyValues=self.index is None)
+		if node is None: return None
+
+		nodeName = node.getName()
+		if self.index is not None:
+			if not indexed: self.index.add(block, nodeName)
+			self.index.attach(node, nodeName)
+		if self.store is not None and not self.store.hasNode(nodeName):
+			self.store.addNode(nodeName, node.getType(), node.getBaseType())
+		self.nodeTypes[nodeName] = block.type
+		return node
+
+	def finish(self):
+		# Whatever is still pending is either a component link or not a node at all
+		references = [reference for references in self.pending.itervalues() for reference in references]
+		self.pending = {}
+		self.__connect(resolveReferences(references, self.nodeTypes))
+
+	def __connect(self, connections):
+		import Nodegraph
+		for nodeFrom, portOut, nodeTo, portIn in connections:
+			Nodegraph.getNode(nodeTo).addInputPort(portIn)
+
+		Nodegraph.connectPorts(connections)
+		if self.store is not None:
+			for connection in connections:
+				self.store.connect(*connection)
+
+
+def loadAssFile(stream, preview=False):
+	'''
+	Streams the node blocks of an .ass file into Nodegraph and queues the
+	port connections once every node name in the file is known.
+	'''
+	builder = SceneBuilder(preview)
+	for block in iterNodeBlocks(stream):
+		builder.addBlocks((block,))
+
+	builder.finish()
+	return len(builder.nodeTypes)
@@ -1,4 +1,5 @@
 import sys, os
+import re
 import functools
 import PySide.QtGui as QtGui
 import PySide.QtCore as QtCore
@@ -6,22 +7,71 @@ import PySide.QtCore as QtCore
 from arnold import *
 
 import Nodegraph
+import AssIO
+import AssParser
+import AssArray
+import AssWriter
+import SceneCache
+import SceneDiff
+import RegistryCache
 import Events
+import EventStats
+import EventReplay
 import Style
 
+from AssLoader import AssLoader
+from EventPump import EventPump
+from AssIndex import AssIndex
+from ArnoldSession import ArnoldSession
+from FileWatcher import FileWatcher
+from GraphQuery import GraphQuery
+
 from NodegraphPanel import NodegraphPanel
 from ParameterPanel import ParameterPanel
 
+import logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+# Frame number right before the extension, e.g. shot.0101.ass.gz
+_framePattern = re.compile(r'^(.*?)(\d+)(\.ass(?:\.gz|\.zst)?)$')
+
 
 class NodeWindow(QtGui.QMainWindow):
 	def __init__(self, parent=None):
 		super(NodeWindow, self).__init__(parent)
 		self.setWindowTitle('ASS Node Viewer')
+
+		# Events queued outside an explicit processEvents() (e.g. from worker threads) are dispatched in time slices
+		self.eventPump = EventPump(self)
+		if os.environ.get('ASSVIEWER_EVENT_STATS', '0') not in ('0', 'off', 'false'):
+			Events.setStats(EventStats.EventStats(trace=True))
+
 		self.openFilename = None
 		self.docks = {}
+		self.loader = None
+		self.sceneBuilder = None
+		self.assIndex = None
+		self.preview = False
+		self.arnoldSession = ArnoldSession()
+		self.reloadPending = False
+		self.eventsFilename = None
+		self.graphQuery = GraphQuery()
+
+		# Optional live reload when an exporter rewrites the open file
+		self.fileWatcher = FileWatcher(self)
+		self.fileWatcher.fileChanged.connect(self.__watchedFileChanged)
 
 		self.initUi()
 
+		# Node types are registered from a cache, a stale one is refreshed by a separate process
+		self.registryTimer = QtCore.QTimer(self)
+		self.registryTimer.setInterval(500)
+		self.registryTimer.timeout.connect(self.__pollRegistryRefresh)
+		if RegistryCache.isRefreshing(): self.registryTimer.start()
+		Events.registerHandler(self.__registryUpdated, 'registry_update')
+
 	def initUi(self):
 		self.setMinimumSize(500, 250)
 		self.resize(800, 500)
@@ -43,6 +93,19 @@ class NodeWindow(QtGui.QMainWindow):
 
 		self.setStyleSheet(Style.css)
 		self.initialiseMenu()
+		self.initialiseStatusBar()
+
+	def initialiseStatusBar(self):
+		self.progressBar = QtGui.QProgressBar()
+		self.progressBar.setRange(0, 100)
+		self.progressBar.setMaximumWidth(200)
+		self.cancelButton = QtGui.QPushButton('Cancel')
+		self.cancelButton.clicked.connect(self.cancelLoad)
+
+		self.statusBar().addPermanentWidget(self.progressBar)
+		self.statusBar().addPermanentWidget(self.cancelButton)
+		self.progressBar.hide()
+		self.cancelButton.hide()
 
 	def addWidget(self, widget, dockName, area=QtCore.Qt.LeftDockWidgetArea):
 		self.docks[dockName] = widget
@@ -75,6 +138,24 @@ class NodeWindow(QtGui.QMainWindow):
 			'tip': 'This visualises the nodes using minimal number of ports',
 			'cmd': self.openAssFile, 'args': [None, True]
 		})
+		self.addMenuItem({
+			'menu': 'File', 'item': 'Reload',
+			'tip': 'Applies what changed in the file on disk to the graph',
+			'shortcut': 'Ctrl+R',
+			'cmd': self.reloadAssFile, 'args': [None]
+		})
+		self.addMenuItem({
+			'menu': 'File', 'item': 'Next Frame',
+			'tip': 'Reloads the next file of a numbered sequence',
+			'shortcut': 'Ctrl+Right',
+			'cmd': self.stepFrame, 'args': [1]
+		})
+		self.addMenuItem({
+			'menu': 'File', 'item': 'Previous Frame',
+			'tip': 'Reloads the previous file of a numbered sequence',
+			'shortcut': 'Ctrl+Left',
+			'cmd': self.stepFrame, 'args': [-1]
+		})
 		self.addMenuItem({
 			'menu': 'File', 'item': 'Save...',
 			'tip': '',
@@ -82,6 +163,12 @@ class NodeWindow(QtGui.QMainWindow):
 		})
 
 		viewMenu = self.getOrCreateMenu('View')
+		self.addMenuItem({
+			'menu': 'View', 'item': 'Watch File',
+			'tip': 'Reloads what changed whenever the open file is written to',
+			'checkable': True, 'checked': self.fileWatcher.isEnabled(),
+			'cmd': self.fileWatcher.setEnabled
+		})
 
 		self.getOrCreateMenu('Tools')
 		self.addMenuItem({
@@ -92,23 +179,83 @@ class NodeWindow(QtGui.QMainWindow):
 			'menu': 'Tools', 'item': '&Position Nodes',
 			'cmd': self.nodeGraphPanel.nodeGraphView.positionNodes, 'args': [] # TODO: Refactor using Events
 		})
+		self.addMenuItem({
+			'menu': 'Tools', 'item': 'Select Upstream',
+			'tip': 'Adds every node feeding into the selection to it',
+			'cmd': self.selectConnected, 'args': [True]
+		})
+		self.addMenuItem({
+			'menu': 'Tools', 'item': 'Select Downstream',
+			'tip': 'Adds every node the selection feeds into to it',
+			'cmd': self.selectConnected, 'args': [False]
+		})
+		self.addMenuItem({
+			'menu': 'Tools', 'item': 'Use Scene Cache',
+			'tip': 'Re-open unchanged files from a cache of the parsed scene and its layout',
+			'checkable': True, 'checked': SceneCache.isEnabled(),
+			'cmd': SceneCache.setEnabled
+		})
+		self.addMenuItem({
+			'menu': 'Tools', 'item': 'Clear Scene Cache',
+			'cmd': SceneCache.clear, 'args': []
+		})
+		self.addMenuItem({
+			'menu': 'Tools', 'item': 'Record Event Statistics',
+			'tip': 'Measures the event handlers, including a trace for chrome://tracing',
+			'checkable': True, 'checked': Events.getStats() is not None,
+			'cmd': self.recordEventStats
+		})
+		self.addMenuItem({
+			'menu': 'Tools', 'item': 'Event Statistics...',
+			'cmd': self.showEventStats, 'args': []
+		})
+		self.recordEventsAction = self.addMenuItem({
+			'menu': 'Tools', 'item': 'Record Events',
+			'tip': 'Records the events between the graph and the views for EventReplay.py',
+			'checkable': True, 'checked': False,
+			'cmd': self.recordEvents
+		})
 
 		self.getOrCreateMenu('Add Node')
+		self.__populateAddNodeMenu()
+
+	def __populateAddNodeMenu(self):
+		# Only the group submenus are made here, their actions are added the first time they open
 		nodeGroups = {}
-		nodes = Nodegraph.getRegisteredNodes()
-		for nodeName, nodeInfo in nodes.iteritems():
+		for nodeName, nodeInfo in Nodegraph.getRegisteredNodes().iteritems():
 			nodeGroups.setdefault(nodeInfo['baseType'], []).append(nodeName)
 
-		for groupName, nodeNames in nodeGroups.iteritems():
-			if not nodeNames: continue
-			self.getOrCreateMenu(groupName, parent='Add Node')
+		for groupName in sorted(nodeGroups):
+			groupMenu = self.getOrCreateMenu(groupName, parent='Add Node')
+			groupMenu.aboutToShow.connect(functools.partial(self.__fillAddNodeGroup, groupName, nodeGroups[groupName]))
+
+	def __fillAddNodeGroup(self, groupName, nodeNames):
+		groupMenu = self.menus.get(groupName)
+		if groupMenu is None or groupMenu.actions(): return
+
+		for nodeName in sorted(nodeNames):
+			action = groupMenu.addAction(nodeName)
+			action.triggered.connect(functools.partial(Nodegraph.createNode, nodeName, None, False))
 
-			nodeNames.sort()
-			for nodeName in nodeNames:
-				self.addMenuItem({
-					'menu': groupName, 'item': nodeName,
-					'cmd': Nodegraph.createNode, 'args': [nodeName, None, False]
-				})
+	def __clearAddNodeMenu(self):
+		addNodeMenu = self.menus['Add Node']
+		for action in addNodeMenu.actions():
+			if action.menu() is not None: del self.menus[action.menu().title()]
+		addNodeMenu.clear()
+
+	def __pollRegistryRefresh(self):
+		entries = RegistryCache.pollRefresh()
+		if entries is None:
+			if not RegistryCache.isRefreshing(): self.registryTimer.stop()
+			return
+
+		self.registryTimer.stop()
+		Nodegraph.updateRegistry(entries)
+		Events.processEvents()
+
+	def __registryUpdated(self):
+		self.__clearAddNodeMenu()
+		self.__populateAddNodeMenu()
 
 	def getOrCreateMenu(self, menu, parent=None):
 		if not self.menus.has_key(menu):
@@ -125,6 +272,9 @@ class NodeWindow(QtGui.QMainWindow):
 		action = QtGui.QAction(menu_dict['item'], self)
 		if 'shortcut' in menu_dict: action.setShortcut(menu_dict['shortcut'])
 		if 'tip' in menu_dict: action.setStatusTip(menu_dict['tip'])
+		if 'checkable' in menu_dict:
+			action.setCheckable(menu_dict['checkable'])
+			action.setChecked(menu_dict.get('checked', False))
 		cmd = eval(menu_dict['cmd']) if isinstance(menu_dict['cmd'], str) else menu_dict['cmd']
 		if 'args' in menu_dict:
 			cmd = functools.partial(cmd, *menu_dict['args'])
@@ -140,172 +290,394 @@ class NodeWindow(QtGui.QMainWindow):
 
 	def kick(self):
 		if self.openFilename:
-			AiBegin()
-			AiASSLoad(self.openFilename, AI_NODE_ALL)
-			AiRender(AI_RENDER_MODE_CAMERA)
-			AiEnd()
+			# The session only re-reads the file if it changed, edits are applied incrementally
+			self.arnoldSession.render()
 
 			# import subprocess
 			# cmd = ['kick', self.openFilename]
 			# subprocess.call(cmd, env=os.environ.copy())
 
+	def selectConnected(self, upstream=True):
+		nodeGraphView = self.nodeGraphPanel.nodeGraphView
+		selected = nodeGraphView.getSelectedNames()
+		getConnected = self.graphQuery.getUpstream if upstream else self.graphQuery.getDownstream
+
+		names = set(selected)
+		for name in selected:
+			names.update(getConnected(name))
+
+		nodeGraphView.selectNodes(names)
+		Events.queueEvent('node_select', names=nodeGraphView.getSelectedNames())
+		Events.processEvents()
+
+	def recordEventStats(self, state):
+		Events.setStats(EventStats.EventStats(trace=True) if state else None)
+
+	def recordEvents(self, state):
+		recorder = Events.getRecorder()
+		if state and recorder is None:
+			fileName, desc = QtGui.QFileDialog.getSaveFileName(self, 'Record events', '%s' % os.environ['HOME'],
+															   'Event recordings (*.events)')
+			if not fileName:
+				self.recordEventsAction.setChecked(False)
+				return
+
+			self.eventsFilename = fileName
+			Events.setRecorder(EventReplay.EventRecorder())
+		elif not state and recorder is not None:
+			Events.setRecorder(None)
+			recorder.save(self.eventsFilename)
+			self.statusBar().showMessage('Recorded %d events to %s' % (recorder.getNumEvents(), self.eventsFilename), 5000)
+
+	def showEventStats(self):
+		stats = Events.getStats()
+		if stats is None:
+			QtGui.QMessageBox.information(self, 'Event Statistics', 'Enable Tools > Record Event Statistics first')
+			return
+
+		dialog = QtGui.QDialog(self)
+		dialog.setWindowTitle('Event Statistics')
+		dialog.resize(900, 500)
+		layout = QtGui.QVBoxLayout(dialog)
+
+		text = QtGui.QPlainTextEdit(stats.formatTable(), dialog)
+		text.setReadOnly(True)
+		text.setLineWrapMode(QtGui.QPlainTextEdit.NoWrap)
+		text.setFont(QtGui.QFont('monospace'))
+		layout.addWidget(text)
+
+		buttons = QtGui.QDialogButtonBox(QtGui.QDialogButtonBox.Close, parent=dialog)
+		exportButton = buttons.addButton('Export Trace...', QtGui.QDialogButtonBox.ActionRole)
+		resetButton = buttons.addButton('Reset', QtGui.QDialogButtonBox.ResetRole)
+		exportButton.clicked.connect(functools.partial(self.__exportEventTrace, stats))
+		resetButton.clicked.connect(lambda: (stats.reset(), text.setPlainText(stats.formatTable())))
+		buttons.rejected.connect(dialog.close)
+		layout.addWidget(buttons)
+
+		dialog.show()
+
+	def __exportEventTrace(self, stats):
+		fileName, desc = QtGui.QFileDialog.getSaveFileName(self, 'Export event trace', '%s' % os.environ['HOME'],
+														   'Chrome trace (*.json)')
+		if fileName: stats.writeChromeTrace(fileName)
+
+	def closeEvent(self, event):
+		self.cancelLoad()
+		self.__cacheScene()
+		self.arnoldSession.close()
+		if Events.getRecorder() is not None: self.recordEvents(False)
+		super(NodeWindow, self).closeEvent(event)
+
 	def new(self):
+		self.__cacheScene()
+		self.arnoldSession.detach()
 		Nodegraph.clearNodes()
-		self.openFilename = None
+		self.__setOpenFilename(None)
+		self.assIndex = None
+		AssArray.closeMappings()
 		Events.processEvents()
 
+	def __setOpenFilename(self, filename):
+		self.openFilename = filename
+		if filename != self.fileWatcher.filename:
+			self.fileWatcher.setFilename(filename)
+
+	def __watchedFileChanged(self, filename):
+		if self.loader is not None:
+			# Written to while being loaded, diff against what was read once the load is done
+			self.reloadPending = True
+			return
+
+		if filename != self.openFilename: return
+		if Nodegraph.getEditedNodes() and not self.__confirmReload(filename): return
+		self.reloadAssFile(filename)
+
+	def __confirmReload(self, filename):
+		'''
+		An external write must not replace unsaved edits without asking
+		'''
+		names = sorted(node.getName() for node in Nodegraph.getEditedNodes())
+		box = QtGui.QMessageBox(QtGui.QMessageBox.Question, 'Reload file',
+								'%s has changed on disk.' % os.path.basename(filename), parent=self)
+		box.setInformativeText('Parameters of %s were edited and not saved. Reloading keeps the edited values '
+							   'over the ones in the file.' % ', '.join(names[:10] + (['...'] if len(names) > 10 else [])))
+		reloadButton = box.addButton('Reload', QtGui.QMessageBox.AcceptRole)
+		box.addButton('Keep Editing', QtGui.QMessageBox.RejectRole)
+		box.exec_()
+
+		if box.clickedButton() is reloadButton: return True
+		self.statusBar().showMessage('%s changed on disk and was not reloaded' % os.path.basename(filename), 5000)
+		return False
+
 	def saveAssFile(self, assFilename=None):
 		if assFilename is None:
 			fileName, desc = QtGui.QFileDialog.getSaveFileName(self, 'Save file', '%s' % os.environ['HOME'],
-															   'ASS file (*.ass)')
+															   AssIO.fileFilter)
 			if not fileName: return
 			assFilename = fileName
 
-		self.__traverseAndSaveAssFile(assFilename)
-		self.openFilename = assFilename
+		try:
+			self.__traverseAndSaveAssFile(assFilename)
+		except AssWriter.SourceChangedError as e:
+			if not self.__saveChangedSource(assFilename, e): return
+		except (IOError, OSError) as e:
+			QtGui.QMessageBox.warning(self, 'Save file', 'Failed to save %s:\n%s' % (assFilename, e))
+			return
+
+		self.__setOpenFilename(assFilename)
+		# Our own write is not a change to reload
+		self.fileWatcher.acknowledge()
+		self.arnoldSession.saved(assFilename)
+		# The edited values are in the file now, a reload no longer has anything to keep
+		for node in Nodegraph.getEditedNodes():
+			node.clearEditedParameters()
+
+	def __saveChangedSource(self, assFilename, error):
+		'''
+		Asks what to do when the file the graph was loaded from changed on disk
+
+		:return: True if the graph was written
+		'''
+		box = QtGui.QMessageBox(QtGui.QMessageBox.Warning, 'Save file', str(error), parent=self)
+		box.setInformativeText('Reload it to pick up the changes, or write the whole graph. '
+							   'Nodes which were not inspected are then taken from the file as it is now.')
+		reloadButton = box.addButton('Reload', QtGui.QMessageBox.AcceptRole)
+		writeButton = box.addButton('Write Everything', QtGui.QMessageBox.DestructiveRole)
+		box.addButton(QtGui.QMessageBox.Cancel)
+		box.exec_()
+
+		if box.clickedButton() is reloadButton:
+			self.reloadAssFile()
+			return False
+		if box.clickedButton() is not writeButton:
+			return False
+
+		# Index the file as it is now so the untouched nodes are copied from the right ranges
+		AssArray.closeMappings(self.assIndex.filename)
+		try:
+			self.assIndex.build()
+			self.__rebindNodes()
+			self.__traverseAndSaveAssFile(assFilename)
+		except (IOError, OSError, RuntimeError) as e:
+			QtGui.QMessageBox.warning(self, 'Save file', 'Failed to save %s:\n%s' % (assFilename, e))
+			return False
+
+		return True
 
 	def __traverseAndSaveAssFile(self, assFilename):
-		AiBegin()
-		nodes = Nodegraph.getNodes()
-		for node in nodes:
-			aNode = AiNode(node.getType())
-			AiNodeSetStr(aNode, "name", node.getName())
-
-		for node in nodes:
-			aInputNode = AiNodeLookUpByName(node.getName())
-			inputs = node.getInputPorts()
-			for inputName, input in inputs.iteritems():
-				connectedPorts = input.getConnectedPorts()
-				for outputPort in connectedPorts:
-					outputNode = outputPort.getNode()
-					aOutputNode = AiNodeLookUpByName(outputNode.getName())
-
-					a = AiNodeGetArray(aInputNode, inputName)
-					AiArraySetPtr(a, 0, aOutputNode)
-
-		AiASSWrite(assFilename, AI_NODE_ALL, False)
-		AiEnd()
+		# Written natively so untouched nodes are streamed from the source file (compressed or not)
+		# without building an Arnold universe, and .gz/.zst targets are compressed on the fly
+		AssWriter.writeAssFile(assFilename, Nodegraph.getNodes(), self.assIndex)
+
+		if self.assIndex is not None and os.path.abspath(assFilename) == os.path.abspath(self.assIndex.filename):
+			# The offsets now refer to the file we just wrote
+			AssArray.closeMappings(self.assIndex.filename)
+			self.assIndex.build()
+			self.__rebindNodes()
+
+	def __rebindNodes(self):
+		# Nodes were written under their current names, array handles into the old file are stale
+		for node in Nodegraph.getNodes():
+			name = node.getName()
+			if 'sourceName' not in node.properties or name not in self.assIndex: continue
+			if node.hasParameterSource():
+				self.assIndex.attach(node, name)
+			else:
+				self.assIndex.rebind(node, name)
 
 	def openAssFile(self, assFilename=None, preview=False):
 		if assFilename is None:
 			fileName, desc = QtGui.QFileDialog.getOpenFileName(self, 'Open file', '%s' % os.environ['HOME'],
-															   'ASS file (*.ass)')
+															   AssIO.fileFilter)
 			if not fileName: return
 			assFilename = fileName
 
+		self.cancelLoad()
 		if self.openFilename:
 			self.new()
 
-		self.__loadAndPopulateAssFile(assFilename, preview)
+		self.preview = preview
+		scene = SceneCache.load(assFilename, preview)
+		if scene is not None:
+			self.__populateFromCache(assFilename, scene)
+		else:
+			self.__loadAndPopulateAssFile(assFilename, preview)
+
+	def reloadAssFile(self, assFilename=None):
+		'''
+		Updates the graph to match assFilename (default: the open file) by applying
+		only the nodes and links which differ, the rest of the graph is left alone
+		'''
+		if assFilename is None: assFilename = self.openFilename
+		if not assFilename: return
+
+		if self.loader is not None or self.assIndex is None or not self.openFilename:
+			# Nothing complete to diff against
+			self.openAssFile(assFilename, self.preview)
+			return
+
+		self.__cacheScene()
+
+		scene = SceneCache.load(assFilename, self.preview)
+		if scene is not None:
+			newIndex = AssIndex.fromRecords(assFilename, scene['records'])
+		else:
+			self.statusBar().showMessage('Reading %s' % assFilename)
+			QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+			try:
+				newIndex = AssIndex(assFilename).build()
+			except (IOError, OSError, RuntimeError) as e:
+				QtGui.QMessageBox.warning(self, 'Reload file', 'Failed to read %s:\n%s' % (assFilename, e))
+				return
+			finally:
+				QtGui.QApplication.restoreOverrideCursor()
+				self.statusBar().clearMessage()
+
+		diff = SceneDiff.diffIndices(self.assIndex, newIndex)
+		nodeGraphView = self.nodeGraphPanel.nodeGraphView
+		selected = nodeGraphView.getSelectedNames()
+		positions = nodeGraphView.getNodePositions()
+
+		oldFilename = self.assIndex.filename
+		self.arnoldSession.detach()
+		created = SceneDiff.applyDiff(diff, self.assIndex, newIndex, self.preview, self.graphQuery.store)
+		AssArray.closeMappings(oldFilename)
 		Events.processEvents()
-		window.nodeGraphPanel.nodeGraphView.positionNodes() # TODO: Refactor using Events
-		self.openFilename = assFilename
+
+		# Nodes which only changed type keep their place, genuinely new ones go next to their neighbours
+		nodeGraphView.setNodePositions(dict((name, positions[name]) for name in created if name in positions))
+		nodeGraphView.placeNodes([name for name in created if name not in positions])
+		nodeGraphView.selectNodes(selected)
+		Events.queueEvent('node_select', names=nodeGraphView.getSelectedNames())
+		Events.processEvents()
+
+		self.__setOpenFilename(assFilename)
+		self.arnoldSession.open(assFilename)
+		if scene is None: self.__cacheScene()
+		self.statusBar().showMessage('Reloaded %s: %s' % (os.path.basename(assFilename), diff), 5000)
+
+	def stepFrame(self, step):
+		if not self.openFilename: return
+		directory, basename = os.path.split(self.openFilename)
+		match = _framePattern.match(basename)
+		if match is None:
+			self.statusBar().showMessage('%s is not part of a numbered sequence' % basename, 5000)
+			return
+
+		prefix, frame, suffix = match.groups()
+		frame = int(frame) + step
+		if frame < 0: return
+
+		# Keep the padding of the sequence
+		assFilename = os.path.join(directory, '%s%0*d%s' % (prefix, len(match.group(2)), frame, suffix))
+		if not os.path.exists(assFilename):
+			self.statusBar().showMessage('%s does not exist' % os.path.basename(assFilename), 5000)
+			return
+
+		self.reloadAssFile(assFilename)
+
+	def __populateFromCache(self, assFilename, scene):
+		# The cached node table replaces the parse and the cached positions replace the layout
+		self.assIndex = AssIndex.fromRecords(assFilename, scene['records'])
+		nodeGraphView = self.nodeGraphPanel.nodeGraphView
+		nodeGraphView.setLoading(True)
+		try:
+			sceneBuilder = AssParser.SceneBuilder(self.preview, self.assIndex, self.graphQuery.store)
+			sceneBuilder.addBlocks(self.assIndex.getEntries(), indexed=True)
+			sceneBuilder.finish()
+			Events.processEvents()
+
+			nodeGraphView.setNodePositions(scene['positions'])
+			nodeGraphView.focus()
+		finally:
+			nodeGraphView.setLoading(False)
+		self.__setOpenFilename(assFilename)
+		self.arnoldSession.open(assFilename)
+
+	def __cacheScene(self):
+		if not self.openFilename or self.assIndex is None or self.assIndex.isStale(): return
+		if os.path.abspath(self.openFilename) != os.path.abspath(self.assIndex.filename): return
+		positions = self.nodeGraphPanel.nodeGraphView.getNodePositions()
+		SceneCache.store(self.openFilename, self.assIndex.getRecords(), positions, self.preview)
+
+	def cancelLoad(self):
+		if self.loader is None: return
+		self.loader.cancel()
+		self.loader.wait()
+		self.__loadFinished(self.loader)
 
 	def __loadAndPopulateAssFile(self, assFilename, preview=False):
-		AiBegin()
-		AiASSLoad(assFilename)
-		nodeIter = AiUniverseGetNodeIterator(AI_NODE_ALL)
-		while not AiNodeIteratorFinished(nodeIter):
-			node = AiNodeIteratorGetNext(nodeIter)
-			nodeEntry = AiNodeGetNodeEntry(node)
-
-			nodeName = AiNodeGetName(node)
-			nodeType = AiNodeEntryGetName(nodeEntry)
-			nodeBaseType = AiNodeEntryGetTypeName(nodeEntry)
-			if nodeName == 'root': continue
-
-			newNode = Nodegraph.createNode(nodeType, nodeName, addRegisteredPorts=not preview)
-
-			outputType = AiNodeEntryGetOutputType(nodeEntry)
-			if outputType != AI_TYPE_NONE:
-				outputTypeName = AiParamGetTypeName(outputType)
-				newNode.addOutputPort(outputTypeName)
-			else:
-				if nodeType != 'options':
-					newNode.addOutputPort('out')
-
-			paramIter = AiNodeEntryGetParamIterator(nodeEntry)
-			while not AiParamIteratorFinished(paramIter):
-				param = AiParamIteratorGetNext(paramIter)
-				paramName = AiParamGetName(param)
-				paramType = AiParamGetType(param)
-				paramTypeName = AiParamGetTypeName(paramType)
-
-				defaultValue = AiParamGetDefault(param)
-
-				nodeParam = newNode.getParameter(paramName)
-
-				if paramType == AI_TYPE_NODE:
-					newPort = newNode.addInputPort(paramName)
-					# TODO: Connect ports
-
-				elif paramType == AI_TYPE_ARRAY:
-					paramArray = AiNodeGetArray(node, paramName)
-					arrayType = AiArrayGetType(paramArray)
-					arrayTypeName = AiParamGetTypeName(arrayType)
-					if arrayType == AI_TYPE_NODE:
-						newPort = newNode.addInputPort(paramName)
-
-						numElems = AiArrayGetNumElements(paramArray)
-						for index in range(numElems):
-							connectedNode = cast(AiArrayGetPtr(paramArray, index), POINTER(AtNode))
-							connectedNodeEntry = AiNodeGetNodeEntry(connectedNode)
-							connectedNodeName = AiNodeGetName(connectedNode)
-							connectedNodeType = AiNodeEntryGetTypeName(connectedNodeEntry)
-
-							# Check which output port we're connected to
-							# If there is only one node output then there's no ambiguity
-							connectedNodeOutputType = AiNodeEntryGetOutputType(connectedNodeEntry)
-							if connectedNodeOutputType == AI_TYPE_NONE:
-								# Maybe we're trying to connect to a node with no defined outputs but
-								# the node itself is the output, e.g. a light filter or camera so we
-								# define the output as 'out' to give it a chance to connect
-								portOutName = 'out'
-							elif connectedNodeOutputType != AI_TYPE_ARRAY:
-								portOutName = AiParamGetTypeName(connectedNodeOutputType)
-							else:
-								# TODO: Resolve ambiguity if the node has multiple outputs (array)
-								portOutName = 'out'
-
-							Events.queuePostEvent('port_connect',
-												  nodeFrom=connectedNodeName, nodeTo=nodeName,
-												  portIn=paramName, portOut=portOutName)
-
-				elif paramType == AI_TYPE_FLOAT:
-					paramValue = AiNodeGetFlt(node, paramName)
-					# self.parameterPanel.addField('string', paramName, '', str(defaultValue.contents.FLT))
-					# newNode.setParameter(paramName, paramType, str(defaultValue.contents.FLT), paramValue)
-				elif paramType == AI_TYPE_STRING:
-					paramValue = AiNodeGetStr(node, paramName)
-					nodeParam.value = paramValue
-					# self.parameterPanel.addField('string', paramName, '', str(defaultValue.contents.FLT))
-					# newNode.setParameter(paramName, paramType, str(defaultValue.contents.STR), paramValue)
-
-				# print nodeName, paramName
-				if AiNodeIsLinked(node, paramName):
-					newPort = newNode.addInputPort(paramName)
-
-					# TODO: Multiple output ports support (array)
-					connectedNode = AiNodeGetLink(node, paramName)
-					connectedNodeName = AiNodeGetName(connectedNode)
-
-					# Check which output port we're connected to
-					# If there is only one node output then there's no ambiguity
-					# Note: This should be refactored into a utility function as it's the same as above
-					connectedNodeEntry = AiNodeGetNodeEntry(connectedNode)
-					connectedNodeOutputType = AiNodeEntryGetOutputType(connectedNodeEntry)
-					if connectedNodeOutputType != AI_TYPE_ARRAY:
-						portOutName = AiParamGetTypeName(connectedNodeOutputType)
-					else:
-						# TODO: Resolve ambiguity if node has multiple outputs (array)
-						portOutName = 'out'
-
-					Events.queuePostEvent('port_connect',
-										  nodeFrom=connectedNodeName, nodeTo=nodeName,
-										  portIn=paramName, portOut=portOutName)
-
-		AiNodeIteratorDestroy(nodeIter)
-		AiEnd()
+		# Parse the file ourselves rather than through AiASSLoad so geometry is never materialised.
+		# The parse runs on a worker thread and the graph is populated batch by batch as it arrives.
+		# Parameter values are read back from the index when a node is first inspected.
+		self.assIndex = AssIndex(assFilename)
+		self.sceneBuilder = AssParser.SceneBuilder(preview, self.assIndex, self.graphQuery.store)
+		self.loader = AssLoader(assFilename, self)
+		self.loader.blocksParsed.connect(self.__addParsedBlocks)
+		self.loader.progressChanged.connect(self.progressBar.setValue)
+		self.loader.finished.connect(functools.partial(self.__loadFinished, self.loader))
+		self.nodeGraphPanel.nodeGraphView.setLoading(True)
+
+		# Writes which land while the file is being parsed trigger a reload afterwards
+		self.fileWatcher.setFilename(assFilename)
+
+		self.progressBar.setValue(0)
+		self.progressBar.show()
+		self.cancelButton.show()
+		self.statusBar().showMessage('Loading %s' % assFilename)
+		self.loader.start()
+
+	def __addParsedBlocks(self, blocks):
+		loader = self.sender()
+		if loader is not self.loader: return
+
+		try:
+			if not loader.isCancelled():
+				self.sceneBuilder.addBlocks(blocks)
+				Events.processEvents()
+		except Exception as e:
+			# The load finishes as failed, see __loadFinished
+			if loader.error is None: loader.error = e
+			loader.cancel()
+			logger.exception('Failed to populate %s' % loader.filename)
+		finally:
+			# Otherwise the worker waits for the batch forever
+			loader.batchDone()
+
+	def __loadFinished(self, loader):
+		if loader is not self.loader: return
+		self.loader = None
+
+		self.progressBar.hide()
+		self.cancelButton.hide()
+		self.statusBar().clearMessage()
+
+		nodeGraphView = self.nodeGraphPanel.nodeGraphView
+		if loader.isCancelled() or loader.error is not None:
+			self.reloadPending = False
+			# A partially loaded scene must not be mistaken for the file
+			self.sceneBuilder = None
+			self.new()
+			nodeGraphView.setLoading(False)
+			if loader.error is not None:
+				QtGui.QMessageBox.warning(self, 'Open file', 'Failed to load %s:\n%s' % (loader.filename, loader.error))
+			return
+
+		self.sceneBuilder.finish()
+		self.sceneBuilder = None
+		Events.processEvents()
+		try:
+			nodeGraphView.positionNodes() # TODO: Refactor using Events
+		finally:
+			# The nodes are realized once they have been laid out
+			nodeGraphView.setLoading(False)
+		self.__setOpenFilename(loader.filename)
+		self.arnoldSession.open(loader.filename)
+		self.__cacheScene()
+
+		if self.reloadPending:
+			self.reloadPending = False
+			if not Nodegraph.getEditedNodes() or self.__confirmReload(loader.filename): self.reloadAssFile()
 
 
 if __name__ == '__main__':
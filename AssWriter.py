@@ -0,0 +1,185 @@
+import os
+import re
+import tempfile
+import itertools
+
+import AssIO
+import AssParser
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+_plainName = re.compile(r'^[^\s"#{}]+$')
+
+
+class SourceChangedError(RuntimeError):
+	'''
+	The source file changed on disk since it was indexed, its byte ranges cannot be copied
+	'''
+	pass
+
+
+def formatName(name):
+	return name if _plainName.match(name) else '"%s"' % name
+
+
+def getLinks(node):
+	'''
+	Names of the nodes connected to each input port of a node
+	'''
+	links = {}
+	for portName, port in node.getInputPorts().iteritems():
+		names = [connectedPort.getNode().getName() for connectedPort in port.getConnectedPorts()]
+		if names: links[portName] = names
+
+	return links
+
+
+def _formatLink(paramName, names, isArray):
+	if isArray or len(names) > 1:
+		return ' %s %d 1 NODE\n  %s\n' % (paramName, len(names), ' '.join(map(formatName, names)))
+
+	return ' %s %s\n' % (paramName, formatName(names[0]))
+
+
+def _formatEditedValue(node, block, paramName):
+	'''
+	:return: the parameter line for a value edited on the node, '' if it was reset to
+	         its default, None if the line in the source block is still current
+	'''
+	definition = node.getParameterDefinition(paramName)
+	if definition is None or definition.getType() == 'ARRAY': return None
+
+	value = node.getOverrides().get(paramName)
+	sourceValue = AssParser.convertValue(definition.getType(), block.params.get(paramName))
+	# Values the parser does not read (e.g. RGB, MATRIX) are never set on the node
+	if value == sourceValue or (value is None and sourceValue is None): return None
+	if value is None: return ''
+	return ' %s %s\n' % (paramName, _formatValue(definition.getType(), value))
+
+
+def _writeSourcedNode(out, source, node, block, nodeNames):
+	links = getLinks(node)
+	# Nodes whose parameters were never read cannot have been edited
+	edited = not node.hasParameterSource()
+	sourceLinks = {}
+	for paramName, name in block.getReferences():
+		if name not in nodeNames: name = name.rsplit('.', 1)[0]
+		if name in nodeNames: sourceLinks.setdefault(paramName, []).append(name)
+
+	out.write('%s\n{\n' % node.getType())
+	if block.name != node.getName():
+		out.write(' name %s\n' % formatName(node.getName()))
+
+	for paramName, start, end in block.ranges:
+		if paramName == 'name' and block.name != node.getName(): continue
+
+		# Parameters whose links were edited are written from the graph, everything else verbatim
+		if paramName in sourceLinks or paramName in links:
+			if set(sourceLinks.get(paramName, ())) != set(links.get(paramName, ())):
+				if paramName in links:
+					out.write(_formatLink(paramName, links.pop(paramName), paramName in block.nodeArrays))
+				continue
+			links.pop(paramName, None)
+
+		elif edited and paramName is not None and paramName != 'name':
+			line = _formatEditedValue(node, block, paramName)
+			if line is not None:
+				out.write(line)
+				continue
+
+		out.write(' ')
+		AssIO.copyRange(source, out, start, end)
+		out.write('\n')
+
+	if edited:
+		# Values set on the node which the source block does not have
+		for paramName, value in sorted(node.getOverrides().iteritems()):
+			if paramName in block.params or paramName in links or paramName == 'name': continue
+			definition = node.getParameterDefinition(paramName)
+			if definition is None or definition.getType() == 'ARRAY': continue
+			out.write(' %s %s\n' % (paramName, _formatValue(definition.getType(), value)))
+
+	for paramName, names in links.iteritems():
+		out.write(_formatLink(paramName, names, False))
+
+	out.write('}\n\n')
+
+
+def _formatValue(paramType, value):
+	if paramType == 'BOOL':
+		return 'on' if value else 'off'
+	elif paramType == 'STRING':
+		return '"%s"' % value
+	elif paramType == 'FLOAT':
+		return repr(float(value))
+
+	return str(value)
+
+
+def _writeNewNode(out, node):
+	out.write('%s\n{\n name %s\n' % (node.getType(), formatName(node.getName())))
+
+	# Only values set on the node are written, everything else is left at its default
+	links = getLinks(node)
+	for paramName, value in sorted(node.getOverrides().iteritems()):
+		if paramName in links: continue
+		definition = node.getParameterDefinition(paramName)
+		if definition is None or definition.getType() == 'ARRAY': continue
+		out.write(' %s %s\n' % (paramName, _formatValue(definition.getType(), value)))
+
+	for paramName, names in links.iteritems():
+		out.write(_formatLink(paramName, names, False))
+	out.write('}\n\n')
+
+
+def writeAssFile(filename, nodes, index=None):
+	'''
+	Streams the graph to a plain or compressed .ass file. Nodes that came from
+	the indexed source file are copied from it range by range, in file order so
+	compressed sources are only decoded once, and only edited links and values
+	are rewritten.
+	The file is written next to the target and moved into place at the end
+	which makes saving over the source file safe.
+	'''
+	nodes = list(nodes)
+	nodeNames = set(node.getName() for node in nodes)
+
+	sourced, created = [], []
+	for node in nodes:
+		sourceName = node.properties.get('sourceName')
+		entry = index.getEntry(sourceName) if index is not None and sourceName else None
+		if entry is not None:
+			sourced.append((entry.start, node, sourceName))
+		else:
+			created.append(node)
+
+	sourced.sort(key=lambda item: item[0])
+	if index is not None and sourced and index.isStale():
+		raise SourceChangedError('%s has changed on disk since it was loaded' % index.filename)
+
+	directory = os.path.dirname(os.path.abspath(filename))
+	handle, tempFilename = tempfile.mkstemp(prefix='.%s.' % os.path.basename(filename), dir=directory)
+	os.close(handle)
+
+	try:
+		out = AssIO.openAss(tempFilename, 'wb', AssIO.compressionFromExtension(filename))
+		try:
+			out.write('### exported: ASS Node Viewer\n\n')
+			if sourced:
+				blocks = index.iterBlocks([sourceName for _, _, sourceName in sourced])
+				with AssIO.openAss(index.filename) as source:
+					for (_, node, _), block in itertools.izip(sourced, blocks):
+						_writeSourcedNode(out, source, node, block, nodeNames)
+
+			for node in created:
+				_writeNewNode(out, node)
+		finally:
+			out.close()
+
+		os.rename(tempFilename, filename)
+	except:
+		if os.path.exists(tempFilename): os.remove(tempFilename)
+		raise
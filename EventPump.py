@@ -0,0 +1,49 @@
+import threading
+
+import PySide.QtCore as QtCore
+
+import Events
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+class EventPump(QtCore.QObject):
+	'''
+	Dispatches queued events on the thread the pump is created on (the GUI thread).
+	Events queued from any thread wake the pump, which then processes them from
+	the Qt event loop in slices of at most sliceTime seconds so a flood of events
+	never blocks the UI for long.
+
+	:param sliceTime: seconds spent dispatching before control returns to the event loop
+	'''
+
+	wakeRequested = QtCore.Signal()
+
+	def __init__(self, parent=None, sliceTime=0.01):
+		super(EventPump, self).__init__(parent)
+		self.sliceTime = sliceTime
+
+		self.timer = QtCore.QTimer(self)
+		self.timer.setInterval(0)
+		self.timer.timeout.connect(self.__dispatch)
+
+		# Queued so waking up from a worker thread starts the timer on our thread
+		self.wakeRequested.connect(self.__start, QtCore.Qt.QueuedConnection)
+
+		Events.setDispatchThread(threading.current_thread())
+		Events.setWakeHandler(self.wakeRequested.emit)
+		if Events.hasPendingEvents(): self.timer.start()
+
+	def __start(self):
+		if not self.timer.isActive(): self.timer.start()
+
+	def __dispatch(self):
+		# Nested event loops (e.g. a dialog opened by a handler) leave it to the running dispatch
+		if Events.isDispatching() or Events.processEvents(self.sliceTime):
+			self.timer.stop()
+
+	def stop(self):
+		self.timer.stop()
+		Events.setWakeHandler(None)
@@ -0,0 +1,212 @@
+'''
+Records the event stream between the model and the views and replays it into a
+NodegraphView without Arnold, Nodegraph or the scene files, e.g. to benchmark the view:
+
+	python EventReplay.py load.events --render --stats
+
+Qt 5 based bindings run offscreen, with Qt 4 use a virtual display (xvfb-run).
+'''
+import os
+import sys
+import time
+import zlib
+import argparse
+import cPickle as pickle
+
+import Events
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+# Bump when the layout of the recorded events changes
+version = 1
+
+
+class RecordedNode(object):
+	'''
+	What the views need to know about a node, stands in for Nodegraph.Node on replay
+	'''
+
+	__slots__ = ('name', 'type', 'baseType')
+
+	def __init__(self, name, type, baseType):
+		self.name = name
+		self.type = type
+		self.baseType = baseType
+
+	def __getstate__(self):
+		return (self.name, self.type, self.baseType)
+
+	def __setstate__(self, state):
+		self.name, self.type, self.baseType = state
+
+	def getName(self):
+		return self.name
+
+	def getType(self):
+		return self.type
+
+	def getBaseType(self):
+		return self.baseType
+
+
+class EventRecorder(object):
+	'''
+	Keeps every queued event, with the node objects replaced by RecordedNodes, and
+	every processEvents() so the replay dispatches the same batches.
+	Install with Events.setRecorder().
+	'''
+
+	def __init__(self):
+		self.startTime = time.time()
+		self.events = []
+		self.nodes = {}
+
+	def __recordNode(self, node):
+		# The same object for the same node keeps the file small, pickle stores it once
+		key = (id(node), node.getName())
+		recordedNode = self.nodes.get(key)
+		if recordedNode is None:
+			recordedNode = self.nodes[key] = RecordedNode(node.getName(), node.getType(), node.getBaseType())
+		return recordedNode
+
+	def eventQueued(self, queueName, eventType, args):
+		'''
+		Called with the queue lock held
+		'''
+		recordedArgs = {}
+		for name, value in args.iteritems():
+			if hasattr(value, 'getBaseType'): value = self.__recordNode(value)
+			recordedArgs[name] = value
+
+		self.events.append((time.time() - self.startTime, queueName, eventType, recordedArgs))
+
+	def eventsProcessed(self):
+		self.events.append((time.time() - self.startTime, 'process', None, None))
+
+	def getNumEvents(self):
+		return len(self.events)
+
+	def save(self, filename):
+		data = {'version': version, 'events': self.events}
+		with open(filename, 'wb') as f:
+			f.write(zlib.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL), 6))
+
+
+def load(filename):
+	with open(filename, 'rb') as f:
+		data = pickle.loads(zlib.decompress(f.read()))
+
+	if data.get('version') != version:
+		raise ValueError('%s was recorded by an incompatible version (%s)' % (filename, data.get('version')))
+	return data['events']
+
+
+class ReplayResult(object):
+	def __init__(self):
+		self.numEvents = 0
+		self.numSkipped = 0
+		self.dispatchTimes = []
+		self.renderTimes = []
+
+	def __percentile(self, times, percentile):
+		if not times: return 0.0
+		times = sorted(times)
+		return times[min(len(times) - 1, int(len(times) * percentile / 100.0))]
+
+	def __str__(self):
+		lines = ['%d events replayed in %d dispatches, %d without a handler skipped' %
+				 (self.numEvents, len(self.dispatchTimes), self.numSkipped)]
+		for label, times in (('dispatch', self.dispatchTimes), ('render', self.renderTimes)):
+			if not times: continue
+			lines.append('%-8s total %9.2f ms  p50 %8.3f ms  p95 %8.3f ms  max %8.3f ms' % (
+				label, sum(times) * 1000.0, self.__percentile(times, 50) * 1000.0,
+				self.__percentile(times, 95) * 1000.0, max(times) * 1000.0))
+
+		return '\n'.join(lines)
+
+
+def replay(events, render=None):
+	'''
+	Queues the recorded events and dispatches them where they were dispatched
+	when recorded. Events nothing listens to here, e.g. the requests the model
+	handles such as port_connect, are skipped.
+
+	:param render: called after every dispatch, e.g. to paint the view
+	:return: ReplayResult
+	'''
+	result = ReplayResult()
+	for timestamp, queueName, eventType, args in events:
+		if queueName == 'process':
+			start = time.time()
+			Events.processEvents()
+			result.dispatchTimes.append(time.time() - start)
+
+			if render is not None:
+				start = time.time()
+				render()
+				result.renderTimes.append(time.time() - start)
+			continue
+
+		if not Events.hasHandlers(eventType):
+			result.numSkipped += 1
+			continue
+
+		result.numEvents += 1
+		if queueName == 'post': Events.queuePostEvent(eventType, **args)
+		else: Events.queueEvent(eventType, **args)
+
+	if Events.hasPendingEvents():
+		start = time.time()
+		Events.processEvents()
+		result.dispatchTimes.append(time.time() - start)
+
+	return result
+
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Replays a recorded event stream into a node graph view')
+	parser.add_argument('filename')
+	parser.add_argument('--render', action='store_true', help='paint the whole scene after every dispatch')
+	parser.add_argument('--stats', action='store_true', help='print the event handler statistics')
+	parser.add_argument('--size', default='1280x800', help='view size used for rendering')
+	parser.add_argument('--virtual', action='store_true', help='only give the nodes near the viewport an item')
+	args = parser.parse_args(argv)
+
+	os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+	import PySide.QtGui as QtGui
+	import EventStats
+	from NodegraphPanel import NodegraphView
+
+	app = QtGui.QApplication.instance() or QtGui.QApplication(sys.argv[:1])
+	width, height = [int(value) for value in args.size.split('x')]
+	view = NodegraphView(None, virtual=args.virtual)
+	view.resize(width, height)
+
+	render = None
+	if args.render:
+		image = QtGui.QImage(width, height, QtGui.QImage.Format_ARGB32_Premultiplied)
+
+		def render():
+			view.focus()
+			painter = QtGui.QPainter(image)
+			view.render(painter)
+			painter.end()
+
+	if args.stats: Events.setStats(EventStats.EventStats())
+
+	events = load(args.filename)
+	start = time.time()
+	result = replay(events, render)
+	print 'Replayed %s in %.2f s' % (args.filename, time.time() - start)
+	print result
+	print '%d items in the scene' % len(view.scene.items())
+	if args.stats: print Events.getStats().formatTable()
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
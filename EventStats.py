@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import random
+import threading
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+slowHandlerThreshold = float(os.environ.get('ASSVIEWER_SLOW_HANDLER_MS', 100)) / 1000.0
+
+
+def getHandlerName(handler):
+	owner = getattr(handler, '__self__', None)
+	name = getattr(handler, '__name__', repr(handler))
+	if owner is not None: return '%s.%s' % (type(owner).__name__, name)
+	return '%s.%s' % (getattr(handler, '__module__', '?'), name)
+
+
+class HandlerStats(object):
+	'''
+	Call count, total time and a bounded reservoir of latencies for the percentiles
+	'''
+
+	__slots__ = ('calls', 'events', 'total', 'max', 'samples')
+
+	maxSamples = 4096
+
+	def __init__(self):
+		self.calls = 0
+		self.events = 0
+		self.total = 0.0
+		self.max = 0.0
+		self.samples = []
+
+	def add(self, duration, numEvents):
+		self.calls += 1
+		self.events += numEvents
+		self.total += duration
+		if duration > self.max: self.max = duration
+
+		if len(self.samples) < self.maxSamples:
+			self.samples.append(duration)
+		else:
+			index = random.randint(0, self.calls - 1)
+			if index < self.maxSamples: self.samples[index] = duration
+
+	def getPercentile(self, percentile):
+		if not self.samples: return 0.0
+		samples = sorted(self.samples)
+		return samples[min(len(samples) - 1, int(len(samples) * percentile / 100.0))]
+
+
+class EventStats(object):
+	'''
+	Collects what goes through the event bus once installed with Events.setStats().
+	Nothing is measured while no stats are installed.
+
+	:param trace: keep the individual handler calls for writeChromeTrace()
+	:param maxTraceEvents: handler calls kept for the trace, later ones are dropped
+	'''
+
+	def __init__(self, trace=False, maxTraceEvents=200000, slowThreshold=None):
+		self.trace = trace
+		self.maxTraceEvents = maxTraceEvents
+		self.slowThreshold = slowHandlerThreshold if slowThreshold is None else slowThreshold
+		self.reset()
+
+	def reset(self):
+		self.startTime = time.time()
+		self.queued = {}
+		self.dispatched = {}
+		self.highWaterMarks = {}
+		self.handlers = {}
+		self.handlerNames = {}
+		self.traceEvents = []
+
+	def eventQueued(self, eventType, queueName, depth):
+		'''
+		Called with the queue lock held
+		'''
+		self.queued[eventType] = self.queued.get(eventType, 0) + 1
+		if depth > self.highWaterMarks.get(queueName, 0): self.highWaterMarks[queueName] = depth
+
+	def eventsDispatched(self, eventType, numEvents):
+		self.dispatched[eventType] = self.dispatched.get(eventType, 0) + numEvents
+
+	def handlerCalled(self, eventType, handler, start, end, numEvents=1):
+		handlerName = self.handlerNames.get(id(handler))
+		if handlerName is None: handlerName = self.handlerNames[id(handler)] = getHandlerName(handler)
+
+		key = (eventType, handlerName)
+		stats = self.handlers.get(key)
+		if stats is None: stats = self.handlers[key] = HandlerStats()
+
+		duration = end - start
+		stats.add(duration, numEvents)
+
+		if duration > self.slowThreshold:
+			logger.warning('Slow event handler %s took %.1f ms for %d %s event(s)' % (handlerName, duration * 1000.0, numEvents, eventType))
+
+		if self.trace and len(self.traceEvents) < self.maxTraceEvents:
+			self.traceEvents.append((handlerName, eventType, start, duration, numEvents, threading.current_thread().ident))
+
+	def getRows(self):
+		'''
+		:return: (eventType, handler, calls, events, total, mean, p50, p95, p99, max) per handler,
+		         slowest total first, times in seconds
+		'''
+		rows = []
+		for (eventType, handlerName), stats in self.handlers.iteritems():
+			rows.append((eventType, handlerName, stats.calls, stats.events, stats.total, stats.total / stats.calls,
+						 stats.getPercentile(50), stats.getPercentile(95), stats.getPercentile(99), stats.max))
+
+		rows.sort(key=lambda row: row[4], reverse=True)
+		return rows
+
+	def formatTable(self):
+		lines = ['Event bus statistics over %.1f s' % (time.time() - self.startTime), '']
+
+		lines.append('%-28s %10s %10s' % ('event', 'queued', 'dispatched'))
+		for eventType in sorted(set(self.queued) | set(self.dispatched)):
+			lines.append('%-28s %10d %10d' % (eventType, self.queued.get(eventType, 0), self.dispatched.get(eventType, 0)))
+
+		lines.append('')
+		for queueName, depth in sorted(self.highWaterMarks.iteritems()):
+			lines.append('Queue high-water mark (%s): %d' % (queueName, depth))
+
+		lines.append('')
+		header = ('event', 'handler', 'calls', 'events', 'total ms', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms')
+		lines.append('%-24s %-36s %8s %8s %10s %9s %9s %9s %9s %9s' % header)
+		for row in self.getRows():
+			times = tuple(value * 1000.0 for value in row[4:])
+			lines.append('%-24s %-36s %8d %8d %10.2f %9.3f %9.3f %9.3f %9.3f %9.3f' % (row[:4] + times))
+
+		return '\n'.join(lines)
+
+	def getChromeTrace(self):
+		'''
+		:return: dict in the Trace Event Format, viewable in chrome://tracing or Perfetto
+		'''
+		pid = os.getpid()
+		traceEvents = []
+		for handlerName, eventType, start, duration, numEvents, threadId in self.traceEvents:
+			traceEvents.append({
+				'name': handlerName, 'cat': eventType, 'ph': 'X',
+				'ts': (start - self.startTime) * 1e6, 'dur': duration * 1e6,
+				'pid': pid, 'tid': threadId, 'args': {'events': numEvents}
+			})
+
+		return {'traceEvents': traceEvents, 'displayTimeUnit': 'ms'}
+
+	def writeChromeTrace(self, filename):
+		with open(filename, 'w') as f:
+			json.dump(self.getChromeTrace(), f)
@@ -1,55 +1,259 @@
+import time
+import threading
+from collections import deque, OrderedDict
+
 import logging
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
-_eventQueue = []
+# Events can be queued from any thread, they are only dispatched on the
+# dispatch thread (the GUI thread), see EventPump
+_lock = threading.Lock()
+_eventQueue = deque()
+_postEventQueue = deque()
+
+# Handler dicts are replaced rather than modified so dispatch can iterate
+# them while handlers are registered, from a handler or another thread
 _eventHandlers = {}
+_batchHandlers = {}
+_coalesceRules = {}
+
+# See EventStats and EventReplay, None while nothing is being measured or recorded
+_stats = None
+_recorder = None
+
+_dispatchThread = threading.current_thread()
+_dispatching = False
+_wakeHandler = None
+_wakeRequested = False
+
+def __wake():
+	global _wakeRequested
+	if _wakeRequested or _wakeHandler is None: return
+	with _lock:
+		if _wakeRequested or _wakeHandler is None: return
+		_wakeRequested = True
+		wakeHandler = _wakeHandler
 
-_postEventQueue = []
+	wakeHandler()
 
 def queueEvent(eventType, **args):
-	global _eventQueue
-	logger.info('queueEvent: %s' % eventType)
-	_eventQueue.append((eventType, args))
+	with _lock:
+		_eventQueue.append((eventType, args))
+		if _stats is not None: _stats.eventQueued(eventType, 'events', len(_eventQueue))
+		if _recorder is not None: _recorder.eventQueued('events', eventType, args)
+	__wake()
 
 def queuePostEvent(eventType, **args):
-	global _postEventQueue
-	logger.info('queuePostEvent: %s' % eventType)
-	_postEventQueue.append((eventType, args))
+	with _lock:
+		_postEventQueue.append((eventType, args))
+		if _stats is not None: _stats.eventQueued(eventType, 'post', len(_postEventQueue))
+		if _recorder is not None: _recorder.eventQueued('post', eventType, args)
+	__wake()
 
 def registerHandler(handler, eventType):
 	global _eventHandlers
-	handlers = _eventHandlers.get(eventType)
-	if handlers is None:
-		handlers = {}
+	with _lock:
+		handlers = dict(_eventHandlers.get(eventType, {}))
+		key = (id(handler))
+		handlers[key] = handler
+		_eventHandlers = dict(_eventHandlers)
+		_eventHandlers[eventType] = handlers
+
+def registerBatchHandler(handler, eventType):
+	'''
+	The handler is called once with the arguments of all the queued events of
+	eventType as a list of dicts, instead of once per event.
+
+	Batched (and coalesced) event types are held back until the next event of a
+	type which is neither, so they must not depend on their order relative to
+	other batched types in between, e.g. node_create and node_addInputPort.
+	'''
+	global _batchHandlers
+	with _lock:
+		handlers = dict(_batchHandlers.get(eventType, {}))
+		handlers[id(handler)] = handler
+		_batchHandlers = dict(_batchHandlers)
+		_batchHandlers[eventType] = handlers
+
+def setCoalesceRule(eventType, rule):
+	'''
+	:param rule: function which reduces the list of argument dicts of the queued
+	             events of eventType to the ones which are dispatched, see coalesceLast()
+	'''
+	global _coalesceRules
+	with _lock:
+		_coalesceRules = dict(_coalesceRules)
+		if rule is None: _coalesceRules.pop(eventType, None)
+		else: _coalesceRules[eventType] = rule
 
-	key = (id(handler))
-	handlers[key] = handler
-	_eventHandlers[eventType] = handlers
+def coalesceLast(events):
+	return events[-1:]
+
+def coalesceConnections(events):
+	connections = []
+	for args in events:
+		connections.extend(args['connections'])
+	return [{'connections': connections}]
+
+def hasHandlers(eventType):
+	return eventType in _eventHandlers or eventType in _batchHandlers
 
 def getRegisteredHandlers(eventType):
 	global _eventHandlers
 	if eventType not in _eventHandlers: return {}
 	return _eventHandlers[eventType]
 
+def setStats(stats):
+	'''
+	:param stats: EventStats which measures the queues and handlers from now on, None to stop
+	'''
+	global _stats
+	with _lock:
+		_stats = stats
+
+def getStats():
+	return _stats
+
+def setRecorder(recorder):
+	'''
+	:param recorder: EventRecorder which is told about every queued event and every
+	                 dispatch from now on, None to stop
+	'''
+	global _recorder
+	with _lock:
+		_recorder = recorder
+
+def getRecorder():
+	return _recorder
+
+def setDispatchThread(thread):
+	global _dispatchThread
+	_dispatchThread = thread
+
+def isDispatchThread():
+	return threading.current_thread() is _dispatchThread
+
+def setWakeHandler(handler):
+	'''
+	:param handler: called from the queueing thread when events are waiting to be
+	                dispatched, at most once until processEvents() runs again
+	'''
+	global _wakeHandler, _wakeRequested
+	with _lock:
+		_wakeHandler = handler
+		_wakeRequested = False
+
+def isDispatching():
+	return _dispatching
+
+def hasPendingEvents():
+	return bool(_eventQueue or _postEventQueue)
+
 def __processHandler(eventType, args):
-	logger.info('Process event: %s' % eventType)
 	# Check if any handlers have been registered for this type of event
 	handlers = _eventHandlers.get(eventType)
 	if handlers is None:
 		logger.warning('No handlers found for event: %s' % eventType)
 		return
 
+	stats = _stats
+	if stats is None:
+		for handlerId, handler in handlers.iteritems():
+			handler(**args)
+		return
+
+	stats.eventsDispatched(eventType, 1)
 	for handlerId, handler in handlers.iteritems():
+		start = time.time()
 		handler(**args)
+		stats.handlerCalled(eventType, handler, start, time.time())
+
+def __processBatch(eventType, events):
+	rule = _coalesceRules.get(eventType)
+	if rule is not None: events = rule(events)
+
+	batchHandlers = _batchHandlers.get(eventType)
+	if batchHandlers is None and eventType not in _eventHandlers:
+		logger.warning('No handlers found for event: %s' % eventType)
+		return
+
+	stats = _stats
+	if batchHandlers is not None:
+		if stats is not None and eventType not in _eventHandlers: stats.eventsDispatched(eventType, len(events))
+		for handlerId, handler in batchHandlers.iteritems():
+			start = time.time() if stats is not None else None
+			handler(events)
+			if stats is not None: stats.handlerCalled(eventType, handler, start, time.time(), len(events))
+
+	if eventType in _eventHandlers:
+		for args in events:
+			__processHandler(eventType, args)
+
+def __processQueue(queue, deadline):
+	'''
+	Dispatches events from the front of the queue until it is empty, events queued
+	by the handlers included.
+
+	:return: False if the deadline passed before the queue was empty
+	'''
+	pending = OrderedDict()
+	while True:
+		with _lock:
+			event = queue.popleft() if queue else None
+
+		if event is None:
+			if not pending: return True
+		else:
+			eventType, args = event
+			if eventType in _batchHandlers or eventType in _coalesceRules:
+				pending.setdefault(eventType, []).append(args)
+				# A flood of batched events is flushed in slices as well
+				if deadline is None or time.time() <= deadline: continue
+				event = None
+
+		# Any other event keeps its place relative to the batched ones
+		while pending:
+			__processBatch(*pending.popitem(last=False))
+		if event is not None: __processHandler(eventType, args)
+
+		if deadline is not None and time.time() > deadline: return not queue
+
+def processEvents(timeout=None):
+	'''
+	Calls the registered handlers for the queued events, then for the queued post
+	events, until both queues are empty.
+
+	Called from another thread than the dispatch thread, or from a handler while
+	events are being dispatched, this only makes sure the events are dispatched.
+
+	:param timeout: seconds after which dispatching stops, the remaining events are
+	                left queued and the wake handler is asked to come back for them
+	:return: True if every queued event was dispatched
+	'''
+	global _dispatching, _wakeRequested
+	if not isDispatchThread():
+		__wake()
+		return False
+
+	# The dispatch already running picks up anything queued in the meantime
+	if _dispatching: return False
+
+	deadline = None if timeout is None else time.time() + timeout
+	if _recorder is not None: _recorder.eventsProcessed()
+	_dispatching = True
+	try:
+		with _lock:
+			_wakeRequested = False
 
-def processEvents():
-	# Go through all the queued events and call respective registered handlers
-	global _eventQueue, _postEventQueue, _eventHandlers
-	for eventType, args in _eventQueue:
-		__processHandler(eventType, args)
+		while _eventQueue or _postEventQueue:
+			if not __processQueue(_eventQueue, deadline): break
+			if not __processQueue(_postEventQueue, deadline): break
+	finally:
+		_dispatching = False
 
-	for eventType, args in _postEventQueue:
-		__processHandler(eventType, args)
+	if hasPendingEvents():
+		__wake()
+		return False
 
-	_eventQueue, _postEventQueue = [], []
+	return True
@@ -0,0 +1,125 @@
+import os
+
+import PySide.QtCore as QtCore
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+pollInterval = int(os.environ.get('ASSVIEWER_WATCH_POLL_MS', 1000))
+forcePolling = os.environ.get('ASSVIEWER_WATCH_POLL', '0') not in ('0', 'off', 'false')
+
+
+class FileWatcher(QtCore.QObject):
+	'''
+	Watches a single file and emits fileChanged once a burst of writes has settled.
+	The file and its directory are watched with QFileSystemWatcher so exporters
+	which write a temporary file and rename it over the target are seen too.
+	Where the watcher is not available (e.g. some network mounts) the file is polled.
+
+	:param debounce: milliseconds the file must stay unchanged before fileChanged is emitted
+	'''
+
+	fileChanged = QtCore.Signal(str)
+
+	def __init__(self, parent=None, debounce=500):
+		super(FileWatcher, self).__init__(parent)
+		self.filename = None
+		self.enabled = False
+		self.polling = forcePolling
+		self.knownStat = None
+		self.pendingStat = None
+
+		self.watcher = QtCore.QFileSystemWatcher(self)
+		self.watcher.fileChanged.connect(self.__changed)
+		self.watcher.directoryChanged.connect(self.__changed)
+
+		self.settleTimer = QtCore.QTimer(self)
+		self.settleTimer.setSingleShot(True)
+		self.settleTimer.setInterval(debounce)
+		self.settleTimer.timeout.connect(self.__settle)
+
+		self.pollTimer = QtCore.QTimer(self)
+		self.pollTimer.setInterval(pollInterval)
+		self.pollTimer.timeout.connect(self.__changed)
+
+	def __stat(self):
+		try:
+			stat = os.stat(self.filename)
+		except OSError:
+			return None
+		return stat.st_size, stat.st_mtime
+
+	def isEnabled(self):
+		return self.enabled
+
+	def setEnabled(self, state):
+		self.enabled = bool(state)
+		self.__watch()
+
+	def setFilename(self, filename):
+		'''
+		Watches filename from its current state on, changes made so far are ignored
+		'''
+		self.filename = filename
+		self.__watch()
+
+	def acknowledge(self):
+		'''
+		The current state of the file is known, e.g. because we just wrote it ourselves
+		'''
+		self.knownStat = self.__stat()
+		self.pendingStat = None
+		self.settleTimer.stop()
+
+	def __unwatch(self):
+		paths = self.watcher.files() + self.watcher.directories()
+		if paths: self.watcher.removePaths(paths)
+		self.settleTimer.stop()
+		self.pollTimer.stop()
+
+	def __watch(self):
+		self.__unwatch()
+		self.acknowledge()
+		if not self.enabled or not self.filename: return
+
+		directory = os.path.dirname(os.path.abspath(self.filename))
+		self.polling = forcePolling
+		if not self.polling:
+			self.watcher.addPaths([directory, self.filename])
+			if self.filename not in self.watcher.files() and os.path.exists(self.filename):
+				logger.info('Falling back to polling %s' % self.filename)
+				self.watcher.removePaths(self.watcher.directories())
+				self.polling = True
+
+		if self.polling: self.pollTimer.start()
+
+	def __changed(self, path=None):
+		stat = self.__stat()
+		if stat == self.knownStat and self.pendingStat is None: return
+
+		# Files replaced by a rename drop out of the watcher and are added again
+		if not self.polling and stat is not None and self.filename not in self.watcher.files():
+			self.watcher.addPath(self.filename)
+
+		self.pendingStat = stat
+		self.settleTimer.start()
+
+	def __settle(self):
+		stat = self.__stat()
+		if stat is None:
+			# Removed or mid-rename, the directory watch picks it up when it is back
+			self.pendingStat = None
+			return
+
+		if stat != self.pendingStat:
+			# Still being written, wait for the next quiet period
+			self.pendingStat = stat
+			self.settleTimer.start()
+			return
+
+		self.pendingStat = None
+		if stat == self.knownStat: return
+		self.knownStat = stat
+		self.fileChanged.emit(self.filename)
@@ -0,0 +1,358 @@
+import os
+import bisect
+from collections import deque, OrderedDict
+
+import Events
+import Nodegraph
+from GraphStore import GraphStore
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+storeBackend = os.environ.get('ASSVIEWER_GRAPH_STORE', '0') not in ('0', 'off', 'false')
+
+
+class GraphQuery(object):
+	'''
+	Answers structural questions about the graph from indexes which are kept
+	up to date from the node and connection events, so no query walks the
+	whole scene. Upstream/downstream closures are cached and only the cached
+	closures an edited connection can affect are dropped.
+
+	The indexes reflect the graph as of the last processed events.
+
+	With the store backend (ASSVIEWER_GRAPH_STORE) types and connections are
+	looked up in a GraphStore instead of dicts of names. The scene builders
+	fill the store in bulk, see AssParser.SceneBuilder, and the events keep it
+	in sync with the edits.
+
+	:param cacheSize: number of closures kept per direction
+	:param store: use a GraphStore as the backend, defaults to ASSVIEWER_GRAPH_STORE
+	'''
+
+	def __init__(self, cacheSize=256, store=None):
+		self.cacheSize = cacheSize
+		if store is None: store = storeBackend
+		self.store = GraphStore() if store else None
+		self.rebuild()
+
+		Events.registerHandler(self.__nodeCreated, 'node_create')
+		Events.registerHandler(self.__nodeDeleted, 'node_delete')
+		Events.registerHandler(self.__nodeRenamed, 'node_rename')
+		Events.registerHandler(self.__portsConnected, 'port_connectBatch')
+		Events.registerHandler(self.__portsDisconnected, 'port_disconnectBatch')
+		Events.registerHandler(self.__nodesCleared, 'node_clear')
+
+	def rebuild(self):
+		self.types = {}
+		self.byType = {}
+		self.byBaseType = {}
+		self.upstream = {}
+		self.downstream = {}
+		self.sortedNames = []
+		self.sortedDirty = False
+		self.upstreamCache = OrderedDict()
+		self.downstreamCache = OrderedDict()
+		if self.store is not None: self.store.clear()
+
+		for node in Nodegraph.getNodes():
+			self.__addNode(node.getName(), node.getType(), node.getBaseType())
+
+		connections = []
+		for node in Nodegraph.getNodes():
+			for portName, input in node.getInputPorts().iteritems():
+				for port in input.getConnectedPorts():
+					connections.append((port.getNode().getName(), port.getName(), node.getName(), portName))
+
+		self.__portsConnected(connections)
+
+	# Index maintenance
+
+	def __addNode(self, name, type, baseType):
+		store = self.store
+		if store is not None:
+			self.sortedDirty = True
+			nodeId = store.getNodeId(name)
+			# Nodes added by the scene builder are already there
+			if nodeId >= 0 and store.getType(nodeId) == type: return
+			if nodeId >= 0: self.__removeNode(name)
+			store.addNode(name, type, baseType)
+			return
+
+		if name in self.types: self.__removeNode(name)
+		self.types[name] = (type, baseType)
+		self.byType.setdefault(type, set()).add(name)
+		self.byBaseType.setdefault(baseType, set()).add(name)
+		self.sortedDirty = True
+
+	def __removeNode(self, name):
+		if self.store is not None:
+			self.store.deleteNode(name)
+			# Every closure through the node contains it
+			self.__invalidate(name, name)
+			self.sortedDirty = True
+			return
+
+		type, baseType = self.types.pop(name)
+		self.byType[type].discard(name)
+		self.byBaseType[baseType].discard(name)
+
+		for source in self.upstream.get(name, {}).keys():
+			self.__removeEdge(source, name, all=True)
+		for target in self.downstream.get(name, {}).keys():
+			self.__removeEdge(name, target, all=True)
+
+		self.upstream.pop(name, None)
+		self.downstream.pop(name, None)
+		self.sortedDirty = True
+
+	def __renameNode(self, name, newName):
+		if self.store is not None:
+			self.store.renameNode(name, newName)
+			self.__dropClosures(name)
+			return
+
+		type, baseType = self.types[newName] = self.types.pop(name)
+		self.byType[type].discard(name)
+		self.byType[type].add(newName)
+		self.byBaseType[baseType].discard(name)
+		self.byBaseType[baseType].add(newName)
+
+		# Only the neighbours refer to the node by name
+		sources = self.upstream.pop(name, None)
+		if sources is not None:
+			self.upstream[newName] = sources
+			for source in sources:
+				targets = self.downstream[source]
+				targets[newName] = targets.pop(name)
+
+		targets = self.downstream.pop(name, None)
+		if targets is not None:
+			self.downstream[newName] = targets
+			for target in targets:
+				sources = self.upstream[target]
+				sources[newName] = sources.pop(name)
+
+		self.__dropClosures(name)
+
+	def __dropClosures(self, name):
+		for cache in (self.upstreamCache, self.downstreamCache):
+			for root, (closure, _) in cache.items():
+				if root == name or name in closure: del cache[root]
+
+		self.sortedDirty = True
+
+	def __addEdge(self, source, target):
+		# Parallel connections between the same nodes (several ports) are counted
+		sources = self.upstream.setdefault(target, {})
+		sources[source] = sources.get(source, 0) + 1
+		targets = self.downstream.setdefault(source, {})
+		targets[target] = targets.get(target, 0) + 1
+		if sources[source] == 1: self.__invalidate(source, target)
+
+	def __removeEdge(self, source, target, all=False):
+		sources = self.upstream.get(target)
+		if not sources or source not in sources: return
+
+		count = 0 if all else sources[source] - 1
+		if count:
+			sources[source] = count
+			self.downstream[source][target] = count
+			return
+
+		del sources[source]
+		del self.downstream[source][target]
+		self.__invalidate(source, target)
+
+	def __invalidate(self, source, target):
+		# Only closures which reach across the edited edge can change
+		for root, (closure, _) in self.upstreamCache.items():
+			if root == target or target in closure: del self.upstreamCache[root]
+
+		for root, (closure, _) in self.downstreamCache.items():
+			if root == source or source in closure: del self.downstreamCache[root]
+
+	def __nodeCreated(self, node):
+		self.__addNode(node.getName(), node.getType(), node.getBaseType())
+
+	def __nodeDeleted(self, name):
+		if self.__hasNode(name): self.__removeNode(name)
+
+	def __nodeRenamed(self, name, newName):
+		if self.__hasNode(name): self.__renameNode(name, newName)
+
+	def __portsConnected(self, connections):
+		store = self.store
+		for nodeFrom, portOut, nodeTo, portIn in connections:
+			if store is None:
+				self.__addEdge(nodeFrom, nodeTo)
+				continue
+
+			# The scene builder may have added the connection already, the cached closures predate it either way
+			store.connect(nodeFrom, portOut, nodeTo, portIn)
+			self.__invalidate(nodeFrom, nodeTo)
+
+	def __portsDisconnected(self, connections):
+		store = self.store
+		for nodeFrom, portOut, nodeTo, portIn in connections:
+			if store is None: self.__removeEdge(nodeFrom, nodeTo)
+			elif store.disconnect(nodeFrom, portOut, nodeTo, portIn): self.__invalidate(nodeFrom, nodeTo)
+
+	def __nodesCleared(self):
+		self.rebuild()
+
+	# Backend access
+
+	def __hasNode(self, name):
+		if self.store is not None: return self.store.hasNode(name)
+		return name in self.types
+
+	def __getTypes(self, name):
+		'''
+		:return: (type, baseType) of a node
+		'''
+		store = self.store
+		if store is None: return self.types[name]
+		nodeId = store.getNodeId(name)
+		return store.getType(nodeId), store.getBaseType(nodeId)
+
+	def __getSources(self, name):
+		store = self.store
+		if store is None: return self.upstream.get(name, ())
+		nodeId = store.getNodeId(name)
+		return store.getNames(store.getSourceIds(nodeId)) if nodeId >= 0 else ()
+
+	def __getTargets(self, name):
+		store = self.store
+		if store is None: return self.downstream.get(name, ())
+		nodeId = store.getNodeId(name)
+		return store.getNames(store.getTargetIds(nodeId)) if nodeId >= 0 else ()
+
+	# Queries
+
+	def getNodesByType(self, type):
+		if self.store is not None: return sorted(self.store.getNames(self.store.getNodeIdsByType(type)))
+		return sorted(self.byType.get(type, ()))
+
+	def getNodesByBaseType(self, baseType):
+		if self.store is not None: return sorted(self.store.getNames(self.store.getNodeIdsByBaseType(baseType)))
+		return sorted(self.byBaseType.get(baseType, ()))
+
+	def getNodesWithPrefix(self, prefix):
+		if self.sortedDirty:
+			self.sortedNames = sorted(self.store.getNames() if self.store is not None else self.types)
+			self.sortedDirty = False
+
+		names = self.sortedNames
+		start = bisect.bisect_left(names, prefix)
+		end = bisect.bisect_left(names, prefix + u'\U0010ffff' if isinstance(prefix, unicode) else prefix + '\xff', start)
+		return names[start:end]
+
+	def getInputs(self, name):
+		'''
+		Names of the nodes directly connected to the inputs of a node
+		'''
+		return sorted(self.__getSources(name))
+
+	def getOutputs(self, name):
+		return sorted(self.__getTargets(name))
+
+	def __closure(self, name, getNeighbours, cache):
+		'''
+		:return: (set, sorted list) of the nodes reachable from name
+		'''
+		cached = cache.get(name)
+		if cached is not None:
+			cache[name] = cache.pop(name)
+			return cached
+
+		closure = set()
+		queue = deque((name,))
+		while queue:
+			for neighbour in getNeighbours(queue.popleft()):
+				if neighbour not in closure:
+					closure.add(neighbour)
+					queue.append(neighbour)
+
+		closure.discard(name)
+		cached = cache[name] = (frozenset(closure), sorted(closure))
+		if len(cache) > self.cacheSize: cache.popitem(last=False)
+		return cached
+
+	def __filter(self, names, type=None, baseType=None):
+		'''
+		Filters sorted names
+		'''
+		if type is not None: names = [name for name in names if self.__getTypes(name)[0] == type]
+		if baseType is not None: names = [name for name in names if self.__getTypes(name)[1] == baseType]
+		return list(names)
+
+	def getUpstream(self, name, type=None, baseType=None):
+		'''
+		Every node feeding into a node, directly or not, e.g. the shaders of a polymesh
+		with getUpstream('mesh1', baseType='shader')
+		'''
+		return self.__filter(self.__closure(name, self.__getSources, self.upstreamCache)[1], type, baseType)
+
+	def getDownstream(self, name, type=None, baseType=None):
+		return self.__filter(self.__closure(name, self.__getTargets, self.downstreamCache)[1], type, baseType)
+
+	def findPath(self, source, target):
+		'''
+		Shortest chain of node names from source down to target, or None
+		'''
+		if not self.__hasNode(source) or not self.__hasNode(target): return None
+		if source != target and target not in self.__closure(source, self.__getTargets, self.downstreamCache)[0]: return None
+
+		previous = {source: None}
+		queue = deque((source,))
+		while queue:
+			name = queue.popleft()
+			if name == target: break
+			for neighbour in self.__getTargets(name):
+				if neighbour not in previous:
+					previous[neighbour] = name
+					queue.append(neighbour)
+
+		path = []
+		while target is not None:
+			path.append(target)
+			target = previous[target]
+
+		return path[::-1]
+
+	def filterByParameter(self, paramName, value, names=None, type=None, baseType=None):
+		'''
+		Nodes whose parameter has the given value (defaults included), optionally
+		only among names or nodes of a type.
+
+		Every candidate is parsed to read its value, so narrow the candidates down
+		on large scenes. Without names or a type only the nodes of the types which
+		define the parameter are read, parameters declared on single nodes are
+		only found among the given names or types.
+		'''
+		if names is None:
+			if type is not None: names = self.getNodesByType(type)
+			elif baseType is not None: names = self.getNodesByBaseType(baseType)
+			else: names = [name for nodeType in self.__getTypesWithParameter(paramName) for name in self.getNodesByType(nodeType)]
+
+		matches = []
+		for name in self.__filter(sorted(names), type, baseType):
+			node = Nodegraph.getNode(name)
+			param = node.getParameter(paramName) if node is not None else None
+			if param is None: continue
+			paramValue = param.getValue()
+			if paramValue is None: paramValue = param.getDefault()
+			if paramValue == value: matches.append(name)
+
+		return matches
+
+	def __getTypesWithParameter(self, paramName):
+		nodeTypes = self.store.typeNames.strings if self.store is not None else self.byType
+		types = []
+		for nodeType in nodeTypes:
+			nodeClass = Nodegraph.getNodeClass(nodeType)
+			if nodeClass is not None and paramName in nodeClass.registeredParameterMap: types.append(nodeType)
+
+		return types
@@ -0,0 +1,642 @@
+import itertools
+import numpy as np
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+class StringTable(object):
+	'''
+	Interns strings as consecutive integer ids
+	'''
+
+	def __init__(self):
+		self.ids = {}
+		self.strings = []
+
+	def intern(self, string):
+		id = self.ids.get(string)
+		if id is None:
+			id = self.ids[string] = len(self.strings)
+			self.strings.append(string)
+
+		return id
+
+	def lookup(self, string):
+		return self.ids.get(string, -1)
+
+	def rename(self, string, newString):
+		'''
+		Gives the id of string to newString, which must not have an id of its own
+		'''
+		id = self.ids.pop(string)
+		self.ids[newString] = id
+		self.strings[id] = newString
+		return id
+
+	def getString(self, id):
+		return self.strings[id]
+
+	def __len__(self):
+		return len(self.strings)
+
+	def __contains__(self, string):
+		return string in self.ids
+
+
+class Column(object):
+	'''
+	Growable NumPy array, rows are appended with amortised doubling
+
+	:param width: number of values per row, 1 for a flat array
+	'''
+
+	def __init__(self, dtype, width=1, capacity=1024):
+		self.width = width
+		shape = (capacity,) if width == 1 else (capacity, width)
+		self.data = np.zeros(shape, dtype)
+		self.size = 0
+
+	def __reserve(self, size):
+		if size <= len(self.data): return
+		capacity = max(size, 2 * len(self.data))
+		data = np.zeros((capacity,) + self.data.shape[1:], self.data.dtype)
+		data[:self.size] = self.data[:self.size]
+		self.data = data
+
+	def append(self, row):
+		self.__reserve(self.size + 1)
+		self.data[self.size] = row
+		self.size += 1
+		return self.size - 1
+
+	def extend(self, rows):
+		rows = np.asarray(rows, self.data.dtype)
+		start = self.size
+		self.__reserve(start + len(rows))
+		self.data[start:start + len(rows)] = rows
+		self.size += len(rows)
+		return start
+
+	def view(self):
+		return self.data[:self.size]
+
+	def __len__(self):
+		return self.size
+
+	def getNumBytes(self):
+		return self.data.nbytes
+
+
+class EdgeIndex(object):
+	'''
+	CSR index of the edge ids grouped by the node in one column of the edge
+	table. Edges added since the last merge are kept in per-node lists so they
+	are found straight away, and are merged into the arrays with a single
+	np.insert once there are enough of them. Deleted edges stay in the index
+	until compact() and are filtered out by the caller.
+
+	:param column: 0 to group the edges by source node, 2 by destination node
+	'''
+
+	def __init__(self, column):
+		self.column = column
+		self.clear()
+
+	def clear(self):
+		self.indptr = np.zeros(1, np.int64)
+		self.edgeIds = np.zeros(0, np.int32)
+		self.pending = {}
+		self.numPending = 0
+
+	def add(self, nodeIds, edgeIds):
+		if len(edgeIds) > self.__getMergeThreshold():
+			self.__merge(np.asarray(nodeIds, np.int64), np.asarray(edgeIds, np.int32))
+			return
+
+		pending = self.pending
+		for nodeId, edgeId in itertools.izip(np.asarray(nodeIds).tolist(), np.asarray(edgeIds).tolist()):
+			edges = pending.get(nodeId)
+			if edges is None: pending[nodeId] = [edgeId]
+			else: edges.append(edgeId)
+
+		self.numPending += len(edgeIds)
+		if self.numPending > self.__getMergeThreshold(): self.__merge()
+
+	def __getMergeThreshold(self):
+		return max(1024, len(self.edgeIds) >> 3)
+
+	def __merge(self, nodeIds=None, edgeIds=None):
+		# The pending edges (and any given ones) go in after the edges of their node
+		pendingNodes = [nodeId for nodeId, edges in self.pending.iteritems() for _ in edges]
+		pendingEdges = [edgeId for edges in self.pending.itervalues() for edgeId in edges]
+		self.pending = {}
+		self.numPending = 0
+		if nodeIds is None:
+			nodeIds, edgeIds = np.array(pendingNodes, np.int64), np.array(pendingEdges, np.int32)
+		elif pendingEdges:
+			nodeIds = np.concatenate((np.array(pendingNodes, np.int64), nodeIds))
+			edgeIds = np.concatenate((np.array(pendingEdges, np.int32), edgeIds))
+		if not len(edgeIds): return
+
+		order = np.argsort(nodeIds, kind='mergesort')
+		nodeIds, edgeIds = nodeIds[order], edgeIds[order]
+
+		indptr = self.indptr
+		numNodes = max(len(indptr) - 1, int(nodeIds[-1]) + 1)
+		if numNodes > len(indptr) - 1:
+			indptr = np.concatenate((indptr, np.repeat(indptr[-1], numNodes + 1 - len(indptr))))
+
+		self.edgeIds = np.insert(self.edgeIds, indptr[nodeIds + 1], edgeIds)
+		indptr = indptr.copy()
+		indptr[1:] += np.cumsum(np.bincount(nodeIds, minlength=numNodes))
+		self.indptr = indptr
+
+	def compact(self, edges, edgeAlive):
+		'''
+		Rebuilds the arrays from the live edges only
+		'''
+		self.clear()
+		liveEdges = np.flatnonzero(edgeAlive)
+		if len(liveEdges): self.__merge(edges[liveEdges, self.column].astype(np.int64), liveEdges.astype(np.int32))
+
+	def get(self, nodeId):
+		indptr = self.indptr
+		if nodeId < len(indptr) - 1:
+			edgeIds = self.edgeIds[indptr[nodeId]:indptr[nodeId + 1]]
+		else:
+			edgeIds = self.edgeIds[:0]
+
+		pending = self.pending.get(nodeId)
+		if pending: edgeIds = np.concatenate((edgeIds, np.array(pending, np.int32)))
+		return edgeIds
+
+	def getNumBytes(self):
+		return self.indptr.nbytes + self.edgeIds.nbytes
+
+
+class GraphStore(object):
+	'''
+	Columnar scene graph for very large scenes. Node names, types and port
+	names are interned, node attributes are NumPy columns and connections are
+	rows of (src node, src port, dst node, dst port) ids in an edge table,
+	indexed in CSR form per source and per destination node, see EdgeIndex.
+
+	Filled by AssParser.SceneBuilder and kept up to date by GraphQuery when it
+	is the backend of the queries (ASSVIEWER_GRAPH_STORE).
+
+	Per-node Python objects only exist as the NodeProxy and PortProxy views
+	handed out by getNode(), which offer the Nodegraph Node and Port API.
+	Sparse per-node data (properties, parameter overrides) is kept in dicts
+	for the few nodes which have any.
+	'''
+
+	def __init__(self):
+		self.clear()
+
+	def clear(self):
+		self.names = StringTable()
+		self.typeNames = StringTable()
+		self.portNames = StringTable()
+
+		# Node columns, indexed by node id which is also the id of the interned name
+		self.nodeTypes = Column(np.int32)
+		self.alive = Column(np.bool_)
+		self.positions = Column(np.float32, 2)
+
+		# Per type: base type and the ids of its registered ports
+		self.baseTypes = {}
+		self.typeInputs = {}
+		self.typeOutputs = {}
+		self.typeParameters = {}
+
+		self.edges = Column(np.int32, 4)
+		self.edgeAlive = Column(np.bool_)
+		self.numDeadEdges = 0
+		self.outputIndex = EdgeIndex(0)
+		self.inputIndex = EdgeIndex(2)
+
+		self.properties = {}
+		self.parameters = {}
+		self.overrides = {}
+
+	# Types
+
+	def registerType(self, type, baseType, inputPorts=(), outputPorts=(), parameterMap=None):
+		'''
+		Describes a node type, e.g. from Nodegraph.getRegisteredNodes()
+
+		:param parameterMap: optional ordered dict of parameter name to Parameter definition
+		'''
+		typeId = self.typeNames.intern(type)
+		self.baseTypes[typeId] = baseType
+		self.typeInputs[typeId] = tuple(self.portNames.intern(name) for name in inputPorts)
+		self.typeOutputs[typeId] = tuple(self.portNames.intern(name) for name in outputPorts)
+		if parameterMap is not None: self.typeParameters[typeId] = parameterMap
+		return typeId
+
+	def registerNodegraphType(self, type):
+		# Nodegraph is imported lazily as its registry needs Arnold while the store does not
+		import Nodegraph
+		nodeClass = Nodegraph.getNodeClass(type)
+		if nodeClass is None: return self.typeNames.intern(type)
+		return self.registerType(type, nodeClass.baseType, nodeClass.registeredInputPorts,
+								 nodeClass.registeredOutputPorts, nodeClass.registeredParameterMap)
+
+	# Nodes
+
+	def addNode(self, name, type, baseType=None):
+		'''
+		:param baseType: base type of a type which was not registered, e.g. Node.getBaseType()
+		'''
+		typeId = self.typeNames.intern(type)
+		if baseType is not None and typeId not in self.baseTypes: self.baseTypes[typeId] = baseType
+		nodeId = self.names.intern(name)
+		if nodeId < len(self.alive):
+			# Re-adding a deleted node reuses its id
+			if self.alive.data[nodeId]:
+				logger.warning('Node %s already exists' % name)
+				return nodeId
+			self.nodeTypes.data[nodeId] = typeId
+			self.alive.data[nodeId] = True
+			return nodeId
+
+		self.nodeTypes.append(typeId)
+		self.alive.append(True)
+		self.positions.append((0, 0))
+		return nodeId
+
+	def addNodes(self, names, types):
+		'''
+		Bulk version of addNode for new names, returns the array of node ids
+		'''
+		internType = self.typeNames.intern
+		internName = self.names.intern
+		first = len(self.names)
+		nodeIds = np.fromiter((internName(name) for name in names), np.int32)
+		if len(nodeIds) and (nodeIds.min() < first or len(self.names) - first != len(nodeIds)):
+			raise ValueError('addNodes only takes names which are not in the store yet')
+
+		self.nodeTypes.extend(np.fromiter((internType(type) for type in types), np.int32, len(nodeIds)))
+		self.alive.extend(np.ones(len(nodeIds), np.bool_))
+		self.positions.extend(np.zeros((len(nodeIds), 2), np.float32))
+		return nodeIds
+
+	def getNodeId(self, name):
+		nodeId = self.names.lookup(name)
+		if nodeId < 0 or not self.alive.data[nodeId]: return -1
+		return nodeId
+
+	def hasNode(self, name):
+		return self.getNodeId(name) >= 0
+
+	def getNode(self, name):
+		nodeId = self.getNodeId(name)
+		if nodeId < 0: return None
+		return NodeProxy(self, nodeId)
+
+	def getNodes(self):
+		return [NodeProxy(self, nodeId) for nodeId in np.flatnonzero(self.alive.view())]
+
+	def getNumNodes(self):
+		return int(np.count_nonzero(self.alive.view()))
+
+	def deleteNode(self, name):
+		nodeId = self.getNodeId(name)
+		if nodeId < 0: return False
+
+		self.__killEdges(np.union1d(self.getOutputEdges(nodeId), self.getInputEdges(nodeId)))
+		self.alive.data[nodeId] = False
+		for sparse in (self.properties, self.parameters, self.overrides):
+			sparse.pop(nodeId, None)
+
+		return True
+
+	def renameNode(self, name, newName):
+		nodeId = self.getNodeId(name)
+		if nodeId < 0 or self.hasNode(newName): return False
+
+		# A deleted node of that name keeps its id, it just can no longer be looked up
+		self.names.ids.pop(newName, None)
+		self.names.rename(name, newName)
+		return True
+
+	def getNodeIdsByType(self, type):
+		typeId = self.typeNames.lookup(type)
+		if typeId < 0: return np.zeros(0, np.int64)
+		return np.flatnonzero((self.nodeTypes.view() == typeId) & self.alive.view())
+
+	def getNodeIdsByBaseType(self, baseType):
+		typeIds = [typeId for typeId, typeBaseType in self.baseTypes.iteritems() if typeBaseType == baseType]
+		return np.flatnonzero(np.in1d(self.nodeTypes.view(), typeIds) & self.alive.view())
+
+	def getNames(self, nodeIds=None):
+		if nodeIds is None: nodeIds = np.flatnonzero(self.alive.view())
+		strings = self.names.strings
+		return [strings[nodeId] for nodeId in nodeIds.tolist()]
+
+	def getName(self, nodeId):
+		return self.names.getString(nodeId)
+
+	def getType(self, nodeId):
+		return self.typeNames.getString(self.nodeTypes.data[nodeId])
+
+	def getBaseType(self, nodeId):
+		return self.baseTypes.get(self.nodeTypes.data[nodeId])
+
+	# Edges
+
+	def connect(self, nodeFrom, portOut, nodeTo, portIn):
+		'''
+		Adds a single connection by name unless it exists, returns True if it was added
+		'''
+		srcId, dstId = self.getNodeId(nodeFrom), self.getNodeId(nodeTo)
+		if srcId < 0 or dstId < 0 or srcId == dstId: return False
+
+		row = (srcId, self.portNames.intern(portOut), dstId, self.portNames.intern(portIn))
+		edges = self.edges.data
+		for edgeId in self.getInputEdges(dstId):
+			if tuple(edges[edgeId]) == row: return False
+
+		edgeId = self.edges.append(row)
+		self.edgeAlive.append(True)
+		self.outputIndex.add((srcId,), (edgeId,))
+		self.inputIndex.add((dstId,), (edgeId,))
+		return True
+
+	def addEdges(self, srcIds, srcPortIds, dstIds, dstPortIds):
+		'''
+		Bulk insert of connections by id, duplicates are not checked
+		'''
+		rows = np.column_stack((srcIds, srcPortIds, dstIds, dstPortIds)).astype(np.int32)
+		start = self.edges.extend(rows)
+		self.edgeAlive.extend(np.ones(len(rows), np.bool_))
+
+		edgeIds = np.arange(start, start + len(rows), dtype=np.int32)
+		self.outputIndex.add(rows[:, 0], edgeIds)
+		self.inputIndex.add(rows[:, 2], edgeIds)
+
+	def disconnect(self, nodeFrom, portOut, nodeTo, portIn):
+		srcId, dstId = self.getNodeId(nodeFrom), self.getNodeId(nodeTo)
+		if srcId < 0 or dstId < 0: return False
+
+		row = (srcId, self.portNames.lookup(portOut), dstId, self.portNames.lookup(portIn))
+		edges = self.edges.data
+		for edgeId in self.getInputEdges(dstId):
+			if tuple(edges[edgeId]) == row:
+				self.__killEdges([edgeId])
+				return True
+
+		return False
+
+	def __killEdges(self, edgeIds):
+		self.edgeAlive.data[edgeIds] = False
+		self.numDeadEdges += len(edgeIds)
+
+		# Dead edges are skipped on every lookup until the indexes drop them
+		if self.numDeadEdges > max(1024, len(self.edges) >> 1):
+			edges, edgeAlive = self.edges.view(), self.edgeAlive.view()
+			self.outputIndex.compact(edges, edgeAlive)
+			self.inputIndex.compact(edges, edgeAlive)
+			self.numDeadEdges = 0
+
+	def getNumEdges(self):
+		return int(np.count_nonzero(self.edgeAlive.view()))
+
+	def __getEdges(self, index, nodeId):
+		edgeIds = index.get(nodeId)
+		return edgeIds[self.edgeAlive.data[edgeIds]]
+
+	def getOutputEdges(self, nodeId):
+		return self.__getEdges(self.outputIndex, nodeId)
+
+	def getInputEdges(self, nodeId):
+		return self.__getEdges(self.inputIndex, nodeId)
+
+	def getSourceIds(self, nodeId):
+		'''
+		:return: ids of the nodes connected to the inputs of a node
+		'''
+		return np.unique(self.edges.data[self.getInputEdges(nodeId), 0])
+
+	def getTargetIds(self, nodeId):
+		return np.unique(self.edges.data[self.getOutputEdges(nodeId), 2])
+
+	def getEdge(self, edgeId):
+		'''
+		:return: (nodeFrom, portOut, nodeTo, portIn) names of a connection
+		'''
+		src, srcPort, dst, dstPort = self.edges.data[edgeId]
+		return self.names.getString(src), self.portNames.getString(srcPort), self.names.getString(dst), self.portNames.getString(dstPort)
+
+	def getConnections(self):
+		return [self.getEdge(edgeId) for edgeId in np.flatnonzero(self.edgeAlive.view())]
+
+	# Sparse per-node data
+
+	def getProperties(self, nodeId):
+		return self.properties.setdefault(nodeId, {})
+
+	def getMemoryUsage(self):
+		'''
+		Bytes held by the columns and the CSR indexes, not counting the interned strings
+		'''
+		columns = (self.nodeTypes, self.alive, self.positions, self.edges, self.edgeAlive)
+		numBytes = sum(column.getNumBytes() for column in columns)
+		numBytes += self.outputIndex.getNumBytes() + self.inputIndex.getNumBytes()
+		return numBytes
+
+	@classmethod
+	def fromIndex(cls, index, registerTypes=True):
+		'''
+		Builds a store straight from an AssIndex without creating any Nodegraph nodes.
+		References are resolved the way the scene builder does.
+		'''
+		store = cls()
+		entries = index.getEntries()
+		if registerTypes:
+			for type in set(entry.type for entry in entries):
+				store.registerNodegraphType(type)
+
+		store.addNodes([entry.name for entry in entries], [entry.type for entry in entries])
+
+		# The output port of a node is the first registered one, 'out' otherwise
+		outputPorts = {}
+		for typeId in xrange(len(store.typeNames)):
+			ports = store.typeOutputs.get(typeId)
+			outputPorts[typeId] = ports[0] if ports else store.portNames.intern('out')
+
+		lookup = store.names.lookup
+		internPort = store.portNames.intern
+		nodeTypes = store.nodeTypes.data
+		srcIds, srcPorts, dstIds, dstPorts = [], [], [], []
+		for dstId, entry in enumerate(entries):
+			for paramName, name in entry.getReferences():
+				srcId = lookup(name)
+				if srcId < 0:
+					# Component links, e.g. image1.r
+					srcId = lookup(name.rsplit('.', 1)[0])
+					if srcId < 0: continue
+
+				srcIds.append(srcId)
+				srcPorts.append(outputPorts[nodeTypes[srcId]])
+				dstIds.append(dstId)
+				dstPorts.append(internPort(paramName))
+
+		store.addEdges(srcIds, srcPorts, dstIds, dstPorts)
+		return store
+
+
+class PortProxy(object):
+	'''
+	Nodegraph Port API on top of a GraphStore
+	'''
+	__slots__ = ('store', 'nodeId', 'portId', 'type')
+
+	def __init__(self, store, nodeId, portId, type):
+		self.store = store
+		self.nodeId = nodeId
+		self.portId = portId
+		self.type = type
+
+	def getName(self):
+		return self.store.portNames.getString(self.portId)
+
+	def getType(self):
+		return self.type
+
+	def getNode(self):
+		return NodeProxy(self.store, self.nodeId)
+
+	def getConnectedPorts(self):
+		store = self.store
+		edges = store.edges.data
+		if self.type == 'in':
+			return [PortProxy(store, edges[edgeId, 0], edges[edgeId, 1], 'out') for edgeId in store.getInputEdges(self.nodeId)
+					if edges[edgeId, 3] == self.portId]
+
+		return [PortProxy(store, edges[edgeId, 2], edges[edgeId, 3], 'in') for edgeId in store.getOutputEdges(self.nodeId)
+				if edges[edgeId, 1] == self.portId]
+
+	def isConnected(self, port):
+		return port in self.getConnectedPorts()
+
+	def connect(self, port):
+		if port.getType() == self.type: return False
+		output, input = (self, port) if self.type == 'out' else (port, self)
+		return self.store.connect(output.getNode().getName(), output.getName(), input.getNode().getName(), input.getName())
+
+	def __eq__(self, other):
+		return (isinstance(other, PortProxy) and self.store is other.store and self.nodeId == other.nodeId
+				and self.portId == other.portId and self.type == other.type)
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __hash__(self):
+		return hash((self.nodeId, self.portId, self.type))
+
+
+class NodeProxy(object):
+	'''
+	Nodegraph Node API on top of a GraphStore. The ports are the registered
+	ports of the node's type plus any port which has a connection.
+	'''
+	__slots__ = ('store', 'id')
+
+	def __init__(self, store, id):
+		self.store = store
+		self.id = id
+
+	def getName(self):
+		return self.store.getName(self.id)
+
+	def getType(self):
+		return self.store.getType(self.id)
+
+	def getBaseType(self):
+		return self.store.getBaseType(self.id)
+
+	@property
+	def properties(self):
+		return self.store.getProperties(self.id)
+
+	def __ports(self, type):
+		store = self.store
+		typeId = store.nodeTypes.data[self.id]
+		if type == 'in':
+			portIds = list(store.typeInputs.get(typeId, ()))
+			portIds.extend(store.edges.data[store.getInputEdges(self.id), 3])
+		else:
+			portIds = list(store.typeOutputs.get(typeId, ()))
+			portIds.extend(store.edges.data[store.getOutputEdges(self.id), 1])
+
+		ports = {}
+		for portId in portIds:
+			name = store.portNames.getString(portId)
+			if name not in ports: ports[name] = PortProxy(store, self.id, portId, type)
+
+		return ports
+
+	def getInputPorts(self):
+		return self.__ports('in')
+
+	def getOutputPorts(self):
+		return self.__ports('out')
+
+	def getInputPort(self, name):
+		return self.getInputPorts().get(name)
+
+	def getOutputPort(self, name):
+		return self.getOutputPorts().get(name)
+
+	# Parameters follow the Node layout: shared definitions, sparse node definitions and overrides
+
+	@property
+	def registeredParameterMap(self):
+		return self.store.typeParameters.get(self.store.nodeTypes.data[self.id], {})
+
+	@property
+	def parameters(self):
+		return self.store.parameters.get(self.id)
+
+	def getParameterDefinition(self, name):
+		parameters = self.parameters
+		if parameters is not None and name in parameters: return parameters[name]
+		return self.registeredParameterMap.get(name)
+
+	def getParameterValue(self, name):
+		overrides = self.store.overrides.get(self.id)
+		if overrides is None: return None
+		return overrides.get(name)
+
+	def setParameterValue(self, name, value):
+		if value is None:
+			overrides = self.store.overrides.get(self.id)
+			if overrides: overrides.pop(name, None)
+			return
+
+		self.store.overrides.setdefault(self.id, {})[name] = value
+
+	def getOverrides(self):
+		return self.store.overrides.get(self.id) or {}
+
+	def getParameters(self):
+		import Nodegraph
+		return Nodegraph.ParameterMap(self)
+
+	def getParameter(self, name):
+		import Nodegraph
+		definition = self.getParameterDefinition(name)
+		if definition is None: return None
+		return Nodegraph.ParameterView(self, definition)
+
+	def __eq__(self, other):
+		return isinstance(other, NodeProxy) and self.store is other.store and self.id == other.id
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __hash__(self):
+		return hash(self.id)
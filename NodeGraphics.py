@@ -1,15 +1,79 @@
 import PySide.QtGui as QtGui
 import PySide.QtCore as QtCore
 import numpy as np
+from collections import OrderedDict
 
 import Events
+import Style
+import StyleCache
 
 import logging
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
 
+def getNodeSize(name, type, numInputs, numOutputs):
+	'''
+	:return: (width, height) of a node, wide enough for its name and type and high enough for its ports
+	'''
+	wordLength = max(len(name), len(type))
+	maxNumPorts = max(numInputs, numOutputs)
+	return max(100, wordLength * 8 + 10), max(60, maxNumPorts * 20 + 10)
+
+
+def getPortOffsets(height, numPorts):
+	'''
+	:return: vertical offsets of the port centres from the top of a node
+	'''
+	return np.linspace(0, height, numPorts + 2, endpoint=True)[1:-1]
+
+
+class NodeRecord(object):
+	'''
+	What the view keeps of every node, whether or not it currently has a NodeItem:
+	its geometry, its ports and their connections. The ports map the (node, port)
+	pairs they are connected to to the ids of the edges in the EdgeLayer.
+	'''
+
+	__slots__ = ('name', 'type', 'style', 'x', 'y', 'width', 'height', 'inputs', 'outputs', 'selected', 'item')
+
+	def __init__(self, name, type, style, position):
+		self.name = name
+		self.type = type
+		self.style = style
+		self.x, self.y = position
+		self.inputs = OrderedDict()
+		self.outputs = OrderedDict()
+		self.selected = False
+		self.item = None
+		self.updateSize()
+
+	def updateSize(self):
+		self.width, self.height = getNodeSize(self.name, self.type, len(self.inputs), len(self.outputs))
+
+	def getRect(self):
+		return (self.x, self.y, self.width, self.height)
+
+	def intersects(self, rect):
+		x, y, width, height = rect
+		return self.x < x + width and x < self.x + self.width and self.y < y + height and y < self.y + self.height
+
+	def getPortCentre(self, portName, output=False):
+		ports = self.outputs if output else self.inputs
+		offsets = getPortOffsets(self.height, len(ports))
+		y = self.y + offsets[ports.keys().index(portName)]
+		return QtCore.QPointF(self.x + self.width if output else self.x, y)
+
+	def isSelected(self):
+		if self.item is not None: return self.item.isSelected()
+		return self.selected
+
+
 class Noodle(QtGui.QGraphicsPathItem):
+	'''
+	Connection being dragged from a port, made connections are drawn by the EdgeLayer
+	'''
+
 	def __init__(self, pointA, pointB):
 		super(Noodle, self).__init__()
 		self._pointA = pointA
@@ -18,10 +82,7 @@ class Noodle(QtGui.QGraphicsPathItem):
 		self._target = None
 		self.setZValue(-1)
 		self.setBrush(QtCore.Qt.NoBrush)
-		self.pen = QtGui.QPen()
-		self.pen.setStyle(QtCore.Qt.SolidLine)
-		self.pen.setWidth(2)
-		self.pen.setColor(QtGui.QColor(150, 150, 150, 255))
+		self.pen = StyleCache.getNoodlePen()
 		self.setPen(self.pen)
 
 	def mousePressEvent(self, event):
@@ -41,7 +102,17 @@ class Noodle(QtGui.QGraphicsPathItem):
 		self.setPath(path)
 
 	def paint(self, painter, option, widget):
+		lod = option.levelOfDetailFromTransform(painter.worldTransform())
+		# The view does not save the painter state, the brush is whatever the last item left
 		painter.setPen(self.pen)
+		painter.setBrush(QtCore.Qt.NoBrush)
+		if lod < Style.levelOfDetail['flat']:
+			# Too far out to see the curve
+			painter.setRenderHint(QtGui.QPainter.Antialiasing, False)
+			painter.drawLine(self._pointA, self._pointB)
+			return
+
+		painter.setRenderHint(QtGui.QPainter.Antialiasing, lod >= Style.levelOfDetail['full'])
 		painter.drawPath(self.path())
 
 	@property
@@ -79,6 +150,252 @@ class Noodle(QtGui.QGraphicsPathItem):
 		self._target = widget
 
 
+class EdgeTile(object):
+	'''
+	Edges whose bounds are centred in one square of the scene, drawn as a single cached path
+	'''
+
+	__slots__ = ('edges', 'bounds', 'path', 'linePath')
+
+	def __init__(self):
+		self.edges = set()
+		self.bounds = QtCore.QRectF()
+		self.path = None
+		self.linePath = None
+
+
+class EdgeLayer(QtGui.QGraphicsItem):
+	'''
+	Draws every connection of the scene from a single item. The end points live in
+	NumPy arrays, moving a node only marks its edges dirty and the control points
+	of all dirty edges are recomputed together before the next paint.
+
+	Edges are grouped into tiles which each keep a QPainterPath, painting draws the
+	paths of the tiles which intersect the exposed rect and only tiles with changed
+	edges are rebuilt.
+
+	:param sceneRect: QRectF the edges can be anywhere in
+	:param tileSize: width and height of a tile in scene units
+	'''
+
+	def __init__(self, sceneRect, tileSize=1024.0):
+		super(EdgeLayer, self).__init__()
+		self.sceneRect = QtCore.QRectF(sceneRect)
+		self.tileSize = float(tileSize)
+		self.setZValue(-1)
+		self.setAcceptedMouseButtons(QtCore.Qt.NoButton)
+		self.setFlag(QtGui.QGraphicsItem.ItemUsesExtendedStyleOption)
+		self.pen = StyleCache.getNoodlePen()
+		self.emptyShape = QtGui.QPainterPath()
+
+		capacity = 1024
+		# Per edge: end points (ax, ay, bx, by), control points (c1x, c1y, c2x, c2y) and tile
+		self.points = np.zeros((capacity, 4), dtype=np.float64)
+		self.controls = np.zeros((capacity, 4), dtype=np.float64)
+		self.edgeTiles = np.zeros((capacity, 2), dtype=np.int64)
+		self.alive = np.zeros(capacity, dtype=np.bool_)
+		self.freeIds = []
+		self.numEdges = 0
+		self.size = 0
+
+		self.tiles = {}
+		self.dirtyEdges = set()
+		self.dirtyTiles = set()
+
+	def __grow(self, capacity):
+		for name in ('points', 'controls', 'edgeTiles', 'alive'):
+			array = getattr(self, name)
+			grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+			grown[:len(array)] = array
+			setattr(self, name, grown)
+
+	def getNumEdges(self):
+		return self.numEdges
+
+	def addEdge(self, pointA, pointB):
+		'''
+		:return: id of the new edge
+		'''
+		if self.freeIds:
+			edgeId = self.freeIds.pop()
+		else:
+			edgeId = self.size
+			self.size += 1
+			if edgeId >= len(self.alive): self.__grow(len(self.alive) * 2)
+
+		self.points[edgeId] = (pointA.x(), pointA.y(), pointB.x(), pointB.y())
+		self.edgeTiles[edgeId] = (-1, -1)
+		self.alive[edgeId] = True
+		self.numEdges += 1
+		self.dirtyEdges.add(edgeId)
+		self.__updateEdgeRect(edgeId)
+		return edgeId
+
+	def removeEdge(self, edgeId):
+		if not self.alive[edgeId]: return
+		self.__updateEdgeRect(edgeId)
+		self.alive[edgeId] = False
+		self.numEdges -= 1
+		self.dirtyEdges.discard(edgeId)
+
+		tileKey = tuple(self.edgeTiles[edgeId])
+		tile = self.tiles.get(tileKey)
+		if tile is not None:
+			tile.edges.discard(edgeId)
+			self.dirtyTiles.add(tileKey)
+		self.freeIds.append(edgeId)
+
+	def setSource(self, edgeId, point):
+		self.__updateEdgeRect(edgeId)
+		self.points[edgeId, 0] = point.x()
+		self.points[edgeId, 1] = point.y()
+		self.dirtyEdges.add(edgeId)
+		self.__updateEdgeRect(edgeId)
+
+	def setTarget(self, edgeId, point):
+		self.__updateEdgeRect(edgeId)
+		self.points[edgeId, 2] = point.x()
+		self.points[edgeId, 3] = point.y()
+		self.dirtyEdges.add(edgeId)
+		self.__updateEdgeRect(edgeId)
+
+	def __updateEdgeRect(self, edgeId):
+		# The control points lie between the end points so the curve stays within their rect
+		ax, ay, bx, by = self.points[edgeId].tolist()
+		width = self.pen.widthF()
+		self.update(min(ax, bx) - width, min(ay, by) - width, abs(bx - ax) + 2 * width, abs(by - ay) + 2 * width)
+
+	def __flush(self):
+		'''
+		Brings the control points and the tiles of the dirty edges up to date
+		'''
+		if self.dirtyEdges:
+			edgeIds = np.fromiter(self.dirtyEdges, dtype=np.int64, count=len(self.dirtyEdges))
+			self.dirtyEdges = set()
+
+			points = self.points[edgeIds]
+			delta = points[:, 2:4] - points[:, 0:2]
+			controls = self.controls
+			controls[edgeIds, 0] = points[:, 0] + delta[:, 0] * 0.25
+			controls[edgeIds, 1] = points[:, 1] + delta[:, 1] * 0.1
+			controls[edgeIds, 2] = points[:, 0] + delta[:, 0] * 0.75
+			controls[edgeIds, 3] = points[:, 1] + delta[:, 1] * 0.9
+
+			centres = (points[:, 0:2] + points[:, 2:4]) * 0.5
+			newTiles = np.floor(centres / self.tileSize).astype(np.int64)
+			oldTiles = self.edgeTiles[edgeIds]
+			self.edgeTiles[edgeIds] = newTiles
+
+			for edgeId, oldTile, newTile in zip(edgeIds.tolist(), map(tuple, oldTiles.tolist()), map(tuple, newTiles.tolist())):
+				if oldTile != newTile:
+					tile = self.tiles.get(oldTile)
+					if tile is not None:
+						tile.edges.discard(edgeId)
+						self.dirtyTiles.add(oldTile)
+					tile = self.tiles.get(newTile)
+					if tile is None: tile = self.tiles[newTile] = EdgeTile()
+					tile.edges.add(edgeId)
+				self.dirtyTiles.add(newTile)
+
+		for tileKey in self.dirtyTiles:
+			tile = self.tiles.get(tileKey)
+			if tile is None: continue
+			if not tile.edges:
+				del self.tiles[tileKey]
+				continue
+
+			edgeIds = np.fromiter(tile.edges, dtype=np.int64, count=len(tile.edges))
+			points = self.points[edgeIds]
+			minX = min(points[:, 0].min(), points[:, 2].min())
+			minY = min(points[:, 1].min(), points[:, 3].min())
+			maxX = max(points[:, 0].max(), points[:, 2].max())
+			maxY = max(points[:, 1].max(), points[:, 3].max())
+			width = self.pen.widthF()
+			tile.bounds = QtCore.QRectF(minX - width, minY - width, maxX - minX + 2 * width, maxY - minY + 2 * width)
+			tile.path = None
+			tile.linePath = None
+
+		self.dirtyTiles = set()
+
+	def __getPath(self, tile, lines):
+		if lines:
+			if tile.linePath is None:
+				path = tile.linePath = QtGui.QPainterPath()
+				for ax, ay, bx, by in self.points[sorted(tile.edges)].tolist():
+					path.moveTo(ax, ay)
+					path.lineTo(bx, by)
+			return tile.linePath
+
+		if tile.path is None:
+			edgeIds = sorted(tile.edges)
+			path = tile.path = QtGui.QPainterPath()
+			for (ax, ay, bx, by), (c1x, c1y, c2x, c2y) in zip(self.points[edgeIds].tolist(), self.controls[edgeIds].tolist()):
+				path.moveTo(ax, ay)
+				path.cubicTo(c1x, c1y, c2x, c2y, bx, by)
+		return tile.path
+
+	def boundingRect(self):
+		return self.sceneRect
+
+	def shape(self):
+		# Edges are not picked, clicks and rubber band selections go to the nodes
+		return self.emptyShape
+
+	def paint(self, painter, option, widget):
+		self.__flush()
+
+		lod = option.levelOfDetailFromTransform(painter.worldTransform())
+		lines = lod < Style.levelOfDetail['flat']
+		painter.setRenderHint(QtGui.QPainter.Antialiasing, lod >= Style.levelOfDetail['full'])
+		painter.setPen(self.pen)
+		painter.setBrush(QtCore.Qt.NoBrush)
+
+		exposedRect = option.exposedRect
+		for tile in self.tiles.itervalues():
+			if tile.bounds.intersects(exposedRect):
+				painter.drawPath(self.__getPath(tile, lines))
+
+
+class NodeRecordLayer(QtGui.QGraphicsItem):
+	'''
+	Draws the nodes which have no NodeItem as flat rects, e.g. when zoomed out too
+	far for the node items to be worth having, see NodegraphView.realizeVisible
+
+	:param records: dict of node name to NodeRecord
+	:param index: SpatialIndex.GridIndex of the record rects
+	'''
+
+	def __init__(self, sceneRect, records, index):
+		super(NodeRecordLayer, self).__init__()
+		self.sceneRect = QtCore.QRectF(sceneRect)
+		self.records = records
+		self.index = index
+		self.setZValue(-0.5)
+		self.setAcceptedMouseButtons(QtCore.Qt.NoButton)
+		self.setFlag(QtGui.QGraphicsItem.ItemUsesExtendedStyleOption)
+		self.emptyShape = QtGui.QPainterPath()
+
+	def updateRecord(self, record):
+		self.update(record.x, record.y, record.width, record.height)
+
+	def boundingRect(self):
+		return self.sceneRect
+
+	def shape(self):
+		return self.emptyShape
+
+	def paint(self, painter, option, widget):
+		exposedRect = option.exposedRect
+		records = self.records
+		painter.setRenderHint(QtGui.QPainter.Antialiasing, False)
+		for name in self.index.query((exposedRect.x(), exposedRect.y(), exposedRect.width(), exposedRect.height())):
+			record = records[name]
+			if record.item is not None: continue
+			style = record.style
+			painter.fillRect(QtCore.QRectF(record.x, record.y, record.width, record.height),
+							 style.selectedColour if record.selected else style.colour)
+
+
 class NodePort(QtGui.QGraphicsItem):
 	def __init__(self, parent, rect, socketName, socketType):
 		super(NodePort, self).__init__(parent)
@@ -86,41 +403,17 @@ class NodePort(QtGui.QGraphicsItem):
 		self.name = socketName
 		self.type = socketType
 		self.parent = parent
+		self.socketRect = QtCore.QRectF(rect)
+		self.bounds = QtCore.QRectF(rect)
+
+		# Shared with every other port, see StyleCache. The label is drawn by the port
+		# itself and its bounds include the label so a highlight only repaints the port.
+		self.style = StyleCache.getPortStyle()
+		self.labelPos = QtCore.QPointF()
+		self.highlightLabelPos = QtCore.QPointF()
+		self.__updateLabels()
 
-		self.labelFont = QtGui.QFont('monospace')
-		self.labelFont.setPixelSize(6)
-		self.highlightLabelFont = QtGui.QFont('monospace')
-		self.highlightLabelFont.setPixelSize(10)
-		self.labelItem = QtGui.QGraphicsTextItem(self.name, self, self.scene())
-		self.labelItem.setDefaultTextColor(QtGui.QColor(200, 200, 200, 255))
-		self.labelItem.setFont(self.labelFont)
-
-		# Brush
-		self.brush = QtGui.QBrush()
-		self.brush.setStyle(QtCore.Qt.SolidPattern)
-		self.brush.setColor(QtGui.QColor(70, 70, 70, 255))
-
-		# Pen
-		self.pen = QtGui.QPen()
-		self.pen.setStyle(QtCore.Qt.SolidLine)
-		self.pen.setWidth(1)
-		self.pen.setColor(QtGui.QColor(50, 50, 50, 255))
-
-		# Pen - Highlighted
-		self.highlightPen = QtGui.QPen()
-		self.highlightPen.setStyle(QtCore.Qt.SolidLine)
-		self.highlightPen.setWidth(1)
-		self.highlightPen.setColor(QtGui.QColor(255, 255, 0, 255))
-
-		# Pen - Text
-		self.textPen = QtGui.QPen()
-		self.textPen.setColor(QtGui.QColor(230, 230, 230, 255))
-
-		# Lines
-		self.outLines = []
-		self.inLines = []
-
-		self.connectedPorts = []
+		self.newLine = None
 
 		self.highlight = False
 		self.setAcceptHoverEvents(True)
@@ -129,51 +422,85 @@ class NodePort(QtGui.QGraphicsItem):
 	def getName(self):
 		return self.name
 
-	def connect(self, port):
-		self.connectedPorts.append(port)
+	def setName(self, name):
+		# A recycled node item reuses its ports for the ports of another node
+		self.prepareGeometryChange()
+		self.name = name
+		self.highlight = False
+		self.__updateLabels()
+		self.update()
 
 	def getNode(self):
 		return self.parent
 
-	def getConnectedPorts(self):
-		return self.connectedPorts
+	def __updateLabels(self):
+		self.label = StyleCache.getStaticText(self.name, self.style.labelFont)
+		self.highlightLabel = StyleCache.getStaticText(self.name, self.style.highlightLabelFont)
+		self.labelSize = self.label.size()
+		self.highlightLabelSize = self.highlightLabel.size()
+		self.__updateGeometry()
+
+	def __updateGeometry(self):
+		socketRect = self.socketRect
+		centreY = socketRect.center().y()
+		if self.type == 'in':
+			self.labelPos.setX(socketRect.left() - self.labelSize.width())
+			self.highlightLabelPos.setX(socketRect.left() - self.highlightLabelSize.width())
+		else:
+			self.labelPos.setX(socketRect.right())
+			self.highlightLabelPos.setX(socketRect.right())
+		self.labelPos.setY(centreY - self.labelSize.height() / 2)
+		self.highlightLabelPos.setY(centreY - self.highlightLabelSize.height() / 2)
+
+		# The highlighted label is the larger one
+		labelRect = QtCore.QRectF(self.highlightLabelPos, self.highlightLabelSize)
+		self.bounds = socketRect.united(labelRect)
 
 	def shape(self):
+		# Only the socket reacts to the mouse, not its label
 		path = QtGui.QPainterPath()
-		path.addEllipse(self.boundingRect())
+		path.addEllipse(self.socketRect)
 		return path
 
 	def boundingRect(self):
-		return QtCore.QRectF(self.rect)
+		return self.bounds
+
+	def updateX(self, x):
+		self.prepareGeometryChange()
+		self.rect.moveLeft(x)
+		self.socketRect.moveLeft(x)
+		self.__updateGeometry()
+		self.update()
 
 	def updateY(self, y):
+		self.prepareGeometryChange()
 		self.rect.moveTop(y)
+		self.socketRect.moveTop(y)
+		self.__updateGeometry()
 		self.update()
 
 	def getCentre(self):
-		rect = self.boundingRect()
+		rect = self.socketRect
 		centre = QtCore.QPointF(rect.x() + rect.width() / 2, rect.y() + rect.height() / 2)
 		centre = self.mapToScene(centre)
 		return centre
 
 	def paint(self, painter, option, widget):
-		if self.highlight:
-			painter.setPen(self.highlightPen)
-			self.labelItem.setFont(self.highlightLabelFont)
-		else:
-			painter.setPen(self.pen)
-			self.labelItem.setFont(self.labelFont)
+		if option.levelOfDetailFromTransform(painter.worldTransform()) < Style.levelOfDetail['full']: return
 
-		painter.setBrush(self.brush)
+		style = self.style
+		painter.setRenderHint(QtGui.QPainter.Antialiasing)
+		painter.setBrush(style.brush)
+		painter.setPen(style.highlightPen if self.highlight else style.pen)
 		painter.drawEllipse(self.rect)
 
-		bounds = self.boundingRect()
-		textBounds = self.labelItem.boundingRect()
-		d = bounds.height() / 2 - textBounds.height() / 2
-		if self.type == 'in':
-			self.labelItem.setPos(bounds.x() - textBounds.width(), bounds.y() + d)
+		painter.setPen(style.labelPen)
+		if self.highlight:
+			painter.setFont(style.highlightLabelFont)
+			painter.drawStaticText(self.highlightLabelPos, self.highlightLabel)
 		else:
-			self.labelItem.setPos(bounds.x() + bounds.width(), bounds.y() + d)
+			painter.setFont(style.labelFont)
+			painter.drawStaticText(self.labelPos, self.label)
 
 	def hoverEnterEvent(self, event):
 		if not self.highlight:
@@ -191,7 +518,6 @@ class NodePort(QtGui.QGraphicsItem):
 			pointB = self.mapToScene(event.pos())
 
 			self.newLine = Noodle(pointA, pointB)
-			self.outLines.append(self.newLine)
 			self.scene().addItem(self.newLine)
 
 		elif self.type == 'in':
@@ -199,7 +525,6 @@ class NodePort(QtGui.QGraphicsItem):
 			pointB = self.getCentre()
 
 			self.newLine = Noodle(pointA, pointB)
-			self.inLines.append(self.newLine)
 			self.scene().addItem(self.newLine)
 
 		else:
@@ -219,9 +544,9 @@ class NodePort(QtGui.QGraphicsItem):
 
 	def mouseReleaseEvent(self, event):
 		item = self.scene().itemAt(event.scenePos().toPoint())
-		if item is None: return
-
-		if self.type == 'out' and item.type == 'in':
+		if item is None or not isinstance(item, NodePort):
+			pass
+		elif self.type == 'out' and item.type == 'in':
 			Events.queueEvent('port_connect', nodeFrom=self.parent.getName(), nodeTo=item.parentItem().getName(),
 							  portIn=item.name, portOut=self.name)
 		elif self.type == 'in' and item.type == 'out':
@@ -231,6 +556,7 @@ class NodePort(QtGui.QGraphicsItem):
 			super(NodePort, self).mouseReleaseEvent(event)
 
 		self.scene().removeItem(self.newLine)
+		self.newLine = None
 		Events.processEvents()
 
 
@@ -238,8 +564,8 @@ class NodeItem(QtGui.QGraphicsItem):
 	def __init__(self, name, type):
 		super(NodeItem, self).__init__()
 
-		self.inputs = {}
-		self.outputs = {}
+		self.inputs = OrderedDict()
+		self.outputs = OrderedDict()
 
 		self.initUi()
 
@@ -247,19 +573,61 @@ class NodeItem(QtGui.QGraphicsItem):
 		self.setName(name)
 
 	def addInputPort(self, portName):
-		y = self.height / 2 - self.portHeight / 2
-		rect = QtCore.QRect(self.x - self.portWidth / 2, y, self.portWidth, self.portHeight)
-
-		self.inputs[portName] = NodePort(self, rect, portName, 'in')
-		self.__updatePorts()
+		self.addInputPorts([portName])
 
 	def addOutputPort(self, portName):
-		y = self.height / 2 - self.portHeight / 2
-		rect = QtCore.QRect(self.width - self.portWidth / 2, y, self.portWidth, self.portHeight)
-
-		self.outputs[portName] = NodePort(self, rect, portName, 'out')
+		self.addOutputPorts([portName])
+
+	def addInputPorts(self, portNames):
+		'''
+		Adds several ports with a single layout pass
+		'''
+		self.setPorts(self.inputs.keys() + list(portNames), self.outputs.keys())
+
+	def addOutputPorts(self, portNames):
+		self.setPorts(self.inputs.keys(), self.outputs.keys() + list(portNames))
+
+	def setPorts(self, inputNames, outputNames):
+		'''
+		Lays out the given ports, reusing the port items the node has already
+		'''
+		self.inputs = self.__reusePorts(self.inputs, inputNames, 'in', self.x - self.portWidth / 2)
+		self.outputs = self.__reusePorts(self.outputs, outputNames, 'out', self.width - self.portWidth / 2)
 		self.__updatePorts()
 
+	def __reusePorts(self, ports, portNames, portType, x):
+		unused = ports.values()
+		unused.reverse()
+		newPorts = OrderedDict()
+		for portName in portNames:
+			port = ports.get(portName)
+			if port is not None and port in unused:
+				unused.remove(port)
+			elif unused:
+				port = unused.pop()
+				port.setName(portName)
+			else:
+				y = self.height / 2 - self.portHeight / 2
+				port = NodePort(self, QtCore.QRect(x, y, self.portWidth, self.portHeight), portName, portType)
+			newPorts[portName] = port
+
+		for port in unused:
+			port.setParentItem(None)
+			scene = port.scene()
+			if scene is not None: scene.removeItem(port)
+
+		return newPorts
+
+	def setNode(self, name, type, inputNames, outputNames):
+		'''
+		Shows another node, e.g. when the item is recycled for a NodeRecord
+		'''
+		self.type = type
+		self.setPorts(inputNames, outputNames)
+		for port in self.inputs.values() + self.outputs.values():
+			port.highlight = False
+		self.setName(name)
+
 	def getInputPorts(self):
 		return self.inputs.values()
 
@@ -271,12 +639,12 @@ class NodeItem(QtGui.QGraphicsItem):
 		self.__updateSize()
 
 		# Input ports
-		socketPositions = np.linspace(0, self.height, len(self.inputs) + 2, endpoint=True)[1:-1]
+		socketPositions = getPortOffsets(self.height, len(self.inputs))
 		for (portName, port), posY in zip(self.inputs.iteritems(), socketPositions):
 			port.updateY(posY - self.portHeight / 2)
 
 		# Output ports
-		socketPositions = np.linspace(0, self.height, len(self.outputs) + 2, endpoint=True)[1:-1]
+		socketPositions = getPortOffsets(self.height, len(self.outputs))
 		for (portName, port), posY in zip(self.outputs.iteritems(), socketPositions):
 			port.updateY(posY - self.portHeight / 2)
 
@@ -287,41 +655,40 @@ class NodeItem(QtGui.QGraphicsItem):
 		self.rect = QtCore.QRect(self.x, self.y, self.width, self.height)
 		self.setFlag(QtGui.QGraphicsItem.ItemIsMovable)
 		self.setFlag(QtGui.QGraphicsItem.ItemIsSelectable)
+		# Every move, including those of the other selected nodes, reaches itemChange
+		self.setFlag(QtGui.QGraphicsItem.ItemSendsGeometryChanges)
 
 		self.portWidth, self.portHeight = 10, 10
+		self.bounds = QtCore.QRectF(self.rect)
 
-		# Brush
-		self.brush = QtGui.QBrush()
-		self.brush.setStyle(QtCore.Qt.SolidPattern)
-		self.brush.setColor(QtGui.QColor(120, 120, 120, 255))
-
-		# Pen
-		self.pen = QtGui.QPen()
-		self.pen.setStyle(QtCore.Qt.SolidLine)
-		self.pen.setWidth(1)
-		self.pen.setColor(QtGui.QColor(60, 60, 60, 255))
-
-		self.selPen = QtGui.QPen()
-		self.selPen.setStyle(QtCore.Qt.SolidLine)
-		self.selPen.setWidth(1)
-		self.selPen.setColor(QtGui.QColor(255, 255, 0, 255))
-
-		# Pen - Text
-		self.textPen = QtGui.QPen()
-		self.textPen.setColor(QtGui.QColor(230, 230, 230, 255))
+		# Shared with every node of the same colours, see StyleCache
+		self.style = StyleCache.getNodeStyleForType('default')
+		self.label = None
+		self.labelPos = QtCore.QPointF()
 
 	def setName(self, name):
+		self.prepareGeometryChange()
 		self.name = name if name else 'Anonyomus'
 		self.__updateSize()
 
+		# Output ports follow the right edge as the width depends on the name
+		for portName, port in self.outputs.iteritems():
+			port.updateX(self.width - self.portWidth / 2)
+		self.updatePortsAndNoodles()
+
 	def getName(self):
 		return self.name
 
+	def setStyle(self, style):
+		self.style = style
+		self.__updateLabel()
+		self.update()
+
 	def setColour(self, colour):
-		self.brush.setColor(QtGui.QColor(colour[0], colour[1], colour[2], colour[3]))
+		self.setStyle(StyleCache.getNodeStyle(colour, self.style.textPen.color().getRgb()))
 
 	def setFontColour(self, colour):
-		self.textPen.setColor(QtGui.QColor(colour[0], colour[1], colour[2], colour[3]))
+		self.setStyle(StyleCache.getNodeStyle(self.style.brush.color().getRgb(), colour))
 
 	def getCentre(self):
 		rect = self.boundingRect()
@@ -340,64 +707,66 @@ class NodeItem(QtGui.QGraphicsItem):
 		return self.mapToScene(self.rect)
 
 	def __updateSize(self):
-		# Update width based on name
-		wordLength = max(len(self.name), len(self.type))
-		self.width = max(100, wordLength * 8 + 10)
-
-		# Update height based on number of ports (10 each plus padding)
-		maxNumPorts = max(len(self.inputs), len(self.outputs))
-		self.height = max(60, maxNumPorts * 20 + 10)
+		# Width based on the name, height based on the number of ports
+		self.width, self.height = getNodeSize(self.name, self.type, len(self.inputs), len(self.outputs))
 
 		self.rect.setWidth(self.width)
 		self.rect.setHeight(self.height)
+		self.bounds.setWidth(self.width)
+		self.bounds.setHeight(self.height)
+		self.__updateLabel()
+
+	def __updateLabel(self):
+		# Laid out once here so painting only draws it, node names hardly ever repeat so it is not shared
+		self.label = StyleCache.createStaticText(self.name, self.style.font)
+		size = self.label.size()
+		self.labelPos.setX(self.rect.x() + (self.width - size.width()) / 2)
+		self.labelPos.setY(self.rect.y() + (self.height - size.height()) / 2)
 
 	def shape(self):
 		path = QtGui.QPainterPath()
-		path.addRect(self.boundingRect())
+		path.addRect(self.bounds)
 		return path
 
 	def boundingRect(self):
-		return QtCore.QRectF(self.rect)
+		return self.bounds
 
 	def paint(self, painter, option, widget):
-		painter.setBrush(self.brush)
+		lod = option.levelOfDetailFromTransform(painter.worldTransform())
+		style = self.style
+		if lod < Style.levelOfDetail['flat']:
+			painter.fillRect(self.rect, style.selectedColour if self.isSelected() else style.colour)
+			return
+
+		painter.setBrush(style.brush)
 		if self.isSelected():
-			painter.setPen(self.selPen)
+			painter.setPen(style.selectedPen)
 		else:
-			painter.setPen(self.pen)
-
-		painter.setRenderHints(
-			QtGui.QPainter.Antialiasing |
-			QtGui.QPainter.SmoothPixmapTransform |
-			QtGui.QPainter.HighQualityAntialiasing)
-
-		painter.drawRoundedRect(self.rect, 6.0, 6.0)
+			painter.setPen(style.pen)
+
+		if lod >= Style.levelOfDetail['full']:
+			painter.setRenderHints(
+				QtGui.QPainter.Antialiasing |
+				QtGui.QPainter.SmoothPixmapTransform |
+				QtGui.QPainter.HighQualityAntialiasing)
+			painter.drawRoundedRect(self.rect, 6.0, 6.0)
+		else:
+			painter.setRenderHint(QtGui.QPainter.Antialiasing, False)
+			painter.drawRect(self.rect)
 
-		font = QtGui.QFont('monospace')
-		painter.setFont(font)
-		textOption = QtGui.QTextOption()
-		textOption.setAlignment(QtCore.Qt.AlignCenter)
-		painter.setPen(self.textPen)
-		# nodeLabel = '{}\n({})'.format(self.name, self.type)
-		nodeLabel = self.name
-		painter.drawText(self.rect, nodeLabel, textOption)
+		painter.setFont(style.font)
+		painter.setPen(style.textPen)
+		painter.drawStaticText(self.labelPos, self.label)
 
-	def mouseMoveEvent(self, event):
-		super(NodeItem, self).mouseMoveEvent(event)
-		self.updatePortsAndNoodles()
+	def itemChange(self, change, value):
+		if change == QtGui.QGraphicsItem.ItemPositionHasChanged:
+			self.updatePortsAndNoodles()
+		return super(NodeItem, self).itemChange(change, value)
 
 	def updatePortsAndNoodles(self):
-		for outputName, output in self.outputs.iteritems():
-			for line in output.outLines:
-				if line.source is not None and line.target is not None:
-					line.pointA = line.source.getCentre()
-					line.pointB = line.target.getCentre()
-
-		for inputName, input in self.inputs.iteritems():
-			for line in input.inLines:
-				if line.source is not None and line.target is not None:
-					line.pointA = line.source.getCentre()
-					line.pointB = line.target.getCentre()
+		# The scene moves the NodeRecord and the edges along, see NodegraphScene.moveNode
+		nodeItemMoved = getattr(self.scene(), 'nodeItemMoved', None)
+		if nodeItemMoved is not None: nodeItemMoved(self)
 
 	def contextMenuEvent(self, event):
 		pass
@@ -1,6 +1,7 @@
 from abc import ABCMeta, abstractproperty
-from arnold import *
+from collections import Mapping, OrderedDict
 import Events
+import RegistryCache
 
 import logging
 logging.basicConfig(level=logging.INFO)
@@ -8,12 +9,17 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
-class Parameter:
-	def __init__(self, name, type, default, value=None, hints={}):
+class Parameter(object):
+	'''
+	Parameter definition, shared by every node of a type. The value of a
+	node's parameter lives in the node, see ParameterView.
+	'''
+	__slots__ = ('name', 'type', 'default', 'hints')
+
+	def __init__(self, name, type, default, hints={}):
 		self.name = name
 		self.type = type
 		self.default = default
-		self.value = value
 		self.hints = hints
 
 	def getName(self):
@@ -25,11 +31,69 @@ class Parameter:
 	def getDefault(self):
 		return self.default
 
+	def getHints(self):
+		return self.hints
+
+
+class ParameterView(object):
+	'''
+	A node's parameter: the shared definition with the node's own value on top
+	'''
+	__slots__ = ('node', 'definition')
+
+	def __init__(self, node, definition):
+		self.node = node
+		self.definition = definition
+
+	def getName(self):
+		return self.definition.name
+
+	def getType(self):
+		return self.definition.type
+
+	def getDefault(self):
+		return self.definition.default
+
 	def getValue(self):
-		return self.value
+		return self.node.getParameterValue(self.definition.name)
+
+	def setValue(self, value):
+		self.node.setParameterValue(self.definition.name, value)
+
+	def isOverridden(self):
+		return self.getValue() is not None
 
 	def getHints(self):
-		return self.hints
+		return self.definition.hints
+
+	value = property(getValue, setValue)
+
+
+class ParameterMap(Mapping):
+	'''
+	Read-only mapping of parameter name to ParameterView for a node, built on
+	demand from the node type's definitions and the node's own ones
+	'''
+
+	def __init__(self, node):
+		self.node = node
+
+	def __getitem__(self, name):
+		definition = self.node.getParameterDefinition(name)
+		if definition is None: raise KeyError(name)
+		return ParameterView(self.node, definition)
+
+	def __iter__(self):
+		registered = self.node.registeredParameterMap
+		for name in registered:
+			yield name
+
+		if self.node.parameters:
+			for name in self.node.parameters:
+				if name not in registered: yield name
+
+	def __len__(self):
+		return sum(1 for _ in self)
 
 
 class Port:
@@ -37,7 +101,8 @@ class Port:
 		self.name = name
 		self.type = type
 		self.node = node
-		self.connectedPorts = []
+		# Ordered set of the connected ports, constant time membership, insertion and removal
+		self.connections = OrderedDict()
 
 	def getName(self):
 		return self.name
@@ -49,36 +114,82 @@ class Port:
 		return self.node
 
 	def getConnectedPorts(self):
-		return self.connectedPorts
+		return self.connections.keys()
+
+	def getNumConnections(self):
+		return len(self.connections)
+
+	def isConnected(self, port):
+		return port in self.connections
+
+	def link(self, port):
+		'''
+		Connects two ports in the model without any notification, returns
+		False if the ports cannot be or are already connected
+		'''
+		if port.getType() == self.getType() or port.getNode() is self.getNode(): return False
+		if port in self.connections: return False
+
+		self.connections[port] = True
+		port.connections[self] = True
+		return True
+
+	def unlink(self, port):
+		'''
+		Disconnects two ports in the model without any notification
+		'''
+		if port not in self.connections: return False
+
+		del self.connections[port]
+		del port.connections[self]
+		return True
 
 	def connect(self, port):
-		if port.getType == self.getType() or port.getNode().getName() == self.getNode().getName(): return
-		if port in self.connectedPorts: return
+		if not self.link(port): return
+
+		if self.getType() == 'in':
+			connection = (port.getNode().getName(), port.getName(), self.getNode().getName(), self.getName())
+		else:
+			connection = (self.getNode().getName(), self.getName(), port.getNode().getName(), port.getName())
 
-		self.connectedPorts.append(port)
-		port.connectedPorts.append(self)
+		Events.queuePostEvent('port_connectBatch', connections=[connection])
+
+	def disconnect(self, port):
+		if not self.unlink(port): return
 
 		if self.getType() == 'in':
-			nodeFrom, nodeTo = port.getNode().getName(), self.getNode().getName()
-			portIn, portOut = self.getName(), port.getName()
+			connection = (port.getNode().getName(), port.getName(), self.getNode().getName(), self.getName())
 		else:
-			nodeFrom, nodeTo = self.getNode().getName(), port.getNode().getName()
-			portIn, portOut = port.getName(), self.getName()
+			connection = (self.getNode().getName(), self.getName(), port.getNode().getName(), port.getName())
 
-		Events.queuePostEvent('port_connect', nodeFrom=nodeFrom, nodeTo=nodeTo, portIn=portIn, portOut=portOut)
+		Events.queuePostEvent('port_disconnectBatch', connections=[connection])
 
 
 class Node(object):
 	# __metaclass__ = ABCMeta
 
+	# Overridden by the classes in the registry
+	registeredInputPorts = ()
+	registeredOutputPorts = ()
+	registeredParameters = ()
+	registeredParameterMap = {}
+
 	def __init__(self, parent=None):
-		self.parameters = {}
+		# Parameter definitions only this node has (e.g. arrays read from a file)
+		# and values which differ from the defaults, both None until needed
+		self.parameters = None
+		self.overrides = None
+		# Names of the values edited since the parameters were read from their source
+		self.editedParameters = None
 		self.inputPorts = {}
 		self.outputPorts = {}
 
 		self.properties = {}
 		# self.properties.setdefault('position', (0, 0))
 
+		# Called with the node the first time its parameters are needed
+		self.parameterSource = None
+
 	# @abstractproperty
 	# def type(self): return
 	# @abstractproperty
@@ -91,10 +202,6 @@ class Node(object):
 		for portName in self.registeredOutputPorts:
 			self.addOutputPort(portName)
 
-	def addRegisteredParameters(self):
-		for param in self.registeredParameters:
-			self.parameters[param.getName()] = param
-
 	def setName(self, name):
 		self.name = name
 
@@ -107,15 +214,87 @@ class Node(object):
 	def getBaseType(self):
 		return self.baseType
 
-	def setParameter(self, name, type, default, value=None, hints={}):
-		self.parameters[name] = Parameter(name, type, default, value)
+	def setParameterSource(self, source):
+		self.parameterSource = source
+
+	def hasParameterSource(self):
+		'''
+		True until the parameters are first read from their source
+		'''
+		return self.parameterSource is not None
+
+	def __loadParameters(self):
+		source, self.parameterSource = self.parameterSource, None
+		source(self)
+
+	def setParameter(self, name, type, default, value=None, hints={}, edited=True):
+		definition = self.registeredParameterMap.get(name)
+		if definition is None or definition.getType() != type:
+			if self.parameters is None: self.parameters = {}
+			self.parameters[name] = Parameter(name, type, default, hints=hints)
+
+		self.setParameterValue(name, value, edited)
+
+	def getParameterDefinition(self, name):
+		if self.parameters is not None and name in self.parameters: return self.parameters[name]
+		return self.registeredParameterMap.get(name)
+
+	def setParameterValue(self, name, value, edited=True):
+		'''
+		:param edited: False for values read from the node's source, see getEditedParameters
+		'''
+		if edited:
+			# Otherwise reading the source later on would overwrite the edit
+			if self.parameterSource is not None: self.__loadParameters()
+			if self.editedParameters is None: self.editedParameters = set()
+			self.editedParameters.add(name)
+
+		if value is None:
+			if self.overrides: self.overrides.pop(name, None)
+			return
+
+		if self.overrides is None: self.overrides = {}
+		self.overrides[name] = value
+
+	def getParameterValue(self, name):
+		if self.parameterSource is not None: self.__loadParameters()
+		if self.overrides is None: return None
+		return self.overrides.get(name)
+
+	def getOverrides(self):
+		'''
+		Values set on this node, everything else is at its default
+		'''
+		if self.parameterSource is not None: self.__loadParameters()
+		return self.overrides or {}
+
+	def getEditedParameters(self):
+		'''
+		Names of the parameters edited since they were read from the node's source,
+		i.e. the values which would be lost by reading them again
+		'''
+		return frozenset(self.editedParameters or ())
+
+	def clearEditedParameters(self):
+		'''
+		The edits were saved, the values now match the source
+		'''
+		self.editedParameters = None
+
+	def resetParameters(self):
+		self.parameters = None
+		self.overrides = None
+		self.editedParameters = None
 
 	def getParameters(self):
-		return self.parameters
+		if self.parameterSource is not None: self.__loadParameters()
+		return ParameterMap(self)
 
 	def getParameter(self, name):
-		if name not in self.parameters: return None
-		return self.parameters[name]
+		if self.parameterSource is not None: self.__loadParameters()
+		definition = self.getParameterDefinition(name)
+		if definition is None: return None
+		return ParameterView(self, definition)
 
 	def addInputPort(self, name):
 		if name in self.inputPorts: return
@@ -143,107 +322,48 @@ class Node(object):
 	def getOutputPorts(self):
 		return self.outputPorts
 
-	# NOTE: Remove, rename ports
 
 # Node.register(tuple)
 
-def __processParam(parameters, param):
-	paramName = AiParamGetName(param)
-	paramType = AiParamGetType(param)
-	paramTypeName = AiParamGetTypeName(paramType)
-	defaultValue = AiParamGetDefault(param)
-	hints = {}
-
-	if paramType == AI_TYPE_STRING:
-		parameters.append(Parameter(paramName, paramTypeName, str(defaultValue.contents.STR)))
-	elif paramType == AI_TYPE_INT:
-		parameters.append(Parameter(paramName, paramTypeName, int(defaultValue.contents.INT)))
-	elif paramType == AI_TYPE_FLOAT:
-		parameters.append(Parameter(paramName, paramTypeName, float(defaultValue.contents.FLT)))
-	elif paramType == AI_TYPE_BOOLEAN:
-		parameters.append(Parameter(paramName, paramTypeName, bool(defaultValue.contents.BOOL)))
-	elif paramType == AI_TYPE_ENUM:
-		enum = AiParamGetEnum(param)
-		value = str(enum.contents.value)
-
-		# Note: Surely there's a way to get the enum values more efficiently
-		enumOptions = []
-		n = 0
-		while AiEnumGetString(enum, n) is not None:
-			enumOptions.append(AiEnumGetString(enum, n))
-			n += 1
-
-		hints['enum_options'] = enumOptions
-		parameters.append(Parameter(paramName, paramTypeName, value, hints=hints))
+class RegisteredNode(dict):
+	'''
+	Registry entry which only holds the name and base type until the node class,
+	its port lists and parameter definitions are first looked up with ['class']
 
-def __registerNodes():
-	logger.info('Registering Arnold Nodes')
-	registeredNodes = {}
+	:param data: packed entry from RegistryCache
+	'''
 
-	AiBegin()
-	nodeIter = AiUniverseGetNodeEntryIterator(AI_NODE_ALL)
-	while not AiNodeEntryIteratorFinished(nodeIter):
-		node = AiNodeEntryIteratorGetNext(nodeIter)
-		nodeName = AiNodeEntryGetName(node)
-		nodeType = AiNodeEntryGetTypeName(node)
-
-		inputPorts = []
-		outputPorts = []
-		parameters = []
-
-		# Determine the outputs for this node
-		outputType = AiNodeEntryGetOutputType(node)
-		if outputType != AI_TYPE_NONE:
-			outputTypeName = AiParamGetTypeName(outputType)
-			outputPorts.append(outputTypeName)
-		else:
-			if nodeType != 'options':
-				outputPorts.append('out')
-
-		# Determine the inputs for this node.
-		# For non-shader nodes we currently only consider node connections.
-		# Note: Can we connect to any input on a non-shader node in Arnold (e.g. noise)?
-		# For shader nodes we should probably add all the parameters as inputs as
-		# any connected node can procedurally tweak a shader parameter.
-		paramIter = AiNodeEntryGetParamIterator(node)
-		while not AiParamIteratorFinished(paramIter):
-			param = AiParamIteratorGetNext(paramIter)
-			paramName = AiParamGetName(param)
-			paramType = AiParamGetType(param)
-			paramTypeName = AiParamGetTypeName(paramType)
-
-			defaultValue = AiParamGetDefault(param)
-
-			if nodeType == 'shader':
-				if paramType in (AI_TYPE_RGB, AI_TYPE_RGBA, AI_TYPE_FLOAT):
-					inputPorts.append(paramName)
-
-				__processParam(parameters, param)
-			else:
-				if paramType == AI_TYPE_NODE:
-					inputPorts.append(paramName)
-
-				elif paramType == AI_TYPE_ARRAY:
-					paramArray = AiParamGetDefault(param).contents.ARRAY
-					arrayType = AiArrayGetType(paramArray)
-					arrayTypeName = AiParamGetTypeName(arrayType)
-					if arrayType == AI_TYPE_NODE:
-						inputPorts.append(paramName)
-
-				__processParam(parameters, param)
+	def __init__(self, name, baseType, data):
+		super(RegisteredNode, self).__init__(name=name, type=name, baseType=baseType)
+		self.data = data
 
+	def __missing__(self, key):
+		if key != 'class': raise KeyError(key)
+
+		entry = RegistryCache.unpack(self.data)
+		parameters = [Parameter(name, paramType, default, hints=hints) for name, paramType, default, hints in entry['parameters']]
 		classDict = {
-			'name': nodeName, 'type': nodeName, 'baseType': nodeType,
-			'registeredInputPorts': inputPorts, 'registeredOutputPorts': outputPorts,
+			'name': self['name'], 'type': self['name'], 'baseType': self['baseType'],
+			'registeredInputPorts': entry['inputPorts'], 'registeredOutputPorts': entry['outputPorts'],
 			'registeredParameters': parameters
 		}
-		registeredNodes[nodeName] = {
-			'class': type(nodeName, (Node,), classDict),
-			'name': nodeName, 'type': nodeName, 'baseType': nodeType
-		}
+		classDict['registeredParameterMap'] = OrderedDict((param.getName(), param) for param in parameters)
+		nodeClass = self['class'] = type(self['name'], (Node,), classDict)
+		self.data = None
+		return nodeClass
 
-	AiNodeEntryIteratorDestroy(nodeIter)
-	AiEnd()
+def __registerNodes():
+	logger.info('Registering Arnold Nodes')
+	entries, isCurrent = RegistryCache.load()
+	if entries is None:
+		entries = RegistryCache.rebuild()
+	elif not isCurrent:
+		# The cached entries are good enough to start with, see updateRegistry()
+		RegistryCache.refreshInBackground()
+
+	registeredNodes = {}
+	for nodeName, (baseType, data) in entries.iteritems():
+		registeredNodes[nodeName] = RegisteredNode(nodeName, baseType, data)
 
 	return registeredNodes
 
@@ -255,14 +375,13 @@ def createNode(type, name=None, deferred=True, addRegisteredPorts=True):
 		logger.warning('Could not find node %s in registry' % type)
 		return
 
-	node = __registeredNodes[type]['class']()
+	node = getNodeClass(type)()
 	if not name: name = type
 	node.setName(name)
 	__nodes[name] = node
 	Events.queueEvent('node_create', node=node)
 
 	if addRegisteredPorts: node.addRegisteredPorts()
-	node.addRegisteredParameters()
 
 	if not deferred: Events.processEvents()
 	return node
@@ -276,14 +395,85 @@ def getNode(name):
 def getNodes():
 	return __nodes.values()
 
+def deleteNode(name, deferred=True):
+	'''
+	Removes a node and all of its connections from the graph
+	'''
+	node = __nodes.pop(name, None)
+	if node is None: return None
+
+	# Only the node's own connections are visited
+	disconnected = []
+	for portName, input in node.inputPorts.iteritems():
+		for port in input.connections.keys():
+			input.unlink(port)
+			disconnected.append((port.getNode().getName(), port.getName(), name, portName))
+
+	for portName, output in node.outputPorts.iteritems():
+		for port in output.connections.keys():
+			output.unlink(port)
+			disconnected.append((name, portName, port.getNode().getName(), port.getName()))
+
+	# The view drops the noodles before the node item
+	if disconnected:
+		Events.queueEvent('port_disconnectBatch', connections=disconnected)
+	Events.queueEvent('node_delete', name=name)
+
+	if not deferred: Events.processEvents()
+	return node
+
+def renameNode(name, newName, deferred=True):
+	'''
+	Renames a node, its connections are kept as ports refer to nodes rather than names.
+	Returns the new name or None if the node does not exist or newName is taken.
+	'''
+	node = __nodes.get(name)
+	if node is None or not newName: return None
+	if newName == name: return name
+	if newName in __nodes:
+		logger.warning('Cannot rename %s to %s, the name is taken' % (name, newName))
+		return None
+
+	del __nodes[name]
+	node.setName(newName)
+	__nodes[newName] = node
+	Events.queueEvent('node_rename', name=name, newName=newName)
+
+	if not deferred: Events.processEvents()
+	return newName
+
+def getEditedNodes():
+	'''
+	Nodes with parameter values which were edited and not saved yet
+	'''
+	return [node for node in getNodes() if node.editedParameters]
+
 def clearNodes():
 	global __nodes
 	__nodes = {}
 	Events.queueEvent('node_clear')
 
 def getRegisteredNodes():
+	'''
+	Registry entries by node type, the node classes are built on first use
+	'''
 	return __registeredNodes
 
+def getNodeClass(type):
+	if type not in __registeredNodes: return None
+	return __registeredNodes[type]['class']
+
+def updateRegistry(entries):
+	'''
+	Replaces the registered node types, e.g. with a refreshed registry cache.
+	Existing nodes keep the class they were created with.
+	'''
+	__registeredNodes.clear()
+	for nodeName, (baseType, data) in entries.iteritems():
+		__registeredNodes[nodeName] = RegisteredNode(nodeName, baseType, data)
+
+	Events.queueEvent('registry_update')
+
 def getRegisteredNode(name):
 	if name not in __registeredNodes:
 		logger.error('Node %s not registered' % name)
@@ -292,17 +482,75 @@ def getRegisteredNode(name):
 	return __registeredNodes[name]
 
 
-# Note: Not sure about this
-def __portConnect(nodeFrom, nodeTo, portIn, portOut):
-	nodeOut = getNode(nodeFrom)
-	nodeIn = getNode(nodeTo)
+def connectPorts(connections, deferred=True):
+	'''
+	Connects a batch of ports in one pass and notifies listeners once with
+	the connections that were actually made.
+
+	:param connections: iterable of (nodeFrom, portOut, nodeTo, portIn) tuples
+	:return: list of the new connections
+	'''
+	nodes = __nodes
+	connected = []
+	for connection in connections:
+		nodeFrom, portOut, nodeTo, portIn = connection
+		nodeOut = nodes.get(nodeFrom)
+		nodeIn = nodes.get(nodeTo)
+		if nodeOut is None or nodeIn is None: continue
+
+		output = nodeOut.outputPorts.get(portOut)
+		input = nodeIn.inputPorts.get(portIn)
+		if output is None or input is None: continue
+
+		if output.link(input):
+			connected.append(connection)
+
+	if connected:
+		Events.queuePostEvent('port_connectBatch', connections=connected)
+
+	if not deferred: Events.processEvents()
+	return connected
+
 
-	if nodeOut is None: return
-	if nodeIn is None: return
+def disconnectPorts(connections, deferred=True):
+	'''
+	Disconnects a batch of ports and notifies listeners once with the
+	connections that were actually removed.
 
-	input = nodeIn.getInputPort(portIn)
-	output = nodeOut.getOutputPort(portOut)
+	:param connections: iterable of (nodeFrom, portOut, nodeTo, portIn) tuples
+	:return: list of the removed connections
+	'''
+	nodes = __nodes
+	disconnected = []
+	for connection in connections:
+		nodeFrom, portOut, nodeTo, portIn = connection
+		nodeOut = nodes.get(nodeFrom)
+		nodeIn = nodes.get(nodeTo)
+		if nodeOut is None or nodeIn is None: continue
 
-	output.connect(input)
+		output = nodeOut.outputPorts.get(portOut)
+		input = nodeIn.inputPorts.get(portIn)
+		if output is None or input is None: continue
+
+		if output.unlink(input):
+			disconnected.append(connection)
+
+	if disconnected:
+		Events.queuePostEvent('port_disconnectBatch', connections=disconnected)
+
+	if not deferred: Events.processEvents()
+	return disconnected
+
+
+def __portConnect(nodeFrom, nodeTo, portIn, portOut):
+	connectPorts(((nodeFrom, portOut, nodeTo, portIn),))
+
+def __nodeDeleteRequest(names):
+	for name in names:
+		deleteNode(name)
 
 Events.registerHandler(__portConnect, 'port_connect')
+Events.registerHandler(__nodeDeleteRequest, 'node_deleteRequest')
+
+# Single connections made one after the other reach the handlers as one batch
+Events.setCoalesceRule('port_connectBatch', Events.coalesceConnections)
@@ -1,10 +1,21 @@
+import os
 import PySide.QtGui as QtGui
 import PySide.QtCore as QtCore
+from collections import OrderedDict
 
 from NodeGraphics import *
 
 import Events
 import Style
+import StyleCache
+import SpatialIndex
+
+
+# Only the final selection of a burst of selection changes is of interest
+Events.setCoalesceRule('node_select', Events.coalesceLast)
+
+# Only give the nodes near the viewport a NodeItem, see NodegraphView.realizeVisible
+virtualScene = os.environ.get('ASSVIEWER_VIRTUAL_SCENE', '0') not in ('0', 'off', 'false')
 
 
 class NodegraphPanel(QtGui.QFrame):
@@ -23,16 +34,225 @@ class NodegraphPanel(QtGui.QFrame):
 
 
 class NodegraphScene(QtGui.QGraphicsScene):
+	'''
+	Keeps a NodeRecord for every node in a grid index. Node items are only made
+	for the records the view realizes, released items are kept for reuse.
+	'''
+
+	maxPooledItems = 512
+
 	def __init__(self):
 		super(NodegraphScene, self).__init__()
+		self.records = OrderedDict()
+		self.index = SpatialIndex.GridIndex()
+		self.realized = set()
+		self.itemPool = []
+		self.edgeLayer = None
+		self.recordLayer = None
+
+	def reset(self):
+		self.clear()
+		self.records = OrderedDict()
+		self.index = SpatialIndex.GridIndex()
+		self.realized = set()
+		self.itemPool = []
+
+		# All the connections and the nodes without an item are drawn by one item each
+		self.edgeLayer = EdgeLayer(self.sceneRect())
+		self.addItem(self.edgeLayer)
+		self.recordLayer = NodeRecordLayer(self.sceneRect(), self.records, self.index)
+		self.addItem(self.recordLayer)
+
+	def addNode(self, name, type, style, position):
+		record = NodeRecord(name, type, style, position)
+		self.records[name] = record
+		self.index.insert(name, record.getRect())
+		self.recordLayer.updateRecord(record)
+		return record
+
+	def addPorts(self, record, portNames, output=False):
+		ports = record.outputs if output else record.inputs
+		for portName in portNames:
+			if portName not in ports: ports[portName] = OrderedDict()
+
+		if record.item is not None: record.item.setPorts(record.inputs.keys(), record.outputs.keys())
+		self.__updateGeometry(record)
+
+	def deleteNode(self, name):
+		record = self.records.get(name)
+		if record is None: return
+
+		for portOut, connections in record.outputs.iteritems():
+			for nodeTo, portIn in connections.keys():
+				self.disconnectPorts(name, portOut, nodeTo, portIn)
+
+		for portIn, connections in record.inputs.iteritems():
+			for nodeFrom, portOut in connections.keys():
+				self.disconnectPorts(nodeFrom, portOut, name, portIn)
+
+		self.release(record)
+		self.recordLayer.updateRecord(record)
+		self.index.remove(name)
+		del self.records[name]
+
+	def renameNode(self, name, newName):
+		record = self.records.pop(name, None)
+		if record is None: return
+
+		record.name = newName
+		self.records[newName] = record
+		self.index.remove(name)
+		if record.item is not None: record.item.setName(newName)
+
+		# The connected records know this one by name
+		records = self.records
+		for portOut, connections in record.outputs.iteritems():
+			for nodeTo, portIn in connections.keys():
+				target = records.get(newName if nodeTo == name else nodeTo)
+				if target is not None: self.__renameKey(target.inputs[portIn], (name, portOut), (newName, portOut))
+
+		for portIn, connections in record.inputs.iteritems():
+			for nodeFrom, portOut in connections.keys():
+				source = records.get(newName if nodeFrom == name else nodeFrom)
+				if source is not None: self.__renameKey(source.outputs[portOut], (name, portIn), (newName, portIn))
+
+		self.__updateGeometry(record)
+
+	def __renameKey(self, connections, key, newKey):
+		if key in connections: connections[newKey] = connections.pop(key)
+
+	def connectPorts(self, nodeFrom, portOut, nodeTo, portIn):
+		'''
+		:return: False if the nodes or ports do not exist
+		'''
+		recordFrom = self.records.get(nodeFrom)
+		recordTo = self.records.get(nodeTo)
+		if recordFrom is None or recordTo is None: return False
+
+		outputs = recordFrom.outputs.get(portOut)
+		inputs = recordTo.inputs.get(portIn)
+		if outputs is None or inputs is None: return False
+		if (nodeTo, portIn) in outputs: return True
+
+		pointA = recordFrom.getPortCentre(portOut, output=True)
+		pointB = recordTo.getPortCentre(portIn)
+		edgeId = self.edgeLayer.addEdge(pointA, pointB)
+		outputs[(nodeTo, portIn)] = edgeId
+		inputs[(nodeFrom, portOut)] = edgeId
+		return True
+
+	def disconnectPorts(self, nodeFrom, portOut, nodeTo, portIn):
+		recordFrom = self.records.get(nodeFrom)
+		recordTo = self.records.get(nodeTo)
+		if recordFrom is None or recordTo is None: return
+
+		outputs = recordFrom.outputs.get(portOut)
+		inputs = recordTo.inputs.get(portIn)
+		if outputs is None or inputs is None: return
+
+		edgeId = outputs.pop((nodeTo, portIn), None)
+		inputs.pop((nodeFrom, portOut), None)
+		if edgeId is not None: self.edgeLayer.removeEdge(edgeId)
+
+	def moveNode(self, name, position):
+		record = self.records.get(name)
+		if record is None: return
+
+		x, y = position
+		if x == record.x and y == record.y: return
+
+		self.recordLayer.updateRecord(record)
+		record.x, record.y = x, y
+		self.index.move(name, record.getRect())
+		self.recordLayer.updateRecord(record)
+
+		item = record.item
+		if item is not None:
+			pos = item.pos()
+			if pos.x() != x or pos.y() != y: item.setPos(x, y)
+
+		self.__updateEdges(record)
+
+	def nodeItemMoved(self, nodeItem):
+		pos = nodeItem.pos()
+		self.moveNode(nodeItem.getName(), (pos.x(), pos.y()))
+
+	def __updateGeometry(self, record):
+		# The size follows the name and the number of ports, the port centres follow the size
+		self.recordLayer.updateRecord(record)
+		record.updateSize()
+		self.index.insert(record.name, record.getRect())
+		self.recordLayer.updateRecord(record)
+		self.__updateEdges(record)
+
+	def __updateEdges(self, record):
+		edgeLayer = self.edgeLayer
+		offsets = getPortOffsets(record.height, len(record.outputs))
+		for connections, offset in zip(record.outputs.itervalues(), offsets):
+			if not connections: continue
+			centre = QtCore.QPointF(record.x + record.width, record.y + offset)
+			for edgeId in connections.itervalues():
+				edgeLayer.setSource(edgeId, centre)
+
+		offsets = getPortOffsets(record.height, len(record.inputs))
+		for connections, offset in zip(record.inputs.itervalues(), offsets):
+			if not connections: continue
+			centre = QtCore.QPointF(record.x, record.y + offset)
+			for edgeId in connections.itervalues():
+				edgeLayer.setTarget(edgeId, centre)
+
+	def realize(self, record):
+		'''
+		Gives the record a node item, a released one if there is any
+		'''
+		if record.item is not None: return record.item
 
-	def mouseReleaseEvent(self, event):
-		names = []
-		for item in self.selectedItems():
-			nodeName = item.getName()
-			names.append(nodeName)
+		if self.itemPool:
+			nodeItem = self.itemPool.pop()
+			nodeItem.setNode(record.name, record.type, record.inputs.keys(), record.outputs.keys())
+		else:
+			nodeItem = NodeItem(name=record.name, type=record.type)
+			nodeItem.setPorts(record.inputs.keys(), record.outputs.keys())
+
+		nodeItem.setStyle(record.style)
+		nodeItem.setPos(record.x, record.y)
+		self.addItem(nodeItem)
+		nodeItem.setSelected(record.selected)
+
+		record.item = nodeItem
+		self.realized.add(record)
+		self.recordLayer.updateRecord(record)
+		return nodeItem
+
+	def release(self, record):
+		nodeItem = record.item
+		if nodeItem is None: return
+
+		record.selected = nodeItem.isSelected()
+		record.item = None
+		self.realized.discard(record)
+		self.removeItem(nodeItem)
+		if len(self.itemPool) < self.maxPooledItems: self.itemPool.append(nodeItem)
+		self.recordLayer.updateRecord(record)
+
+	def getSelectedNames(self):
+		return [name for name, record in self.records.iteritems() if record.isSelected()]
+
+	def selectRecords(self, names, add=False):
+		'''
+		Selects nodes whether they have an item or not
+		'''
+		names = set(names)
+		for name, record in self.records.iteritems():
+			selected = name in names or (add and record.isSelected())
+			if record.item is not None:
+				record.item.setSelected(selected)
+			elif record.selected != selected:
+				record.selected = selected
+				self.recordLayer.updateRecord(record)
 
-		Events.queueEvent('node_select', names=names)
+	def mouseReleaseEvent(self, event):
+		Events.queueEvent('node_select', names=self.getSelectedNames())
 		Events.processEvents()
 
 		super(NodegraphScene, self).mouseReleaseEvent(event)
@@ -42,12 +262,22 @@ class NodegraphView(QtGui.QGraphicsView):
 	'''
 	QGraphicsView for displaying the nodes
 
+	In virtual mode only the nodes near the viewport have a NodeItem, which are
+	recycled as the view moves, and the rest are drawn as flat rects.
+
 	:param parent: QWidget/QFrame
+	:param virtual: only realize the nodes near the viewport, ASSVIEWER_VIRTUAL_SCENE by default
 	'''
 
-	def __init__(self, parent):
+	# Part of the viewport size around it in which nodes are realized, and kept once realized
+	realizeMargin = 0.5
+	releaseMargin = 1.0
+
+	def __init__(self, parent, virtual=None):
 		super(NodegraphView, self).__init__(parent)
 		self.setObjectName('Node Graph View')
+		self.virtual = virtualScene if virtual is None else virtual
+		self.loading = False
 		self.scene = None
 		self.initUi()
 
@@ -60,25 +290,32 @@ class NodegraphView(QtGui.QGraphicsView):
 			self.scene.setObjectName('Node Graph')
 			self.scene.setSceneRect(0, 0, 32000, 32000)
 			self.setScene(self.scene)
-		else:
-			self.scene.clear()
+
+		self.scene.reset()
+		self.scene.recordLayer.setVisible(self.virtual)
 
 		self.setTransformationAnchor(QtGui.QGraphicsView.AnchorUnderMouse)
 		self.setViewportUpdateMode(QtGui.QGraphicsView.SmartViewportUpdate)
+		# Items set all the painter state they use themselves (pen, brush, font and antialiasing)
+		self.setOptimizationFlags(QtGui.QGraphicsView.DontSavePainterState)
 		self.drag = False
 
 		self.zoomFactor = 1.0
 		self.scaleFactor = 1.0
-		self.nodeMap = {}
+		self.pressPos = None
 
 	def __registerDirtyCallbacks(self):
-		Events.registerHandler(self.__addNode, 'node_create')
-		Events.registerHandler(self.__addInputPort, 'node_addInputPort')
-		Events.registerHandler(self.__addOutputPort, 'node_addOutputPort')
-		Events.registerHandler(self.__portConnect, 'port_connect')
+		Events.registerBatchHandler(self.__addNodes, 'node_create')
+		Events.registerBatchHandler(self.__addInputPorts, 'node_addInputPort')
+		Events.registerBatchHandler(self.__addOutputPorts, 'node_addOutputPort')
+		Events.registerHandler(self.__portConnectBatch, 'port_connectBatch')
+		Events.registerHandler(self.__portDisconnectBatch, 'port_disconnectBatch')
+		Events.registerHandler(self.__deleteNode, 'node_delete')
+		Events.registerHandler(self.__renameNode, 'node_rename')
 		Events.registerHandler(self.__clearNodes, 'node_clear')
 
 	def __clearNodes(self):
+		StyleCache.clearStaticTexts()
 		self.initUi()
 
 	def getCentre(self):
@@ -86,64 +323,143 @@ class NodegraphView(QtGui.QGraphicsView):
 
 	def __addNode(self, node):
 		cx, cy = self.getCentre()
-		nodeItem = NodeItem(name=node.getName(), type=node.getType())
-		nodeItem.setPos(cx - nodeItem.width / 2, cy - nodeItem.height / 2)
-
-		self.scene.addItem(nodeItem)
-		self.nodeMap[node.getName()] = nodeItem
-		nodeBaseType = node.getBaseType()
+		width, height = getNodeSize(node.getName(), node.getType(), 0, 0)
+		style = StyleCache.getNodeStyleForType(node.getBaseType())
+		record = self.scene.addNode(node.getName(), node.getType(), style, (cx - width / 2, cy - height / 2))
+		if not self.virtual: self.scene.realize(record)
+
+	def __deleteNode(self, name):
+		# Edges are normally gone already through port_disconnectBatch
+		self.scene.deleteNode(name)
+
+	def __addNodes(self, events):
+		for args in events:
+			self.__addNode(**args)
+		self.realizeVisible()
+
+	def __groupPorts(self, events):
+		# Ports are laid out once per node rather than once per port
+		portNames = OrderedDict()
+		for args in events:
+			portNames.setdefault(args['node'].getName(), []).append(args['portName'])
+
+		records = self.scene.records
+		for nodeName, names in portNames.iteritems():
+			record = records.get(nodeName)
+			if record is not None: yield record, names
+
+	def __addInputPorts(self, events):
+		for record, portNames in self.__groupPorts(events):
+			self.scene.addPorts(record, portNames)
+
+	def __addOutputPorts(self, events):
+		for record, portNames in self.__groupPorts(events):
+			self.scene.addPorts(record, portNames, output=True)
+
+	def __portConnectBatch(self, connections):
+		scene = self.scene
+		for nodeFrom, portOut, nodeTo, portIn in connections:
+			# TODO: Log connections to nodes or ports which do not exist
+			scene.connectPorts(nodeFrom, portOut, nodeTo, portIn)
+
+	def __portDisconnectBatch(self, connections):
+		scene = self.scene
+		for nodeFrom, portOut, nodeTo, portIn in connections:
+			scene.disconnectPorts(nodeFrom, portOut, nodeTo, portIn)
+
+	def __renameNode(self, name, newName):
+		self.scene.renameNode(name, newName)
+
+	def getNodePositions(self):
+		positions = {}
+		for nodeName, record in self.scene.records.iteritems():
+			positions[nodeName] = (record.x, record.y)
+
+		return positions
+
+	def setNodePositions(self, positions):
+		scene = self.scene
+		for nodeName, position in positions.iteritems():
+			scene.moveNode(nodeName, position)
+		self.realizeVisible()
+
+	def getSelectedNames(self):
+		return self.scene.getSelectedNames()
+
+	def selectNodes(self, names):
+		records = self.scene.records
+		self.scene.selectRecords([nodeName for nodeName in names if nodeName in records], add=True)
+
+	def placeNodes(self, names, spacing=150):
+		'''
+		Puts nodes next to the nodes they are connected to, e.g. after being added by a reload
+		'''
+		scene = self.scene
+		records = scene.records
+		for nodeName in names:
+			record = records.get(nodeName)
+			if record is None: continue
+
+			upstream = [records[source] for connections in record.inputs.itervalues()
+						for source, portOut in connections if source in records]
+			downstream = [records[target] for connections in record.outputs.itervalues()
+						  for target, portIn in connections if target in records]
+			if upstream:
+				x = max(other.x for other in upstream) + spacing
+				y = sum(other.y for other in upstream) / len(upstream)
+			elif downstream:
+				x = min(other.x for other in downstream) - spacing
+				y = sum(other.y for other in downstream) / len(downstream)
+			else:
+				continue
 
-		nodeColours = Style.nodeColours['node']
-		if nodeBaseType in nodeColours:
-			nodeItem.setColour(nodeColours[nodeBaseType])
-		else:
-			nodeItem.setColour(nodeColours['default'])
+			scene.moveNode(nodeName, (x, y))
+		self.realizeVisible()
 
-		nodeFontColours = Style.nodeColours['node_font']
-		if nodeBaseType in nodeFontColours:
-			nodeItem.setFontColour(nodeFontColours[nodeBaseType])
-		else:
-			nodeItem.setFontColour(nodeFontColours['default'])
+	def setLoading(self, loading):
+		'''
+		While a file is loading its nodes all wait in the centre of the scene for the
+		layout, so none are realized until the load is done.
+		'''
+		self.loading = loading
+		if not loading: self.realizeVisible()
 
-	def __addInputPort(self, node, portName):
-		nodeName = node.getName()
-		if nodeName not in self.nodeMap: return
-		self.nodeMap[nodeName].addInputPort(portName)
+	def realizeVisible(self):
+		'''
+		In virtual mode, gives the nodes near the viewport a NodeItem and releases the
+		items of the nodes which are further away. Zoomed out beyond the flat level of
+		detail no node needs an item, the NodeRecordLayer draws them all.
+		'''
+		scene = self.scene
+		if not self.virtual or scene is None or self.loading: return
 
-	def __addOutputPort(self, node, portName):
-		nodeName = node.getName()
-		if nodeName not in self.nodeMap: return
-		self.nodeMap[nodeName].addOutputPort(portName)
+		viewRect = self.mapToScene(self.viewport().rect()).boundingRect()
+		lod = QtGui.QStyleOptionGraphicsItem.levelOfDetailFromTransform(self.transform())
+		flat = lod < Style.levelOfDetail['flat']
+		keepRect = self.__expandRect(viewRect, self.releaseMargin)
 
-	def __portConnect(self, nodeFrom, nodeTo, portIn, portOut):
-		if nodeFrom not in self.nodeMap or nodeTo not in self.nodeMap:
-			# TODO: Log
-			return
+		for record in list(scene.realized):
+			# Selected items stay so dragging moves the whole selection
+			if record.item.isSelected() or scene.mouseGrabberItem() is record.item: continue
+			if flat or not record.intersects(keepRect): scene.release(record)
 
-		nodeItemFrom = self.nodeMap[nodeFrom]
-		nodeItemTo = self.nodeMap[nodeTo]
-		if portOut not in nodeItemFrom.outputs:
-			# TODO: Log
-			return
+		if flat: return
 
-		if portIn not in nodeItemTo.inputs:
-			# TODO: Log
-			return
+		records = scene.records
+		for nodeName in scene.index.query(self.__expandRect(viewRect, self.realizeMargin)):
+			scene.realize(records[nodeName])
 
-		nodeItemFrom.outputs[portOut].connect(nodeItemTo.inputs[portIn])
+	def __expandRect(self, rect, margin):
+		dx, dy = rect.width() * margin, rect.height() * margin
+		return (rect.x() - dx, rect.y() - dy, rect.width() + 2 * dx, rect.height() + 2 * dy)
 
-		# Connect ports with a noodle
-		portItemOut = nodeItemFrom.outputs[portOut]
-		portItemIn = nodeItemTo.inputs[portIn]
+	def scrollContentsBy(self, dx, dy):
+		super(NodegraphView, self).scrollContentsBy(dx, dy)
+		self.realizeVisible()
 
-		pointA, pointB = portItemOut.getCentre(), portItemIn.getCentre()
-		newLine = Noodle(pointA, pointB)
-		newLine.source = portItemOut
-		newLine.target = portItemIn
-		newLine.updatePath()
-		portItemOut.outLines.append(newLine)
-		portItemIn.inLines.append(newLine)
-		self.scene.addItem(newLine)
+	def resizeEvent(self, event):
+		super(NodegraphView, self).resizeEvent(event)
+		self.realizeVisible()
 
 	def wheelEvent(self, event):
 		inFactor = 1.1
@@ -174,6 +490,7 @@ class NodegraphView(QtGui.QGraphicsView):
 		# print delta, dx, dy
 		self.translate(delta.x(), delta.y())
 		# self.centerOn(newPos)
+		self.realizeVisible()
 
 	def __resetScale(self):
 		if self.scaleFactor > 0:
@@ -183,34 +500,35 @@ class NodegraphView(QtGui.QGraphicsView):
 
 		self.scale(self.zoomFactor, self.zoomFactor)
 		self.scaleFactor = 1.0
+		self.realizeVisible()
 
-	def __getUnitedRect(self, selectedItems, padding=60):
-		if not selectedItems:
-			# Check if
-			selectedItems = self.nodeMap.values()
-
-		unitedRegion = QtGui.QPolygonF()
-		for item in selectedItems:
-			unitedRegion = unitedRegion.united(item.getRect())
+	def __getSelectedRecords(self):
+		records = self.scene.records
+		return [records[nodeName] for nodeName in self.scene.getSelectedNames()]
 
-		unitedRect = unitedRegion.boundingRect()
+	def __getUnitedRect(self, records, padding=60):
+		if not records:
+			records = self.scene.records.values()
+		if not records:
+			return QtCore.QRectF(-padding, -padding, 2 * padding, 2 * padding)
 
-		if padding > 0:
-			unitedRect.setX(unitedRect.x() - padding)
-			unitedRect.setWidth(unitedRect.width() + padding)
-			unitedRect.setY(unitedRect.y() - padding)
-			unitedRect.setHeight(unitedRect.height() + padding)
-
-		centre = QtCore.QPoint(unitedRect.x() + unitedRect.width() / 2, unitedRect.y() + unitedRect.height() / 2)
-		return unitedRect
+		left = min(record.x for record in records)
+		top = min(record.y for record in records)
+		right = max(record.x + record.width for record in records)
+		bottom = max(record.y + record.height for record in records)
+		return QtCore.QRectF(left - padding, top - padding, right - left + 2 * padding, bottom - top + 2 * padding)
 
 	def focus(self):
-		unitedRect = self.__getUnitedRect(self.scene.selectedItems())
+		unitedRect = self.__getUnitedRect(self.__getSelectedRecords())
 		self.fitInView(unitedRect, QtCore.Qt.KeepAspectRatio)
+		self.realizeVisible()
 
 	def keyPressEvent(self, event):
 		if event.key() == QtCore.Qt.Key_F:
 			self.focus()
+		elif event.key() in (QtCore.Qt.Key_Delete, QtCore.Qt.Key_Backspace):
+			Events.queueEvent('node_deleteRequest', names=self.getSelectedNames())
+			Events.processEvents()
 
 	def mousePressEvent(self, event):
 		if event.button() == QtCore.Qt.MiddleButton and event.modifiers() == QtCore.Qt.AltModifier:
@@ -220,6 +538,7 @@ class NodegraphView(QtGui.QGraphicsView):
 			self.setCursor(QtCore.Qt.SizeAllCursor)
 		elif event.button() == QtCore.Qt.LeftButton:
 			self.setDragMode(QtGui.QGraphicsView.RubberBandDrag)
+			self.pressPos = event.pos()
 
 		super(NodegraphView, self).mousePressEvent(event)
 
@@ -238,9 +557,27 @@ class NodegraphView(QtGui.QGraphicsView):
 		if self.drag:
 			self.drag = False
 			self.setCursor(QtCore.Qt.ArrowCursor)
+		elif event.button() == QtCore.Qt.LeftButton and self.pressPos is not None:
+			self.__selectRecords(self.pressPos, event)
 
+		self.pressPos = None
 		super(NodegraphView, self).mouseReleaseEvent(event)
 
+	def __selectRecords(self, pressPos, event):
+		'''
+		Nodes drawn by the NodeRecordLayer have no item for the rubber band to select,
+		the records under the band or the click are selected instead
+		'''
+		if not self.virtual or self.scene.recordLayer is None: return
+		lod = QtGui.QStyleOptionGraphicsItem.levelOfDetailFromTransform(self.transform())
+		if lod >= Style.levelOfDetail['flat']: return
+
+		rect = QtCore.QRect(pressPos, event.pos()).normalized()
+		rect.adjust(-2, -2, 2, 2)
+		sceneRect = self.mapToScene(rect).boundingRect()
+		names = self.scene.index.query((sceneRect.x(), sceneRect.y(), sceneRect.width(), sceneRect.height()))
+		self.scene.selectRecords(names, add=bool(event.modifiers() & QtCore.Qt.ControlModifier))
+
 	def _updateBounds(self, bounds, point):
 		if point[0] < bounds[0]:
 			bounds[0] = point[0]
@@ -256,8 +593,8 @@ class NodegraphView(QtGui.QGraphicsView):
 		Get a function to transform (x,y) tuples from startBounds to endBounds
 		'''
 		sx, sy = 1.4, 1.8
-		tx = ((endBounds[0] + endBounds[2]) - (startBounds[0] + startBounds[2])) / 2.0 + 16000
-		ty = ((endBounds[1] + endBounds[3]) - (startBounds[1] + startBounds[3])) / 2.0 + 16000
+		tx = ((endBounds[0] + endBounds[2]) - (startBounds[0] + startBounds[2])) / 2.0
+		ty = ((endBounds[1] + endBounds[3]) - (startBounds[1] + startBounds[3])) / 2.0
 
 		return lambda (x, y): (
 			(x - startBounds[0]) * sx + startBounds[0] + tx,
@@ -271,11 +608,11 @@ class NodegraphView(QtGui.QGraphicsView):
 			raise RuntimeError('You need pygraphviz to use this feature')
 
 		if nodes is None:
-			selectedItems = self.scene.selectedItems()
-			if selectedItems:
-				nodes = selectedItems
+			selectedRecords = self.__getSelectedRecords()
+			if selectedRecords:
+				nodes = selectedRecords
 			else:
-				nodes = self.nodeMap.values()
+				nodes = self.scene.records.values()
 
 		# origBounds = self.__getUnitedRect(nodes)
 		# print origBounds
@@ -287,12 +624,12 @@ class NodegraphView(QtGui.QGraphicsView):
 
 		g = pygraphviz.AGraph(strict=True, directed=True, rankdir='LR', fixedsize=True)
 
-		for nodeItem in nodes:
+		for record in nodes:
 			# pos = Nodegraph.GetNodePosition(n)
-			pos = nodeItem.getPosition()
+			pos = (record.x, record.y)
 			self._updateBounds(nodeGraphBounds, pos)
 
-			nodeName = nodeItem.getName()
+			nodeName = record.name
 			# g.node_attr.update(height=nodeItem.rect.height() / 100)
 			g.add_node(nodeName)
 			# n = g.get_node(nodeName)
@@ -301,19 +638,19 @@ class NodegraphView(QtGui.QGraphicsView):
 			# n.attr['height'] = nodeItem.rect.height() / 100.
 			# print g.node_attr.keys()
 
-			for inPort in nodeItem.getInputPorts():
-				for port in inPort.getConnectedPorts():
-					g.add_edge(port.getNode().getName(), nodeName)
+			for connections in record.inputs.itervalues():
+				for source, portOut in connections:
+					g.add_edge(source, nodeName)
 
-			for outPort in nodeItem.getOutputPorts():
-				for port in outPort.getConnectedPorts():
-					g.add_edge(nodeName, port.getNode().getName())
+			for connections in record.outputs.itervalues():
+				for target, portIn in connections:
+					g.add_edge(nodeName, target)
 
 		g.layout(prog='dot', args='-Nfontname="%s"' % fontName)
 
 		positions = dict()
 		for node in nodes:
-			name = node.getName()
+			name = node.name
 			graphNode = g.get_node(name)
 			posAttr = graphNode.attr['pos']
 			position = map(float, posAttr.split(','))
@@ -324,10 +661,9 @@ class NodegraphView(QtGui.QGraphicsView):
 		rescale = self._getTransformFunction(graphVizBounds, nodeGraphBounds)
 
 		for node in nodes:
-			name = node.getName()
+			name = node.name
 			# NodegraphAPI.SetNodePosition(n, rescale(positions[name]))
-			node.setPosition(rescale(positions[name]))
+			self.scene.moveNode(name, rescale(positions[name]))
 			# node.setPosition(positions[name])
-			node.updatePortsAndNoodles()
 
 		self.focus()
@@ -1,8 +1,10 @@
+import functools
 import PySide.QtGui as QtGui
 import PySide.QtCore as QtCore
 
 import Events
 import Nodegraph
+import AssArray
 
 
 # class ParameterPanel(QtGui.QWidget):
@@ -26,7 +28,10 @@ class ParameterPanel(QtGui.QFrame):
 		self.__panelScrollArea = PanelScrollArea(self)
 		self.layout().addWidget(self.__panelScrollArea, 10)
 
-		Events.registerHandler(self.__selectNode, 'node_select')
+		Events.registerBatchHandler(self.__selectNodes, 'node_select')
+
+	def __selectNodes(self, events):
+		self.__selectNode(**events[-1])
 
 	def __selectNode(self, names):
 		self.__panelScrollArea.initialise()
@@ -63,6 +68,12 @@ class PanelScrollArea(QtGui.QScrollArea):
 		self.gridLayout.setAlignment(QtCore.Qt.AlignTop)
 		self.scrollParent.setLayout(self.gridLayout)
 
+	def __renameNode(self, node, qNameText):
+		newName = str(qNameText.text()).strip()
+		if newName == node.getName(): return
+		if Nodegraph.renameNode(node.getName(), newName, deferred=False) is None:
+			qNameText.setText(node.getName())
+
 	def addParameters(self, node):
 		# Our preference is to add the type and name at the top (and ignore these parameters below)
 		qTypeLabel = QtGui.QLabel('type')
@@ -80,6 +91,7 @@ class PanelScrollArea(QtGui.QScrollArea):
 		qNameText = QtGui.QLineEdit(node.getName())
 		self.gridLayout.addWidget(qNameLabel, 2, 0)
 		self.gridLayout.addWidget(qNameText, 2, 1)
+		qNameText.editingFinished.connect(lambda: self.__renameNode(node, qNameText))
 
 		parameters = node.getParameters()
 		for paramName, param in parameters.iteritems():
@@ -116,15 +128,29 @@ class PanelScrollArea(QtGui.QScrollArea):
 
 				if value is not None:
 					qEdit.setCurrentIndex(value if isinstance(value, int) else enum_options.index(value))
+			elif type == 'ARRAY' and value is not None:
+				# Only the header is known until the user asks for the values
+				qEdit = QtGui.QPushButton(str(value))
+				qEdit.setToolTip('%d bytes, click for min/max' % value.getNumBytes())
+				qEdit.clicked.connect(functools.partial(self.__showArrayStats, qEdit, value))
 
 			if qEdit is not None:
 				qEdit.setFont(QtGui.QFont('tahoma', 10, QtGui.QFont.Normal, 0))
-				qEdit.setStyleSheet('color: white')
+				# Values left at the type's default are dimmed
+				qEdit.setStyleSheet('color: white' if param.isOverridden() else 'color: gray')
 
 				numRows = self.gridLayout.rowCount()
 				self.gridLayout.addWidget(qLabel, numRows, 0)
 				self.gridLayout.addWidget(qEdit, numRows, 1)
 
+	def __showArrayStats(self, button, handle):
+		try:
+			stats = handle.getStats()
+		except AssArray.StaleFileError:
+			button.setText('%s  changed on disk, reload to read it' % handle)
+			return
+		button.setText('%s  min %s  max %s' % (handle, stats['min'], stats['max']))
+
 
 class QSelect(QtGui.QComboBox):
 	'''Qselect is like a QComboBox, but has correct mouse wheel behaviour (only responds to wheel when it has focus).'''
@@ -0,0 +1,258 @@
+import os
+import sys
+import zlib
+import errno
+import hashlib
+import subprocess
+import cPickle as pickle
+
+from arnold import *
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+# Bump when the layout of the node entries changes
+version = 2
+
+cacheDir = os.environ.get('ASSVIEWER_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'AssViewer'))
+cacheFile = os.path.join(cacheDir, 'registry.cache')
+enabled = os.environ.get('ASSVIEWER_REGISTRY_CACHE', '1') not in ('0', 'off', 'false')
+
+_refresh = None
+
+
+def __processParam(parameters, param):
+	paramName = AiParamGetName(param)
+	paramType = AiParamGetType(param)
+	paramTypeName = AiParamGetTypeName(paramType)
+	defaultValue = AiParamGetDefault(param)
+	hints = {}
+
+	if paramType == AI_TYPE_STRING:
+		parameters.append((paramName, paramTypeName, str(defaultValue.contents.STR), hints))
+	elif paramType == AI_TYPE_INT:
+		parameters.append((paramName, paramTypeName, int(defaultValue.contents.INT), hints))
+	elif paramType == AI_TYPE_FLOAT:
+		parameters.append((paramName, paramTypeName, float(defaultValue.contents.FLT), hints))
+	elif paramType == AI_TYPE_BOOLEAN:
+		parameters.append((paramName, paramTypeName, bool(defaultValue.contents.BOOL), hints))
+	elif paramType == AI_TYPE_ENUM:
+		enum = AiParamGetEnum(param)
+		value = str(enum.contents.value)
+
+		# Note: Surely there's a way to get the enum values more efficiently
+		enumOptions = []
+		n = 0
+		while AiEnumGetString(enum, n) is not None:
+			enumOptions.append(AiEnumGetString(enum, n))
+			n += 1
+
+		hints['enum_options'] = enumOptions
+		parameters.append((paramName, paramTypeName, value, hints))
+
+
+def readNodeEntries():
+	'''
+	Walks every node entry Arnold knows about in a temporary universe.
+
+	:return: dict of node entry name to a dict of plain, picklable data
+	         (name, baseType, inputPorts, outputPorts and (name, type, default, hints) parameters)
+	'''
+	logger.info('Reading Arnold node entries')
+	entries = {}
+
+	AiBegin()
+	nodeIter = AiUniverseGetNodeEntryIterator(AI_NODE_ALL)
+	while not AiNodeEntryIteratorFinished(nodeIter):
+		node = AiNodeEntryIteratorGetNext(nodeIter)
+		nodeName = AiNodeEntryGetName(node)
+		nodeType = AiNodeEntryGetTypeName(node)
+
+		inputPorts = []
+		outputPorts = []
+		parameters = []
+
+		# Determine the outputs for this node
+		outputType = AiNodeEntryGetOutputType(node)
+		if outputType != AI_TYPE_NONE:
+			outputTypeName = AiParamGetTypeName(outputType)
+			outputPorts.append(outputTypeName)
+		else:
+			if nodeType != 'options':
+				outputPorts.append('out')
+
+		# Determine the inputs for this node.
+		# For non-shader nodes we currently only consider node connections.
+		# Note: Can we connect to any input on a non-shader node in Arnold (e.g. noise)?
+		# For shader nodes we should probably add all the parameters as inputs as
+		# any connected node can procedurally tweak a shader parameter.
+		paramIter = AiNodeEntryGetParamIterator(node)
+		while not AiParamIteratorFinished(paramIter):
+			param = AiParamIteratorGetNext(paramIter)
+			paramName = AiParamGetName(param)
+			paramType = AiParamGetType(param)
+
+			if nodeType == 'shader':
+				if paramType in (AI_TYPE_RGB, AI_TYPE_RGBA, AI_TYPE_FLOAT):
+					inputPorts.append(paramName)
+
+				__processParam(parameters, param)
+			else:
+				if paramType == AI_TYPE_NODE:
+					inputPorts.append(paramName)
+
+				elif paramType == AI_TYPE_ARRAY:
+					paramArray = AiParamGetDefault(param).contents.ARRAY
+					arrayType = AiArrayGetType(paramArray)
+					if arrayType == AI_TYPE_NODE:
+						inputPorts.append(paramName)
+
+				__processParam(parameters, param)
+
+		entries[nodeName] = {
+			'name': nodeName, 'baseType': nodeType,
+			'inputPorts': inputPorts, 'outputPorts': outputPorts,
+			'parameters': parameters
+		}
+
+	AiNodeEntryIteratorDestroy(nodeIter)
+	AiEnd()
+
+	return entries
+
+
+def pack(entries):
+	'''
+	Pickles each entry on its own so loading the registry only materialises
+	the names and base types, see unpack()
+
+	:return: dict of node entry name to (baseType, data)
+	'''
+	packed = {}
+	for nodeName, entry in entries.iteritems():
+		packed[nodeName] = (entry['baseType'], pickle.dumps(entry, pickle.HIGHEST_PROTOCOL))
+
+	return packed
+
+
+def unpack(data):
+	return pickle.loads(data)
+
+
+def getKey():
+	'''
+	Identifies the installed node entries by the Arnold version and the
+	names, sizes and mtimes of everything on ARNOLD_PLUGIN_PATH
+	'''
+	digest = hashlib.sha1()
+	digest.update('%d|%s|%s' % (version, AiGetVersion(None, None, None, None), sys.platform))
+
+	pluginPath = os.environ.get('ARNOLD_PLUGIN_PATH', '')
+	digest.update(pluginPath)
+	for directory in pluginPath.split(os.pathsep):
+		if not directory: continue
+		try:
+			names = sorted(os.listdir(directory))
+		except OSError:
+			continue
+
+		for name in names:
+			try:
+				stat = os.stat(os.path.join(directory, name))
+			except OSError:
+				continue
+			digest.update('%s|%s|%d|%r' % (directory, name, stat.st_size, stat.st_mtime))
+
+	return digest.hexdigest()
+
+
+def load():
+	'''
+	:return: (entries, isCurrent) from the cache, entries is None if there is no usable cache
+	         and otherwise packed, see pack()
+	'''
+	if not enabled: return None, False
+	try:
+		with open(cacheFile, 'rb') as f:
+			registry = pickle.loads(zlib.decompress(f.read()))
+	except (IOError, OSError):
+		return None, False
+	except Exception:
+		logger.warning('Discarding unreadable registry cache %s' % cacheFile)
+		return None, False
+
+	if registry.get('version') != version: return None, False
+	return registry['entries'], registry.get('key') == getKey()
+
+
+def store(entries, key=None):
+	'''
+	:param entries: packed entries, see pack()
+	'''
+	if not enabled: return
+	if key is None: key = getKey()
+
+	try:
+		os.makedirs(cacheDir)
+	except OSError as e:
+		if e.errno != errno.EEXIST:
+			logger.warning('Could not create registry cache directory %s' % cacheDir)
+			return
+
+	registry = {'version': version, 'key': key, 'entries': entries}
+	tempPath = '%s.%d.tmp' % (cacheFile, os.getpid())
+	try:
+		with open(tempPath, 'wb') as f:
+			f.write(zlib.compress(pickle.dumps(registry, pickle.HIGHEST_PROTOCOL), 1))
+		os.rename(tempPath, cacheFile)
+	except (IOError, OSError):
+		logger.warning('Could not write registry cache %s' % cacheFile)
+		if os.path.exists(tempPath): os.remove(tempPath)
+
+
+def rebuild():
+	'''
+	:return: the packed entries read from Arnold
+	'''
+	key = getKey()
+	entries = pack(readNodeEntries())
+	store(entries, key)
+	return entries
+
+
+def refreshInBackground():
+	'''
+	Rebuilds the cache in a separate process, which needs its own Arnold
+	universe and so cannot run on a thread next to an open session
+	'''
+	global _refresh
+	if _refresh is not None or not enabled: return
+	module = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+	_refresh = subprocess.Popen([sys.executable, module, '--rebuild'])
+
+
+def pollRefresh():
+	'''
+	:return: the rebuilt entries once a background refresh has finished, otherwise None
+	'''
+	global _refresh
+	if _refresh is None or _refresh.poll() is None: return None
+
+	returnCode, _refresh = _refresh.returncode, None
+	if returnCode != 0:
+		logger.warning('Refreshing the registry cache failed (%d)' % returnCode)
+		return None
+
+	entries, isCurrent = load()
+	return entries
+
+
+def isRefreshing():
+	return _refresh is not None
+
+
+if __name__ == '__main__':
+	if '--rebuild' in sys.argv[1:]:
+		rebuild()
@@ -0,0 +1,168 @@
+import os
+import zlib
+import errno
+import hashlib
+import cPickle as pickle
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+# Bump when the layout of a cache entry or the meaning of its fields changes
+version = 3
+
+cacheDir = os.environ.get('ASSVIEWER_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'AssViewer', 'scenes'))
+maxCacheSize = int(os.environ.get('ASSVIEWER_CACHE_SIZE_MB', 1024)) << 20
+enabled = os.environ.get('ASSVIEWER_CACHE', '1') not in ('0', 'off', 'false')
+
+_sampleSize = 1 << 16
+_numSamples = 8
+
+
+def setEnabled(state):
+	global enabled
+	enabled = bool(state)
+
+
+def isEnabled():
+	return enabled
+
+
+def fastHash(filename, size):
+	'''
+	Hashes the head, tail and a few evenly spaced samples of a file, which is
+	enough to tell exported scenes apart without reading gigabytes.
+	'''
+	digest = hashlib.sha1()
+	with open(filename, 'rb') as f:
+		offsets = set([0, max(0, size - _sampleSize)])
+		offsets.update(size * i // (_numSamples + 1) for i in range(1, _numSamples + 1))
+		for offset in sorted(offsets):
+			f.seek(offset)
+			digest.update(f.read(_sampleSize))
+
+	return digest.hexdigest()
+
+
+def getKey(filename, preview=False):
+	filename = os.path.abspath(filename)
+	try:
+		stat = os.stat(filename)
+	except OSError:
+		return None
+
+	identity = '%s|%d|%r|%s|%d|%d' % (filename, stat.st_size, stat.st_mtime, fastHash(filename, stat.st_size), preview, version)
+	return hashlib.sha1(identity).hexdigest()
+
+
+def _entryPath(key):
+	return os.path.join(cacheDir, key + '.scene')
+
+
+def load(filename, preview=False):
+	'''
+	Returns the cached scene for an unchanged file or None
+	'''
+	if not enabled: return None
+	key = getKey(filename, preview)
+	if key is None: return None
+
+	path = _entryPath(key)
+	try:
+		with open(path, 'rb') as f:
+			scene = pickle.loads(zlib.decompress(f.read()))
+	except (IOError, OSError):
+		return None
+	except Exception:
+		logger.warning('Discarding unreadable scene cache entry %s' % path)
+		_remove(path)
+		return None
+
+	if scene.get('version') != version: return None
+
+	# Touch the entry so eviction is least recently used
+	try:
+		os.utime(path, None)
+	except OSError:
+		pass
+
+	return scene
+
+
+def store(filename, records, positions, preview=False):
+	'''
+	Caches the node table of a file together with the node positions
+
+	:param records: list of (name, type, start, end, references, checksum) tuples
+	:param positions: dict of node name to (x, y)
+	'''
+	if not enabled: return
+	key = getKey(filename, preview)
+	if key is None: return
+
+	try:
+		os.makedirs(cacheDir)
+	except OSError as e:
+		if e.errno != errno.EEXIST:
+			logger.warning('Could not create scene cache directory %s' % cacheDir)
+			return
+
+	scene = {'version': version, 'filename': os.path.abspath(filename), 'records': records, 'positions': positions}
+	data = zlib.compress(pickle.dumps(scene, pickle.HIGHEST_PROTOCOL), 1)
+
+	path = _entryPath(key)
+	tempPath = '%s.%d.tmp' % (path, os.getpid())
+	try:
+		with open(tempPath, 'wb') as f:
+			f.write(data)
+		os.rename(tempPath, path)
+	except (IOError, OSError):
+		logger.warning('Could not write scene cache entry %s' % path)
+		_remove(tempPath)
+		return
+
+	evict()
+
+
+def _remove(path):
+	try:
+		os.remove(path)
+	except OSError:
+		pass
+
+
+def _entries():
+	try:
+		names = os.listdir(cacheDir)
+	except OSError:
+		return []
+
+	entries = []
+	for name in names:
+		if not name.endswith('.scene'): continue
+		path = os.path.join(cacheDir, name)
+		try:
+			stat = os.stat(path)
+		except OSError:
+			continue
+		entries.append((stat.st_mtime, stat.st_size, path))
+
+	return entries
+
+
+def evict(limit=None):
+	'''
+	Removes the least recently used entries until the cache fits in the limit
+	'''
+	if limit is None: limit = maxCacheSize
+	entries = sorted(_entries())
+	totalSize = sum(size for _, size, _ in entries)
+	for _, size, path in entries:
+		if totalSize <= limit: break
+		_remove(path)
+		totalSize -= size
+
+
+def clear():
+	evict(0)
@@ -0,0 +1,171 @@
+import AssParser
+import Nodegraph
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+class SceneDiff(object):
+	'''
+	Node level difference between two indexed versions of a scene. A node whose
+	type changed is treated as removed and added again.
+	'''
+
+	def __init__(self, added, removed, changed):
+		self.added = added
+		self.removed = removed
+		self.changed = changed
+
+	def isEmpty(self):
+		return not (self.added or self.removed or self.changed)
+
+	def __str__(self):
+		return '%d added, %d removed, %d changed' % (len(self.added), len(self.removed), len(self.changed))
+
+
+def diffIndices(oldIndex, newIndex):
+	'''
+	Compares two AssIndexes by block checksum, neither file is parsed again
+	'''
+	added, removed, changed = [], [], []
+	for name, entry in newIndex.entries.iteritems():
+		oldEntry = oldIndex.getEntry(name)
+		if oldEntry is None:
+			added.append(name)
+		elif oldEntry.type != entry.type:
+			removed.append(name)
+			added.append(name)
+		elif oldEntry.checksum is None or oldEntry.checksum != entry.checksum:
+			changed.append(name)
+
+	removed.extend(name for name in oldIndex.entries if name not in newIndex.entries)
+	return SceneDiff(added, removed, changed)
+
+
+def getInputConnections(node):
+	connections = set()
+	nodeName = node.getName()
+	for portName, input in node.getInputPorts().iteritems():
+		for port in input.getConnectedPorts():
+			connections.add((port.getNode().getName(), port.getName(), nodeName, portName))
+
+	return connections
+
+
+def getSourcedNodes():
+	'''
+	:return: dict of the name a node has in its source file to the node, which
+	         differs from the node name once a node has been renamed
+	'''
+	nodes = {}
+	for node in Nodegraph.getNodes():
+		sourceName = node.properties.get('sourceName')
+		if sourceName is not None: nodes[sourceName] = node
+
+	return nodes
+
+
+def reloadEditedNode(node, index, name):
+	'''
+	Reads the parameters of a changed node from the new file, except for the
+	values which were edited in the graph
+	'''
+	edited = node.getEditedParameters()
+	logger.warning('Keeping the edited parameters %s of %s over the changed file' % (', '.join(sorted(edited)), node.getName()))
+	overrides = node.getOverrides()
+	edits = [(paramName, node.getParameterDefinition(paramName), overrides.get(paramName)) for paramName in edited]
+
+	node.resetParameters()
+	index.attach(node, name)
+	# Read right away so the edits go on top of the new values
+	node.getOverrides()
+	for paramName, definition, value in edits:
+		# Parameters declared in the file may be gone from it
+		if definition is not None and node.getParameterDefinition(paramName) is None:
+			node.setParameter(paramName, definition.getType(), definition.getDefault(), hints=definition.getHints(), edited=False)
+		node.setParameterValue(paramName, value)
+
+
+def applyDiff(diff, index, newIndex, preview=False, store=None):
+	'''
+	Brings the graph from the scene in index to the scene in newIndex, touching
+	only the nodes and links in the diff. The index is updated in place so the
+	parameter sources of untouched nodes stay bound to it. Nodes renamed in the
+	graph are matched to the file by their source name and keep their new name,
+	edited parameter values are kept as well.
+
+	:return: names of the nodes which were created
+	'''
+	nodes = getSourcedNodes()
+	for name in diff.removed:
+		node = nodes.pop(name, None)
+		if node is not None: Nodegraph.deleteNode(node.getName())
+
+	index.update(newIndex)
+
+	# Parameters are re-read lazily from the new file, nothing is parsed here
+	changed = set(diff.changed)
+	for name in diff.changed:
+		node = nodes.get(name)
+		if node is None: continue
+		if node.getEditedParameters():
+			reloadEditedNode(node, index, name)
+		else:
+			node.resetParameters()
+			index.attach(node, name)
+
+	for name, node in nodes.iteritems():
+		if node.parameterSource is None and name in index and name not in changed:
+			# Same block at new offsets, only the array handles into the old file must not outlive it
+			index.rebind(node, name)
+
+	builder = AssParser.SceneBuilder(preview, index, store)
+	created = []
+	for name in diff.added:
+		if Nodegraph.getNode(name) is not None:
+			logger.warning('Node %s already exists and is not replaced' % name)
+			continue
+
+		node = builder.addNode(index.getEntry(name), indexed=True)
+		if node is not None:
+			nodes[name] = node
+			created.append(name)
+
+	# Links are rebuilt for new and changed nodes and for nodes pointing at new ones
+	relink = set(diff.changed)
+	relink.update(created)
+	if created:
+		createdSet = set(created)
+		for entry in index.getEntries():
+			for paramName, name in entry.getReferences():
+				if name in createdSet or name.rsplit('.', 1)[0] in createdSet:
+					relink.add(entry.name)
+					break
+
+	nodeTypes = dict((entry.name, entry.type) for entry in index.getEntries())
+	references = []
+	for name in relink:
+		entry = index.getEntry(name)
+		references.extend((name, paramName, referencedName) for paramName, referencedName in entry.getReferences())
+
+	# Connections are resolved against the file, then mapped to the current node names
+	wanted = set()
+	for nodeFrom, portOut, nodeTo, portIn in AssParser.resolveReferences(references, nodeTypes):
+		if nodeFrom in nodes: nodeFrom = nodes[nodeFrom].getName()
+		if nodeTo in nodes: nodeTo = nodes[nodeTo].getName()
+		wanted.add((nodeFrom, portOut, nodeTo, portIn))
+
+	current = set()
+	for name in relink:
+		node = nodes.get(name)
+		if node is not None: current.update(getInputConnections(node))
+
+	Nodegraph.disconnectPorts(current - wanted)
+
+	connections = wanted - current
+	for nodeFrom, portOut, nodeTo, portIn in connections:
+		Nodegraph.getNode(nodeTo).addInputPort(portIn)
+	Nodegraph.connectPorts(connections)
+
+	return created
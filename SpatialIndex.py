@@ -0,0 +1,86 @@
+import math
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+class GridIndex(object):
+	'''
+	Buckets (x, y, width, height) rects into the cells of a uniform grid they
+	overlap, so finding the rects near the viewport only looks at the cells it covers.
+
+	:param cellSize: width and height of a cell, a few times the size of a typical rect
+	'''
+
+	def __init__(self, cellSize=256.0):
+		self.cellSize = float(cellSize)
+		self.cells = {}
+		self.rects = {}
+
+	def __getCells(self, rect):
+		x, y, width, height = rect
+		cellSize = self.cellSize
+		left, top = int(math.floor(x / cellSize)), int(math.floor(y / cellSize))
+		right, bottom = int(math.floor((x + width) / cellSize)), int(math.floor((y + height) / cellSize))
+		return [(column, row) for column in xrange(left, right + 1) for row in xrange(top, bottom + 1)]
+
+	def insert(self, key, rect):
+		if key in self.rects: self.remove(key)
+
+		self.rects[key] = rect
+		cells = self.cells
+		for cell in self.__getCells(rect):
+			keys = cells.get(cell)
+			if keys is None: keys = cells[cell] = set()
+			keys.add(key)
+
+	def remove(self, key):
+		rect = self.rects.pop(key, None)
+		if rect is None: return
+
+		cells = self.cells
+		for cell in self.__getCells(rect):
+			keys = cells.get(cell)
+			if keys is None: continue
+			keys.discard(key)
+			if not keys: del cells[cell]
+
+	def move(self, key, rect):
+		oldRect = self.rects.get(key)
+		if oldRect is not None and self.__getCells(oldRect) == self.__getCells(rect):
+			# Still in the same cells, which is the common case while dragging
+			self.rects[key] = rect
+			return
+
+		self.insert(key, rect)
+
+	def getRect(self, key):
+		return self.rects.get(key)
+
+	def query(self, rect):
+		'''
+		:return: set of the keys whose rects intersect rect
+		'''
+		x, y, width, height = rect
+		right, bottom = x + width, y + height
+		rects = self.rects
+		cells = self.cells
+
+		found = set()
+		for cell in self.__getCells(rect):
+			keys = cells.get(cell)
+			if not keys: continue
+			for key in keys:
+				if key in found: continue
+				keyX, keyY, keyWidth, keyHeight = rects[key]
+				if keyX < right and x < keyX + keyWidth and keyY < bottom and y < keyY + keyHeight:
+					found.add(key)
+
+		return found
+
+	def __len__(self):
+		return len(self.rects)
+
+	def __contains__(self, key):
+		return key in self.rects
@@ -508,3 +508,11 @@ nodeColours = {
 		'filter': (230, 230, 230, 255)
 	}
 }
+
+# Zoom levels (QStyleOptionGraphicsItem.levelOfDetailFromTransform) at which the graph is drawn with less detail:
+# below 'flat' nodes are plain rects without labels, ports or curved noodles,
+# below 'full' nodes are drawn with their label but without ports
+levelOfDetail = {
+	'flat': 0.3,
+	'full': 0.7
+}
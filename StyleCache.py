@@ -0,0 +1,136 @@
+import PySide.QtGui as QtGui
+import PySide.QtCore as QtCore
+from collections import OrderedDict
+
+import Style
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+# Pens, brushes, fonts and labels shared by all the graphics items. They are
+# made the first time they are asked for (a QApplication must exist by then)
+# and must not be modified by the items.
+__pens = {}
+__brushes = {}
+__fonts = {}
+__staticTexts = OrderedDict()
+__maxStaticTexts = 1024
+__nodeStyles = {}
+
+
+def getColour(colour):
+	return QtGui.QColor(colour[0], colour[1], colour[2], colour[3])
+
+
+def getPen(colour, width=1):
+	key = (colour, width)
+	pen = __pens.get(key)
+	if pen is None:
+		pen = __pens[key] = QtGui.QPen()
+		pen.setStyle(QtCore.Qt.SolidLine)
+		pen.setWidth(width)
+		pen.setColor(getColour(colour))
+	return pen
+
+
+def getBrush(colour):
+	brush = __brushes.get(colour)
+	if brush is None:
+		brush = __brushes[colour] = QtGui.QBrush()
+		brush.setStyle(QtCore.Qt.SolidPattern)
+		brush.setColor(getColour(colour))
+	return brush
+
+
+def getFont(family='monospace', pixelSize=None):
+	key = (family, pixelSize)
+	font = __fonts.get(key)
+	if font is None:
+		font = __fonts[key] = QtGui.QFont(family)
+		if pixelSize is not None: font.setPixelSize(pixelSize)
+	return font
+
+
+def createStaticText(text, font):
+	'''
+	:return: new QStaticText laid out for the font, e.g. for a node name
+	'''
+	staticText = QtGui.QStaticText(text)
+	staticText.setTextFormat(QtCore.Qt.PlainText)
+	staticText.prepare(QtGui.QTransform(), font)
+	return staticText
+
+
+def getStaticText(text, font):
+	'''
+	Shared QStaticText for labels which repeat across nodes, e.g. port names.
+	Only the most recently used ones are kept.
+	'''
+	key = (text, font.key())
+	staticText = __staticTexts.pop(key, None)
+	if staticText is None:
+		staticText = createStaticText(text, font)
+		if len(__staticTexts) >= __maxStaticTexts: __staticTexts.popitem(last=False)
+	__staticTexts[key] = staticText
+	return staticText
+
+
+def clearStaticTexts():
+	__staticTexts.clear()
+
+
+class NodeStyle(object):
+	'''
+	What a node of one colour scheme is painted with
+	'''
+
+	__slots__ = ('brush', 'colour', 'pen', 'selectedPen', 'selectedColour', 'textPen', 'font')
+
+	def __init__(self, colour, fontColour):
+		self.brush = getBrush(colour)
+		self.colour = self.brush.color()
+		self.pen = getPen((60, 60, 60, 255))
+		self.selectedPen = getPen((255, 255, 0, 255))
+		self.selectedColour = self.selectedPen.color()
+		self.textPen = getPen(fontColour)
+		self.font = getFont('monospace')
+
+
+def getNodeStyle(colour, fontColour):
+	key = (colour, fontColour)
+	nodeStyle = __nodeStyles.get(key)
+	if nodeStyle is None: nodeStyle = __nodeStyles[key] = NodeStyle(colour, fontColour)
+	return nodeStyle
+
+
+def getNodeStyleForType(baseType):
+	nodeColours = Style.nodeColours['node']
+	nodeFontColours = Style.nodeColours['node_font']
+	return getNodeStyle(nodeColours.get(baseType, nodeColours['default']),
+						nodeFontColours.get(baseType, nodeFontColours['default']))
+
+
+class PortStyle(object):
+	__slots__ = ('brush', 'pen', 'highlightPen', 'labelPen', 'labelFont', 'highlightLabelFont')
+
+	def __init__(self):
+		self.brush = getBrush((70, 70, 70, 255))
+		self.pen = getPen((50, 50, 50, 255))
+		self.highlightPen = getPen((255, 255, 0, 255))
+		self.labelPen = getPen((200, 200, 200, 255))
+		self.labelFont = getFont('monospace', 6)
+		self.highlightLabelFont = getFont('monospace', 10)
+
+
+__portStyle = []
+
+
+def getPortStyle():
+	if not __portStyle: __portStyle.append(PortStyle())
+	return __portStyle[0]
+
+
+def getNoodlePen():
+	return getPen((150, 150, 150, 255), 2)